@@ -0,0 +1,335 @@
+# Precomputed marker clusters per zoom level, maintained incrementally from photos changes
+import math
+import logging
+
+from marker_queries import bbox_condition, build_marker_filters, has_dedup_index, has_spatial_index, marker_query_sql
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_MIN_ZOOM = 0
+CLUSTER_MAX_ZOOM = 18
+
+# Cells per 256px tile side, as a power of two (2 -> 4x4 cells of 64px, close to markercluster's radius)
+CELLS_PER_TILE_SHIFT = 2
+
+# Cell coordinates at the finest level; coarser levels are right shifts of these
+_FINEST_SHIFT = CLUSTER_MAX_ZOOM + CELLS_PER_TILE_SHIFT
+_FINEST_CELLS = 1 << _FINEST_SHIFT
+
+# Web Mercator latitude limit
+MAX_LATITUDE = 85.05112878
+
+# Triggers only use plain SQL, so every writer (ingest, watch mode, tools) feeds the queue.
+# Hidden duplicates (photos.is_duplicate) are left out, like in the marker list; the
+# de-duplication triggers flip is_duplicate after inserts, deletes and moves, and those
+# flips queue the matching -1/+1.
+CLUSTER_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS photo_clusters (
+  zoom INTEGER NOT NULL,
+  cell_x INTEGER NOT NULL,
+  cell_y INTEGER NOT NULL,
+  library_id INTEGER NOT NULL,
+  count INTEGER NOT NULL,
+  sum_lat REAL NOT NULL,
+  sum_lon REAL NOT NULL,
+  representative_id INTEGER,
+  PRIMARY KEY (zoom, cell_x, cell_y, library_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS cluster_queue (
+  seq INTEGER PRIMARY KEY,
+  photo_id INTEGER NOT NULL,
+  latitude REAL NOT NULL,
+  longitude REAL NOT NULL,
+  library_id INTEGER,
+  delta INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS photos_cluster_insert AFTER INSERT ON photos
+WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL AND NEW.is_duplicate = 0
+BEGIN
+  INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+  VALUES (NEW.id, NEW.latitude, NEW.longitude, NEW.library_id, 1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_cluster_delete AFTER DELETE ON photos
+WHEN OLD.latitude IS NOT NULL AND OLD.longitude IS NOT NULL AND OLD.is_duplicate = 0
+BEGIN
+  INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+  VALUES (OLD.id, OLD.latitude, OLD.longitude, OLD.library_id, -1);
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_cluster_update AFTER UPDATE OF latitude, longitude, library_id ON photos
+WHEN OLD.is_duplicate = 0
+BEGIN
+  INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+  SELECT OLD.id, OLD.latitude, OLD.longitude, OLD.library_id, -1
+  WHERE OLD.latitude IS NOT NULL AND OLD.longitude IS NOT NULL;
+  INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+  SELECT NEW.id, NEW.latitude, NEW.longitude, NEW.library_id, 1
+  WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_cluster_duplicate AFTER UPDATE OF is_duplicate ON photos
+WHEN OLD.is_duplicate IS NOT NEW.is_duplicate AND NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+BEGIN
+  INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+  VALUES (NEW.id, NEW.latitude, NEW.longitude, NEW.library_id, CASE WHEN NEW.is_duplicate = 0 THEN 1 ELSE -1 END);
+END;
+'''
+
+# Triggers replaced when a pyramid from before duplicates were left out is rebuilt
+_CLUSTER_TRIGGERS = ('photos_cluster_insert', 'photos_cluster_delete', 'photos_cluster_update')
+
+def ensure_cluster_tables(cursor):
+    """Create the cluster pyramid tables and triggers (after ensure_dedup_key)
+
+    When the pyramid is created for an existing database, or was built while
+    it still counted hidden duplicates, every geotagged photo that is not a
+    duplicate is queued so the next update_cluster_pyramid() builds it.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name='photos_cluster_duplicate'")
+    is_new = cursor.fetchone() is None
+    if is_new:
+        for trigger in _CLUSTER_TRIGGERS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        reset_cluster_pyramid(cursor)
+    cursor.executescript(CLUSTER_SCHEMA)
+    if is_new:
+        cursor.execute('''
+        INSERT INTO cluster_queue (photo_id, latitude, longitude, library_id, delta)
+        SELECT id, latitude, longitude, library_id, 1 FROM photos
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND is_duplicate = 0
+        ''')
+        if cursor.rowcount > 0:
+            logger.info(f"Queued {cursor.rowcount} existing photos for the cluster pyramid")
+
+def _finest_cell(lat, lon):
+    """Web Mercator cell of a point at the finest pyramid level"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lon + 180.0) / 360.0
+    sin_lat = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)
+    return (min(_FINEST_CELLS - 1, max(0, int(x * _FINEST_CELLS))),
+            min(_FINEST_CELLS - 1, max(0, int(y * _FINEST_CELLS))))
+
+def _cells_per_side(zoom):
+    return 1 << (zoom + CELLS_PER_TILE_SHIFT)
+
+def cell_for_point(lat, lon, zoom):
+    """Return (cell_x, cell_y) of a point at a zoom level"""
+    x, y = _finest_cell(lat, lon)
+    shift = CLUSTER_MAX_ZOOM - zoom
+    return x >> shift, y >> shift
+
+def _tile_y_to_lat(y, cells):
+    n = math.pi - 2 * math.pi * y / cells
+    return math.degrees(math.atan(math.sinh(n)))
+
+def cell_bounds(zoom, cell_x, cell_y):
+    """Return (west, south, east, north) of a cell"""
+    cells = _cells_per_side(zoom)
+    west = cell_x / cells * 360.0 - 180.0
+    east = (cell_x + 1) / cells * 360.0 - 180.0
+    return west, _tile_y_to_lat(cell_y + 1, cells), east, _tile_y_to_lat(cell_y, cells)
+
+def bbox_cell_ranges(bbox, zoom):
+    """Translate a bbox into ([(x_min, x_max), ...], (y_min, y_max)) cell ranges at zoom
+
+    A bbox crossing the antimeridian yields two x ranges.
+    """
+    west, south, east, north = bbox
+    x_west, y_north = cell_for_point(north, west, zoom)
+    x_east, y_south = cell_for_point(south, east, zoom)
+    if east == 180.0:
+        x_east = _cells_per_side(zoom) - 1
+    if west <= east:
+        x_ranges = [(x_west, x_east)]
+    else:
+        x_ranges = [(x_west, _cells_per_side(zoom) - 1), (0, x_east)]
+    return x_ranges, (y_north, y_south)
+
+def _cell_aligned_bbox(bbox, zoom):
+    """Grow bbox to the edges of the cells it touches, so on-the-fly clusters match the pyramid's"""
+    x_ranges, (y_min, y_max) = bbox_cell_ranges(bbox, zoom)
+    west = cell_bounds(zoom, x_ranges[0][0], y_min)[0]
+    east = cell_bounds(zoom, x_ranges[-1][1], y_min)[2]
+    north = cell_bounds(zoom, x_ranges[0][0], y_min)[3]
+    south = cell_bounds(zoom, x_ranges[0][0], y_max)[1]
+    if y_min == 0:
+        north = 90.0
+    if y_max == _cells_per_side(zoom) - 1:
+        south = -90.0
+    return west, south, east, north
+
+def _aggregate(rows, zooms=range(CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM + 1)):
+    """Sum (photo_id, lat, lon, library_id, delta) rows into per-cell deltas for every zoom"""
+    cells = {}
+    for photo_id, lat, lon, library_id, delta in rows:
+        x, y = _finest_cell(lat, lon)
+        library_id = library_id or 0
+        for zoom in zooms:
+            shift = CLUSTER_MAX_ZOOM - zoom
+            key = (zoom, x >> shift, y >> shift, library_id)
+            cell = cells.get(key)
+            if cell is None:
+                cell = cells[key] = [0, 0.0, 0.0, None, set()]
+            cell[0] += delta
+            cell[1] += lat * delta
+            cell[2] += lon * delta
+            if delta > 0:
+                cell[3] = photo_id if cell[3] is None else min(cell[3], photo_id)
+            else:
+                cell[4].add(photo_id)
+    return cells
+
+def _repair_representatives(cursor, removed):
+    """Pick a new representative for cells whose representative photo was removed"""
+    id_column = 'id' if removed and has_spatial_index(cursor) else None
+    for zoom, cell_x, cell_y, library_id in removed:
+        condition, params = bbox_condition(cell_bounds(zoom, cell_x, cell_y), id_column=id_column)
+        cursor.execute(
+            f"SELECT MIN(id) FROM photos WHERE library_id IS ? AND is_duplicate = 0 AND {condition}",
+            [library_id or None] + params
+        )
+        cursor.execute(
+            "UPDATE photo_clusters SET representative_id = ? "
+            "WHERE zoom = ? AND cell_x = ? AND cell_y = ? AND library_id = ?",
+            (cursor.fetchone()[0], zoom, cell_x, cell_y, library_id)
+        )
+
+def update_cluster_pyramid(cursor, batch_size=50000):
+    """Apply queued photo inserts, deletes and moves to the cluster pyramid
+
+    Does not commit; callers fold this into their own transaction.
+
+    Returns:
+        Number of queued changes applied
+    """
+    applied = 0
+    while True:
+        cursor.execute(
+            "SELECT seq, photo_id, latitude, longitude, library_id, delta FROM cluster_queue ORDER BY seq LIMIT ?",
+            (batch_size,)
+        )
+        queued = cursor.fetchall()
+        if not queued:
+            break
+
+        cells = _aggregate(row[1:] for row in queued)
+        cursor.executemany('''
+        INSERT INTO photo_clusters (zoom, cell_x, cell_y, library_id, count, sum_lat, sum_lon, representative_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(zoom, cell_x, cell_y, library_id) DO UPDATE SET
+          count = count + excluded.count,
+          sum_lat = sum_lat + excluded.sum_lat,
+          sum_lon = sum_lon + excluded.sum_lon,
+          representative_id = CASE
+            WHEN representative_id IS NULL THEN excluded.representative_id
+            WHEN excluded.representative_id IS NULL THEN representative_id
+            ELSE MIN(representative_id, excluded.representative_id) END
+        ''', [key + tuple(cell[:4]) for key, cell in cells.items()])
+        cursor.execute("DELETE FROM photo_clusters WHERE count <= 0")
+
+        # Cells that lost their representative photo need a new one
+        removed = []
+        for key, cell in cells.items():
+            if cell[4]:
+                cursor.execute(
+                    "SELECT representative_id FROM photo_clusters WHERE zoom = ? AND cell_x = ? AND cell_y = ? AND library_id = ?",
+                    key
+                )
+                row = cursor.fetchone()
+                if row and row[0] in cell[4]:
+                    removed.append(key)
+        _repair_representatives(cursor, removed)
+
+        cursor.execute("DELETE FROM cluster_queue WHERE seq <= ?", (queued[-1][0],))
+        applied += len(queued)
+    if applied:
+        logger.debug(f"Applied {applied} queued changes to the cluster pyramid")
+    return applied
+
+def reset_cluster_pyramid(cursor):
+    """Empty the pyramid and its queue (used when the photos table is cleared)"""
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='photo_clusters'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM photo_clusters")
+        cursor.execute("DELETE FROM cluster_queue")
+
+def _cluster_dict(zoom, cell_x, cell_y, count, sum_lat, sum_lon, representative_id, libraries):
+    return {
+        "cell": [cell_x, cell_y],
+        "latitude": sum_lat / count,
+        "longitude": sum_lon / count,
+        "count": count,
+        "libraries": libraries,
+        "photo_id": representative_id,
+        "bounds": list(cell_bounds(zoom, cell_x, cell_y)),
+    }
+
+def query_clusters(conn, zoom, bbox=None, library_ids=None):
+    """Read clusters for a zoom level from the pyramid, merged across the selected libraries
+
+    Counts are photo counts per cell without hidden duplicates, matching the
+    unfiltered marker list; per-library counts are returned in 'libraries' and
+    'photo_id' is the lowest photo id in the cell.
+    """
+    zoom = max(CLUSTER_MIN_ZOOM, min(CLUSTER_MAX_ZOOM, zoom))
+    conditions = ["zoom = ?"]
+    params = [zoom]
+    if bbox is not None:
+        x_ranges, (y_min, y_max) = bbox_cell_ranges(bbox, zoom)
+        conditions.append('(' + ' OR '.join('cell_x BETWEEN ? AND ?' for _ in x_ranges) + ')')
+        for x_range in x_ranges:
+            params.extend(x_range)
+        conditions.append("cell_y BETWEEN ? AND ?")
+        params.extend([y_min, y_max])
+    if library_ids:
+        conditions.append(f"library_id IN ({','.join('?' * len(library_ids))})")
+        params.extend(library_ids)
+
+    cursor = conn.execute(f'''
+    SELECT cell_x, cell_y, SUM(count), SUM(sum_lat), SUM(sum_lon), MIN(representative_id),
+           GROUP_CONCAT(library_id || ':' || count)
+    FROM photo_clusters
+    WHERE {' AND '.join(conditions)}
+    GROUP BY cell_x, cell_y
+    ''', params)
+
+    clusters = []
+    for cell_x, cell_y, count, sum_lat, sum_lon, representative_id, per_library in cursor.fetchall():
+        libraries = {}
+        for pair in per_library.split(','):
+            library_id, library_count = pair.split(':')
+            libraries[library_id] = int(library_count)
+        clusters.append(_cluster_dict(zoom, cell_x, cell_y, count, sum_lat, sum_lon, representative_id, libraries))
+    return clusters
+
+def compute_clusters(conn, zoom, bbox=None, library_ids=None, library_names=None, date_from=None, date_to=None):
+    """Cluster matching photos on the fly (for filters the pyramid does not cover, e.g. dates)"""
+    zoom = max(CLUSTER_MIN_ZOOM, min(CLUSTER_MAX_ZOOM, zoom))
+    if bbox is not None:
+        bbox = _cell_aligned_bbox(bbox, zoom)
+    where_sql, params = build_marker_filters(bbox, library_ids, library_names, date_from, date_to,
+                                             spatial_index=bbox is not None and has_spatial_index(conn))
+    # Same de-duplication as the filtered marker list
+    duplicate_where_sql = None
+    if has_dedup_index(conn):
+        duplicate_where_sql, duplicate_params = build_marker_filters(bbox, library_ids, library_names,
+                                                                     date_from, date_to, alias='d')
+        params = params + duplicate_params
+    cursor = conn.execute(f'''
+    SELECT id, latitude, longitude, library_id, 1
+    FROM ({marker_query_sql(where_sql, duplicate_where_sql=duplicate_where_sql)})
+    ''', params)
+
+    merged = {}
+    for (_, cell_x, cell_y, library_id), (count, sum_lat, sum_lon, representative_id, _) in _aggregate(cursor, [zoom]).items():
+        cell = merged.setdefault((cell_x, cell_y), [0, 0.0, 0.0, None, {}])
+        cell[0] += count
+        cell[1] += sum_lat
+        cell[2] += sum_lon
+        cell[3] = representative_id if cell[3] is None else min(cell[3], representative_id)
+        cell[4][str(library_id)] = count
+    return [_cluster_dict(zoom, cell_x, cell_y, *cell) for (cell_x, cell_y), cell in merged.items()]
@@ -0,0 +1,138 @@
+# Pooled read-only SQLite connections for the web server
+import os
+import pathlib
+import sqlite3
+import logging
+import threading
+import contextlib
+
+logger = logging.getLogger(__name__)
+
+# Where the server looks for the database when no path is given, relative to its directory
+DB_PATH_CANDIDATES = (os.path.join('data', 'photo_library.db'), 'photo_library.db')
+
+# Per-connection page cache; the memory map below is shared through the OS page cache
+READ_CACHE_MB = 32
+READ_MMAP_MB = 1024
+
+# Prepared statements kept per connection (sqlite3 reuses them by SQL text)
+CACHED_STATEMENTS = 256
+
+# Idle connections kept for reuse; more are opened under load and closed when returned
+MAX_IDLE_CONNECTIONS = 16
+
+def resolve_db_path(db_path=None):
+    """Return the absolute database path: db_path if given, else the first existing candidate"""
+    if db_path:
+        return os.path.abspath(db_path)
+    for candidate in DB_PATH_CANDIDATES:
+        if os.path.exists(candidate):
+            return os.path.abspath(candidate)
+    return os.path.abspath(DB_PATH_CANDIDATES[0])
+
+def _file_identity(path):
+    stat = os.stat(path)
+    return stat.st_dev, stat.st_ino
+
+class _PooledConnection(sqlite3.Connection):
+    pool_identity = None  # (st_dev, st_ino) of the database file the connection was opened on
+
+class ReadOnlyConnectionPool:
+    """Reusable read-only connections to one database
+
+    Connections are opened with mode=ro and PRAGMA query_only, memory-map the
+    database and keep their prepared statements, so a request only borrows an
+    open handle instead of connecting. A connection is used by one thread at a
+    time. If the database file is replaced (e.g. by --clean), connections to
+    the old file are dropped.
+    """
+
+    def __init__(self, db_path, cache_mb=READ_CACHE_MB, mmap_mb=READ_MMAP_MB, max_idle=MAX_IDLE_CONNECTIONS):
+        self.db_path = db_path
+        self.cache_mb = cache_mb
+        self.mmap_mb = mmap_mb
+        self.max_idle = max_idle
+        self._idle = []  # (connection, file identity), most recently used last
+        self._lock = threading.Lock()
+        self._version_conn = None
+        self._version_lock = threading.Lock()
+
+    def exists(self):
+        return os.path.exists(self.db_path)
+
+    def _open(self):
+        uri = f"{pathlib.Path(self.db_path).as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=30.0, check_same_thread=False,
+                               cached_statements=CACHED_STATEMENTS, factory=_PooledConnection)
+        conn.execute("PRAGMA query_only=ON")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_mb * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_mb * 1024}")  # Negative values are KiB
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        """Borrow a connection, or return None if the database does not exist
+
+        Pass the connection back with release() when done.
+        """
+        try:
+            identity = _file_identity(self.db_path)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            while self._idle:
+                conn, conn_identity = self._idle.pop()
+                if conn_identity == identity:
+                    return conn
+                conn.close()  # Opened on a file that has since been replaced
+        conn = self._open()
+        conn.pool_identity = identity
+        return conn
+
+    def data_version(self):
+        """Return a token that changes whenever any process commits to the database or it is replaced
+
+        Returns None if the database does not exist. PRAGMA data_version is only
+        comparable on one connection, so a dedicated connection answers it.
+        """
+        try:
+            identity = _file_identity(self.db_path)
+        except FileNotFoundError:
+            return None
+        with self._version_lock:
+            if self._version_conn is None or self._version_conn.pool_identity != identity:
+                if self._version_conn is not None:
+                    self._version_conn.close()
+                self._version_conn = self._open()
+                self._version_conn.pool_identity = identity
+            return identity + (self._version_conn.execute("PRAGMA data_version").fetchone()[0],)
+
+    def release(self, conn):
+        """Return a borrowed connection to the pool"""
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((conn, conn.pool_identity))
+                return
+        conn.close()
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a with block (None if the database does not exist)"""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            if conn is not None:
+                self.release(conn)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            conn.close()
+        with self._version_lock:
+            if self._version_conn is not None:
+                self._version_conn.close()
+                self._version_conn = None
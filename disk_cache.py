@@ -0,0 +1,181 @@
+# Size-bounded, content-addressed file cache on local disk with LRU eviction
+import os
+import time
+import logging
+import zlib
+import tempfile
+import threading
+import contextlib
+
+# Try to import fcntl for cross-process locking (not available on Windows)
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+logger = logging.getLogger(__name__)
+
+# Default size bound of a cache directory
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+
+# Eviction frees space down to this fraction of the bound, so it does not run on every write
+EVICTION_LOW_WATERMARK = 0.9
+
+# Hits refresh an entry's mtime (its LRU timestamp) at most this often, in seconds
+TOUCH_INTERVAL = 3600
+
+# Lock files shared by all keys (striped by key) for single-flight across processes
+LOCK_STRIPES = 64
+
+class DiskCache:
+    """Files stored under root/<key[:2]>/<key><suffix>, evicted least recently used first
+
+    Keys must be derived from the content they describe (e.g. a photo hash plus
+    the rendering parameters), so an entry never needs invalidating: a changed
+    photo simply gets a new key and the old entry ages out. Writes are atomic
+    (temporary file plus rename), which makes the cache safe to share between
+    the server and the ingest process. An entry's mtime records its last use.
+    get_or_create() renders each missing entry once, however many requests
+    ask for it at the same time.
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self._size = None  # Total bytes on disk, counted lazily on the first write
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> [lock, waiters] for entries being created
+        self._flights_lock = threading.Lock()
+
+    def path_for(self, key, suffix=''):
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def get(self, key, suffix=''):
+        """Return the path of a cached entry, or None if it is not cached"""
+        path = self.path_for(key, suffix)
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return None
+        now = time.time()
+        if now - mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass  # Evicted by another process in the meantime; still readable if open
+        return path
+
+    def put(self, key, data, suffix=''):
+        """Store bytes under key and return the entry's path"""
+        path = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._scan())
+            else:
+                self._size += len(data)
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    @contextlib.contextmanager
+    def _single_flight(self, key):
+        """Hold a lock for key that other threads, and other processes where fcntl exists, share"""
+        with self._flights_lock:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                if not HAS_FCNTL:
+                    yield
+                    return
+                lock_dir = os.path.join(self.root, '.locks')
+                os.makedirs(lock_dir, exist_ok=True)
+                stripe = zlib.crc32(key.encode()) % LOCK_STRIPES
+                with open(os.path.join(lock_dir, f"{stripe:02d}"), 'a') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        yield
+                    finally:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        finally:
+            with self._flights_lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self._flights[key]
+
+    def get_or_create(self, key, create, suffix=''):
+        """Return the path of key's entry, calling create() for its bytes if it is missing
+
+        Concurrent callers for the same key wait for the first one's result
+        instead of rendering it again.
+        """
+        path = self.get(key, suffix)
+        if path is not None:
+            return path
+        with self._single_flight(key):
+            path = self.get(key, suffix)
+            if path is None:
+                path = self.put(key, create(), suffix)
+            return path
+
+    def _scan(self):
+        """Return (mtime, size, path) of every entry"""
+        entries = []
+        try:
+            shards = os.scandir(self.root)
+        except FileNotFoundError:
+            return entries
+        with shards:
+            for shard in shards:
+                if shard.name.startswith('.') or not shard.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(shard.path) as files:
+                    for entry in files:
+                        if entry.name.startswith('.tmp-'):
+                            continue
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        """Delete least recently used entries until the cache is below its low watermark
+
+        Returns:
+            Number of entries removed
+        """
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            target = self.max_bytes * EVICTION_LOW_WATERMARK
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                removed += 1
+            self._size = total
+        if removed:
+            logger.info(f"Evicted {removed} entries from {self.root} ({total / (1024 * 1024):.1f} MB remaining)")
+        return removed
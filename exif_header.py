@@ -0,0 +1,446 @@
+"""
+Header-only EXIF reader for the photo processor
+
+Locates the EXIF TIFF block without decoding any pixel data:
+- JPEG: the APP1 "Exif" segment in the marker stream
+- TIFF-based files (TIFF, DNG, NEF, CR2, ARW): the file itself is the TIFF block
+- HEIC/HEIF: the "Exif" item found through the meta/iinf/iloc boxes
+
+Only the tags the heatmap needs are decoded: GPS latitude/longitude,
+DateTimeOriginal and orientation. For RAW files, read_embedded_jpeg() also
+locates the JPEG previews cameras embed, so they can be shown without a RAW decoder.
+"""
+import os
+import struct
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# How much of the file read_exif() loads up front; anything outside is fetched on demand
+DEFAULT_HEADER_SIZE = 256 * 1024
+
+# Upper bound for a single out-of-header read (EXIF blocks are tiny, this guards corrupt offsets)
+MAX_EXTRA_READ = 4 * 1024 * 1024
+
+# TIFF tag IDs
+TAG_ORIENTATION = 0x0112
+TAG_DATETIME = 0x0132
+TAG_EXIF_IFD = 0x8769
+TAG_GPS_IFD = 0x8825
+TAG_DATETIME_ORIGINAL = 0x9003
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+# TIFF tags locating embedded previews in RAW files
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+
+# Compression values whose single strip may be a complete JPEG stream
+JPEG_COMPRESSIONS = (6, 7)
+
+# JPEG start-of-frame markers browsers and Pillow decode (baseline, extended, progressive);
+# lossless SOF3 streams in CR2/DNG carry raw sensor data
+DISPLAYABLE_SOF_MARKERS = (0xC0, 0xC1, 0xC2)
+
+# Limits for walking IFD chains in RAW files
+MAX_IFD_CHAIN = 16
+MAX_PREVIEW_SIZE = 64 * 1024 * 1024
+
+# TIFF field type -> (struct code, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1),   # BYTE
+    2: ('s', 1),   # ASCII
+    3: ('H', 2),   # SHORT
+    4: ('I', 4),   # LONG
+    5: ('II', 8),  # RATIONAL
+    6: ('b', 1),   # SBYTE
+    7: ('s', 1),   # UNDEFINED
+    8: ('h', 2),   # SSHORT
+    9: ('i', 4),   # SLONG
+    10: ('ii', 8), # SRATIONAL
+    11: ('f', 4),  # FLOAT
+    12: ('d', 8),  # DOUBLE
+}
+
+# A sane cap on IFD entry counts so corrupt data fails fast
+MAX_IFD_ENTRIES = 1024
+
+class _ByteSource:
+    """Random access to a byte range backed by a header buffer and an optional open file"""
+
+    def __init__(self, data, base=0, fileobj=None):
+        self.data = data
+        self.base = base
+        self.fileobj = fileobj
+
+    def read(self, offset, length):
+        start = self.base + offset
+        end = start + length
+        if offset < 0 or length < 0:
+            raise ValueError("Negative offset or length")
+        if end <= len(self.data):
+            return bytes(self.data[start:end])
+        if self.fileobj is None:
+            raise ValueError(f"Range {start}-{end} lies outside the header buffer")
+        if length > MAX_EXTRA_READ:
+            raise ValueError(f"Refusing to read {length} bytes outside the header buffer")
+        self.fileobj.seek(start)
+        chunk = self.fileobj.read(length)
+        if len(chunk) < length:
+            raise ValueError("Unexpected end of file")
+        return chunk
+
+    def sub(self, offset):
+        """Return a source whose offset 0 is at offset within this one"""
+        return _ByteSource(self.data, self.base + offset, self.fileobj)
+
+def _read_ifd(src, offset, endian):
+    """Read an IFD into {tag: (type, count, raw 4-byte value/offset field)}"""
+    count = struct.unpack(endian + 'H', src.read(offset, 2))[0]
+    if count > MAX_IFD_ENTRIES:
+        raise ValueError(f"Implausible IFD entry count {count}")
+    entries = src.read(offset + 2, count * 12)
+    tags = {}
+    for i in range(count):
+        entry = entries[i * 12:(i + 1) * 12]
+        tag, field_type, n = struct.unpack(endian + 'HHI', entry[:8])
+        tags[tag] = (field_type, n, entry[8:])
+    return tags
+
+def _tag_value(src, endian, entry):
+    """Decode a tag value; returns a str for ASCII, otherwise a list of numbers"""
+    field_type, n, raw = entry
+    if field_type not in TIFF_TYPES:
+        return None
+    code, size = TIFF_TYPES[field_type]
+    total = size * n
+    if total <= 4:
+        buf = raw[:total]
+    else:
+        buf = src.read(struct.unpack(endian + 'I', raw)[0], total)
+
+    if field_type == 2:
+        return buf.split(b'\x00', 1)[0].decode('ascii', errors='ignore')
+    if field_type == 7:
+        return buf
+    if field_type in (5, 10):
+        values = struct.unpack(endian + code * n, buf)
+        return [values[i] / values[i + 1] if values[i + 1] else 0.0 for i in range(0, len(values), 2)]
+    return list(struct.unpack(endian + code * n, buf))
+
+def _gps_decimal(dms, ref):
+    """Convert [degrees, minutes, seconds] plus N/S/E/W reference to decimal degrees"""
+    if not dms:
+        return None
+    decimal = 0.0
+    for value, divisor in zip(dms, (1.0, 60.0, 3600.0)):
+        decimal += value / divisor
+    if isinstance(ref, str) and ref.strip().upper() in ('S', 'W'):
+        decimal = -decimal
+    return decimal
+
+def _iso_datetime(value):
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' string to ISO format, or None"""
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.strptime(value.strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+    except ValueError:
+        return None
+
+def parse_tiff(src):
+    """Parse GPS, DateTimeOriginal and orientation from a TIFF block
+
+    Args:
+        src: _ByteSource whose offset 0 is the TIFF byte-order mark
+
+    Returns:
+        dict with latitude, longitude, datetime and orientation keys, plus
+        gps_unresolved when a GPS IFD is present but yields no coordinates
+    """
+    header = src.read(0, 8)
+    if header[:2] == b'II':
+        endian = '<'
+    elif header[:2] == b'MM':
+        endian = '>'
+    else:
+        raise ValueError("Not a TIFF header")
+    if struct.unpack(endian + 'H', header[2:4])[0] != 42:
+        raise ValueError("Bad TIFF magic number")
+
+    ifd0 = _read_ifd(src, struct.unpack(endian + 'I', header[4:8])[0], endian)
+    result = {'latitude': None, 'longitude': None, 'datetime': None, 'orientation': None, 'gps_unresolved': False}
+
+    if TAG_ORIENTATION in ifd0:
+        value = _tag_value(src, endian, ifd0[TAG_ORIENTATION])
+        result['orientation'] = value[0] if value else None
+
+    if TAG_EXIF_IFD in ifd0:
+        exif_offset = _tag_value(src, endian, ifd0[TAG_EXIF_IFD])[0]
+        exif_ifd = _read_ifd(src, exif_offset, endian)
+        if TAG_DATETIME_ORIGINAL in exif_ifd:
+            result['datetime'] = _iso_datetime(_tag_value(src, endian, exif_ifd[TAG_DATETIME_ORIGINAL]))
+
+    if TAG_GPS_IFD in ifd0:
+        try:
+            gps_offset = _tag_value(src, endian, ifd0[TAG_GPS_IFD])[0]
+            gps_ifd = _read_ifd(src, gps_offset, endian)
+            if GPS_LATITUDE in gps_ifd and GPS_LONGITUDE in gps_ifd:
+                lat_ref = _tag_value(src, endian, gps_ifd[GPS_LATITUDE_REF]) if GPS_LATITUDE_REF in gps_ifd else 'N'
+                lon_ref = _tag_value(src, endian, gps_ifd[GPS_LONGITUDE_REF]) if GPS_LONGITUDE_REF in gps_ifd else 'E'
+                result['latitude'] = _gps_decimal(_tag_value(src, endian, gps_ifd[GPS_LATITUDE]), lat_ref)
+                result['longitude'] = _gps_decimal(_tag_value(src, endian, gps_ifd[GPS_LONGITUDE]), lon_ref)
+        except (ValueError, struct.error, IndexError, TypeError) as e:
+            # Vendor layouts (e.g. some Samsung phones) point GPSInfo somewhere this parser cannot follow
+            logger.debug(f"Could not resolve the GPS IFD: {e}")
+        result['gps_unresolved'] = result['latitude'] is None or result['longitude'] is None
+
+    return result
+
+def _find_jpeg_exif(src):
+    """Walk the JPEG marker stream up to the first scan and return the APP1 Exif TIFF offset"""
+    offset = 2
+    while True:
+        marker = src.read(offset, 2)
+        if marker[0] != 0xFF:
+            raise ValueError("Lost JPEG marker sync")
+        code = marker[1]
+        if code == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if code == 0xDA or code == 0xD9:  # Start of scan / end of image: no EXIF before pixel data
+            return None
+        if 0xD0 <= code <= 0xD7 or code == 0x01:  # Markers without a length field
+            offset += 2
+            continue
+        length = struct.unpack('>H', src.read(offset + 2, 2))[0]
+        if code == 0xE1 and length >= 8 and src.read(offset + 4, 6) == b'Exif\x00\x00':
+            return offset + 10
+        offset += 2 + length
+
+def _iter_boxes(src, start, end):
+    """Yield (type, payload offset, payload end) for ISO BMFF boxes between start and end"""
+    offset = start
+    while end is None or offset + 8 <= end:
+        try:
+            header = src.read(offset, 8)
+        except ValueError:
+            return
+        size, box_type = struct.unpack('>I4s', header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack('>Q', src.read(offset + 8, 8))[0]
+            header_size = 16
+        elif size == 0:
+            if end is None:
+                return
+            size = end - offset
+        if size < header_size:
+            raise ValueError("Corrupt box size")
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+def _read_uint(src, offset, size):
+    """Read a big-endian unsigned integer of 0, 4 or 8 bytes (iloc field sizes)"""
+    if size == 0:
+        return 0
+    if size == 4:
+        return struct.unpack('>I', src.read(offset, 4))[0]
+    if size == 8:
+        return struct.unpack('>Q', src.read(offset, 8))[0]
+    raise ValueError(f"Unsupported iloc field size {size}")
+
+def _find_heic_exif_item(src, meta_start, meta_end):
+    """Return (offset, length) of the Exif item inside a HEIF meta box, or None"""
+    exif_item_id = None
+    locations = {}
+    # meta is a FullBox: skip version/flags
+    for box_type, start, end in _iter_boxes(src, meta_start + 4, meta_end):
+        if box_type == b'iinf':
+            version = src.read(start, 1)[0]
+            pos = start + 4
+            pos += 2 if version == 0 else 4
+            for entry_type, entry_start, _ in _iter_boxes(src, pos, end):
+                if entry_type != b'infe':
+                    continue
+                entry_version = src.read(entry_start, 1)[0]
+                if entry_version < 2:
+                    continue
+                pos = entry_start + 4
+                if entry_version == 2:
+                    item_id = struct.unpack('>H', src.read(pos, 2))[0]
+                    pos += 2
+                else:
+                    item_id = struct.unpack('>I', src.read(pos, 4))[0]
+                    pos += 4
+                item_type = src.read(pos + 2, 4)
+                if item_type == b'Exif':
+                    exif_item_id = item_id
+        elif box_type == b'iloc':
+            version = src.read(start, 1)[0]
+            sizes = src.read(start + 4, 2)
+            offset_size, length_size = sizes[0] >> 4, sizes[0] & 0x0F
+            base_offset_size = sizes[1] >> 4
+            index_size = sizes[1] & 0x0F if version in (1, 2) else 0
+            pos = start + 6
+            if version < 2:
+                item_count = struct.unpack('>H', src.read(pos, 2))[0]
+                pos += 2
+            else:
+                item_count = struct.unpack('>I', src.read(pos, 4))[0]
+                pos += 4
+            for _ in range(item_count):
+                if version < 2:
+                    item_id = struct.unpack('>H', src.read(pos, 2))[0]
+                    pos += 2
+                else:
+                    item_id = struct.unpack('>I', src.read(pos, 4))[0]
+                    pos += 4
+                construction_method = 0
+                if version in (1, 2):
+                    construction_method = struct.unpack('>H', src.read(pos, 2))[0] & 0x0F
+                    pos += 2
+                pos += 2  # data_reference_index
+                base_offset = _read_uint(src, pos, base_offset_size)
+                pos += base_offset_size
+                extent_count = struct.unpack('>H', src.read(pos, 2))[0]
+                pos += 2
+                extents = []
+                for _ in range(extent_count):
+                    pos += index_size
+                    extent_offset = _read_uint(src, pos, offset_size)
+                    pos += offset_size
+                    extent_length = _read_uint(src, pos, length_size)
+                    pos += length_size
+                    extents.append((extent_offset, extent_length))
+                # Only file-offset items (construction method 0) with a single extent are supported
+                if construction_method == 0 and len(extents) == 1:
+                    locations[item_id] = (base_offset + extents[0][0], extents[0][1])
+
+    if exif_item_id is None or exif_item_id not in locations:
+        return None
+    return locations[exif_item_id]
+
+def _find_heic_exif(src):
+    """Return the TIFF header offset of the Exif item in a HEIF/HEIC file, or None"""
+    for box_type, start, end in _iter_boxes(src, 0, None):
+        if box_type == b'meta':
+            location = _find_heic_exif_item(src, start, end)
+            if location is None:
+                return None
+            item_offset, _ = location
+            # The Exif item payload starts with the offset to the TIFF header
+            tiff_offset = struct.unpack('>I', src.read(item_offset, 4))[0]
+            return item_offset + 4 + tiff_offset
+    return None
+
+def _preview_candidates(src, endian, offset, depth=0):
+    """Yield (offset, length) of possible JPEG streams in an IFD chain and its SubIFDs"""
+    seen = 0
+    while offset and seen < MAX_IFD_CHAIN:
+        seen += 1
+        ifd = _read_ifd(src, offset, endian)
+        if TAG_JPEG_OFFSET in ifd and TAG_JPEG_LENGTH in ifd:
+            yield _tag_value(src, endian, ifd[TAG_JPEG_OFFSET])[0], _tag_value(src, endian, ifd[TAG_JPEG_LENGTH])[0]
+        compression = _tag_value(src, endian, ifd[TAG_COMPRESSION])[0] if TAG_COMPRESSION in ifd else None
+        if compression in JPEG_COMPRESSIONS and TAG_STRIP_OFFSETS in ifd and TAG_STRIP_BYTE_COUNTS in ifd:
+            strips = _tag_value(src, endian, ifd[TAG_STRIP_OFFSETS])
+            counts = _tag_value(src, endian, ifd[TAG_STRIP_BYTE_COUNTS])
+            if len(strips) == 1 and len(counts) == 1:
+                yield strips[0], counts[0]
+        if TAG_SUB_IFDS in ifd and depth < 2:
+            for sub_offset in _tag_value(src, endian, ifd[TAG_SUB_IFDS]):
+                yield from _preview_candidates(src, endian, sub_offset, depth + 1)
+        count = len(ifd)
+        offset = struct.unpack(endian + 'I', src.read(offset + 2 + count * 12, 4))[0]
+
+def _jpeg_is_displayable(head):
+    """Whether the frame header in the first bytes of a JPEG stream is baseline or progressive"""
+    pos = 2
+    while pos + 4 <= len(head):
+        if head[pos] != 0xFF:
+            return False
+        marker = head[pos + 1]
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return marker in DISPLAYABLE_SOF_MARKERS
+        pos += 2 + struct.unpack('>H', head[pos + 2:pos + 4])[0]
+    return False
+
+def read_embedded_jpeg(image_path):
+    """Return the largest displayable JPEG preview embedded in a TIFF-based RAW file, or None
+
+    DNG, NEF, CR2 and ARW files carry one or more JPEG renderings of the
+    photo (often full size) next to the sensor data.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            src = _ByteSource(f.read(DEFAULT_HEADER_SIZE), 0, f)
+            header = src.read(0, 8)
+            if header[:4] not in (b'II*\x00', b'MM\x00*'):
+                return None
+            endian = '<' if header[:2] == b'II' else '>'
+            candidates = sorted(set(_preview_candidates(src, endian, struct.unpack(endian + 'I', header[4:8])[0])),
+                                key=lambda candidate: candidate[1], reverse=True)
+            for offset, length in candidates:
+                if not 0 < length <= MAX_PREVIEW_SIZE:
+                    continue
+                f.seek(offset)
+                head = f.read(min(length, 65536))
+                if head[:2] != b'\xff\xd8' or not _jpeg_is_displayable(head):
+                    continue
+                return head + f.read(length - len(head))
+    except (ValueError, struct.error, IndexError, OSError) as e:
+        logger.debug(f"Could not locate an embedded JPEG in {image_path}: {e}")
+    return None
+
+def parse_exif_header(data, fileobj=None):
+    """Parse EXIF metadata from the start of an image file without decoding pixels
+
+    Args:
+        data: The first bytes of the file (or the whole file)
+        fileobj: Optional open binary file used for ranges beyond data
+
+    Returns:
+        dict with latitude, longitude, datetime, orientation and gps_unresolved keys,
+        or None if the format is unknown or the EXIF block could not be parsed
+    """
+    src = _ByteSource(data, 0, fileobj)
+    try:
+        magic = src.read(0, 12)
+        if magic[:2] == b'\xff\xd8':
+            tiff_offset = _find_jpeg_exif(src)
+        elif magic[:4] in (b'II*\x00', b'MM\x00*'):
+            tiff_offset = 0
+        elif magic[4:8] == b'ftyp':
+            tiff_offset = _find_heic_exif(src)
+        else:
+            return None
+
+        if tiff_offset is None:
+            # A well-formed file that simply carries no EXIF block
+            return {'latitude': None, 'longitude': None, 'datetime': None, 'orientation': None, 'gps_unresolved': False}
+        return parse_tiff(src.sub(tiff_offset))
+    except (ValueError, struct.error, IndexError, OSError) as e:
+        logger.debug(f"Header EXIF parse failed: {e}")
+        return None
+
+def read_exif(image_path, header_size=DEFAULT_HEADER_SIZE):
+    """Read the first header_size bytes of a file and parse its EXIF metadata
+
+    Ranges outside the header (e.g. a HEIC Exif item stored after the image data)
+    are fetched with targeted seeks rather than reading the whole file.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read(header_size)
+            return parse_exif_header(data, f)
+    except OSError as e:
+        logger.debug(f"Could not read {image_path}: {e}")
+        return None
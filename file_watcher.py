@@ -0,0 +1,232 @@
+# Filesystem change notification for the --watch ingest daemon
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import logging
+import ctypes
+import ctypes.util
+
+from scan_functions import build_signature_tree
+
+logger = logging.getLogger(__name__)
+
+# inotify event masks (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+# CLOSE_WRITE rather than MODIFY: one event per finished write instead of one per write() call
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+# Filesystems where inotify does not see changes made by other hosts
+NETWORK_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'fuse.sshfs', 'fuse.rclone', 'afs', '9p', 'virtiofs')
+
+DEFAULT_DEBOUNCE = 2.0
+DEFAULT_POLL_INTERVAL = 60.0
+
+class ChangeBatch:
+    """Directories touched by a burst of filesystem events
+
+    dirs are re-listed non-recursively; trees (created, moved or removed
+    directories, or the whole root after an event overflow) are re-scanned
+    recursively.
+    """
+
+    def __init__(self):
+        self.dirs = set()
+        self.trees = set()
+
+    def __bool__(self):
+        return bool(self.dirs or self.trees)
+
+    def __repr__(self):
+        return f"ChangeBatch(dirs={len(self.dirs)}, trees={len(self.trees)})"
+
+def get_filesystem_type(path):
+    """Return the filesystem type of the mount containing path (Linux only), or None"""
+    try:
+        path = os.path.realpath(path)
+        best_mount, best_type = '', None
+        with open('/proc/mounts') as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace('\\040', ' ')
+                if (path == mount_point or path.startswith(mount_point.rstrip('/') + '/')) and len(mount_point) > len(best_mount):
+                    best_mount, best_type = mount_point, fields[2]
+        return best_type
+    except OSError:
+        return None
+
+class InotifyWatcher:
+    """Recursive directory watcher on top of the Linux inotify API (via ctypes)"""
+
+    def __init__(self, root_dir, image_extensions, debounce=DEFAULT_DEBOUNCE):
+        self.root_dir = root_dir
+        self.image_extensions = image_extensions
+        self.debounce = debounce
+        self.watches = {}  # wd -> directory path
+
+        libc_name = ctypes.util.find_library('c') or 'libc.so.6'
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        try:
+            self._add_tree(root_dir)
+        except OSError:
+            os.close(self.fd)
+            raise
+        logger.info(f"Watching {len(self.watches)} directories under {root_dir} with inotify")
+
+    def _add_watch(self, dir_path):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(dir_path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                raise OSError(err, 'inotify watch limit reached (raise fs.inotify.max_user_watches)')
+            logger.debug(f"Could not watch {dir_path}: {os.strerror(err)}")
+            return
+        self.watches[wd] = dir_path
+
+    def _add_tree(self, dir_path):
+        """Watch dir_path and every directory below it"""
+        for current, _, _ in os.walk(dir_path):
+            self._add_watch(current)
+
+    def _forget_tree(self, dir_path):
+        """Drop watches of a directory that was moved away (its wds now point elsewhere)"""
+        prefix = os.path.join(dir_path, '')
+        for wd, path in list(self.watches.items()):
+            if path == dir_path or path.startswith(prefix):
+                self._libc.inotify_rm_watch(self.fd, wd)
+                del self.watches[wd]
+
+    def _read_events(self, batch):
+        """Drain pending events into batch; returns the number of events read"""
+        try:
+            data = os.read(self.fd, 256 * 1024)
+        except BlockingIOError:
+            return 0
+
+        count = 0
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            count += 1
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; only a full rescan is safe
+                logger.warning("inotify event queue overflowed; rescanning the whole library")
+                batch.trees.add(self.root_dir)
+                continue
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+                continue
+
+            dir_path = self.watches.get(wd)
+            if dir_path is None:
+                continue
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # The parent's DELETE/MOVED_FROM event schedules the cleanup
+                continue
+
+            path = os.path.join(dir_path, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._add_tree(path)
+                    batch.trees.add(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._forget_tree(path)
+                    batch.trees.add(path)
+            elif name.lower().endswith(self.image_extensions):
+                batch.dirs.add(dir_path)
+        return count
+
+    def batches(self):
+        """Yield a ChangeBatch per burst of events, once no event arrived for `debounce` seconds
+
+        A continuous stream of events is still flushed after 5x the debounce
+        delay so ingest latency stays bounded during large copies.
+        """
+        while True:
+            batch = ChangeBatch()
+            select.select([self.fd], [], [])
+            first_event = time.monotonic()
+            while True:
+                self._read_events(batch)
+                if time.monotonic() - first_event >= self.debounce * 5:
+                    break
+                ready, _, _ = select.select([self.fd], [], [], self.debounce)
+                if not ready:
+                    break
+            if batch:
+                yield batch
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingWatcher:
+    """Fallback watcher that re-signs the directory tree every poll_interval seconds
+
+    A poll is one scandir pass over the library; only directories whose
+    signature changed are handed to the ingest step.
+    """
+
+    def __init__(self, root_dir, image_extensions, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.root_dir = root_dir
+        self.image_extensions = image_extensions
+        self.poll_interval = poll_interval
+        self.signatures, _ = build_signature_tree(root_dir, image_extensions)
+        logger.info(f"Polling {len(self.signatures)} directories under {root_dir} every {poll_interval:.0f}s")
+
+    def batches(self):
+        while True:
+            time.sleep(self.poll_interval)
+            signatures, changed_records = build_signature_tree(self.root_dir, self.image_extensions, self.signatures)
+            batch = ChangeBatch()
+            batch.dirs.update(changed_records)
+            # Directories that vanished take their whole subtree with them
+            batch.trees.update(path for path in self.signatures if path not in signatures)
+            self.signatures = signatures
+            if batch:
+                yield batch
+
+    def close(self):
+        pass
+
+def create_watcher(root_dir, image_extensions, debounce=DEFAULT_DEBOUNCE, poll_interval=DEFAULT_POLL_INTERVAL, force_polling=False):
+    """Create an inotify watcher, falling back to polling where inotify cannot work
+
+    Polling is used on non-Linux systems, on network filesystems (whose remote
+    changes inotify never reports) and when inotify setup fails, e.g. because
+    the watch limit is exhausted.
+    """
+    if not force_polling and sys.platform.startswith('linux'):
+        fs_type = get_filesystem_type(root_dir)
+        if fs_type in NETWORK_FILESYSTEMS:
+            logger.info(f"{root_dir} is on a {fs_type} mount; using polling instead of inotify")
+        else:
+            try:
+                return InotifyWatcher(root_dir, image_extensions, debounce)
+            except (OSError, AttributeError) as e:
+                logger.warning(f"inotify unavailable ({e}); falling back to polling")
+    return PollingWatcher(root_dir, image_extensions, poll_interval)
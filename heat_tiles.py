@@ -0,0 +1,216 @@
+# Server-side heatmap tiles: per-tile density grids as weighted points (JSON) or rendered PNGs
+import io
+import math
+import logging
+
+from PIL import Image, ImageChops, ImageDraw, ImageFilter
+
+from marker_queries import build_marker_filters, has_dedup_index, has_spatial_index, marker_query_sql
+from cluster_pyramid import CLUSTER_MAX_ZOOM, CELLS_PER_TILE_SHIFT, MAX_LATITUDE
+
+logger = logging.getLogger(__name__)
+
+# Try to import NumPy for vectorized binning
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+TILE_SIZE = 256
+
+# Density cells per tile side in JSON mode (4px cells)
+HEAT_BINS = 64
+
+# Pyramid zoom offset whose cells are exactly HEAT_BINS per tile
+_PYRAMID_OFFSET = int(math.log2(HEAT_BINS)) - CELLS_PER_TILE_SHIFT
+
+# Gradient matching the client heat layer: 0.4 blue, 0.65 lime, 1.0 red
+HEAT_GRADIENT = ((0.0, (0, 0, 255)), (0.4, (0, 0, 255)), (0.65, (0, 255, 0)), (1.0, (255, 0, 0)))
+
+DEFAULT_RADIUS = 15
+DEFAULT_SCALE = 10
+
+def tile_bounds(z, x, y):
+    """Return (west, south, east, north) of a Web Mercator tile"""
+    n = 2 ** z
+    def lat(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+def validate_tile(z, x, y):
+    """Raise ValueError for tile coordinates outside the pyramid"""
+    if not 0 <= z <= CLUSTER_MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise ValueError(f"tile {z}/{x}/{y} is out of range")
+
+def _tile_pixels(latitudes, longitudes, z, x, y, size):
+    """Project points to pixel coordinates inside tile (z, x, y) at `size` pixels per side"""
+    scale = 2 ** z * size
+    if HAS_NUMPY:
+        lat = np.clip(np.asarray(latitudes, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE)
+        sin_lat = np.sin(np.radians(lat))
+        px = (np.asarray(longitudes, dtype=np.float64) + 180.0) / 360.0 * scale - x * size
+        py = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale - y * size
+        return px, py
+    px, py = [], []
+    for lat, lon in zip(latitudes, longitudes):
+        sin_lat = math.sin(math.radians(max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))))
+        px.append((lon + 180.0) / 360.0 * scale - x * size)
+        py.append((0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale - y * size)
+    return px, py
+
+def _fetch_points(conn, bbox, library_ids, library_names, date_from, date_to):
+    """Coordinates of the matching photos, de-duplicated like the marker list and the pyramid"""
+    where_sql, params = build_marker_filters(bbox, library_ids, library_names, date_from, date_to,
+                                             spatial_index=has_spatial_index(conn))
+    duplicate_where_sql = None
+    if has_dedup_index(conn):
+        duplicate_where_sql, duplicate_params = build_marker_filters(bbox, library_ids, library_names,
+                                                                     date_from, date_to, alias='d')
+        params = params + duplicate_params
+    rows = conn.execute(f'''
+    SELECT latitude, longitude
+    FROM ({marker_query_sql(where_sql, duplicate_where_sql=duplicate_where_sql)})
+    ''', params).fetchall()
+    return [row[0] for row in rows], [row[1] for row in rows]
+
+def _bin_points(latitudes, longitudes, px, py, bins, pixels_per_bin):
+    """Sum counts and coordinates per bin; returns [(count, sum_lat, sum_lon)] keyed by bin index"""
+    if HAS_NUMPY:
+        bx = np.floor(np.asarray(px) / pixels_per_bin).astype(np.int64)
+        by = np.floor(np.asarray(py) / pixels_per_bin).astype(np.int64)
+        inside = (bx >= 0) & (bx < bins) & (by >= 0) & (by < bins)
+        index = by[inside] * bins + bx[inside]
+        counts = np.bincount(index, minlength=bins * bins)
+        sum_lat = np.bincount(index, weights=np.asarray(latitudes)[inside], minlength=bins * bins)
+        sum_lon = np.bincount(index, weights=np.asarray(longitudes)[inside], minlength=bins * bins)
+        occupied = np.nonzero(counts)[0]
+        return [(int(counts[i]), float(sum_lat[i]), float(sum_lon[i])) for i in occupied]
+
+    cells = {}
+    for lat, lon, x_px, y_px in zip(latitudes, longitudes, px, py):
+        bx, by = int(x_px // pixels_per_bin), int(y_px // pixels_per_bin)
+        if 0 <= bx < bins and 0 <= by < bins:
+            cell = cells.setdefault(by * bins + bx, [0, 0.0, 0.0])
+            cell[0] += 1
+            cell[1] += lat
+            cell[2] += lon
+    return [tuple(cells[key]) for key in sorted(cells)]
+
+def _pyramid_cells(conn, z, x, y, library_ids):
+    """Read the tile's density cells from the cluster pyramid (zoom z + offset)"""
+    pyramid_zoom = z + _PYRAMID_OFFSET
+    x_min, y_min = x * HEAT_BINS, y * HEAT_BINS
+    conditions = "zoom = ? AND cell_x BETWEEN ? AND ? AND cell_y BETWEEN ? AND ?"
+    params = [pyramid_zoom, x_min, x_min + HEAT_BINS - 1, y_min, y_min + HEAT_BINS - 1]
+    if library_ids:
+        conditions += f" AND library_id IN ({','.join('?' * len(library_ids))})"
+        params.extend(library_ids)
+    return conn.execute(f'''
+    SELECT SUM(count), SUM(sum_lat), SUM(sum_lon) FROM photo_clusters
+    WHERE {conditions}
+    GROUP BY cell_x, cell_y
+    ''', params).fetchall()
+
+def has_cluster_pyramid(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='photo_clusters'").fetchone() is not None
+
+def query_heat_tile(conn, z, x, y, library_ids=None, library_names=None, date_from=None, date_to=None):
+    """Return the density cells of one tile as [[latitude, longitude, count], ...]
+
+    Unfiltered-by-date tiles whose cells exist in the cluster pyramid are read
+    from it directly; other tiles bin the raw points (vectorized with NumPy
+    when available). Each point is the centroid of the photos in its cell.
+    """
+    validate_tile(z, x, y)
+    if (z + _PYRAMID_OFFSET <= CLUSTER_MAX_ZOOM and not (date_from or date_to or library_names)
+            and has_cluster_pyramid(conn)):
+        cells = _pyramid_cells(conn, z, x, y, library_ids)
+    else:
+        latitudes, longitudes = _fetch_points(conn, tile_bounds(z, x, y), library_ids, library_names, date_from, date_to)
+        if not latitudes:
+            return []
+        px, py = _tile_pixels(latitudes, longitudes, z, x, y, TILE_SIZE)
+        cells = _bin_points(latitudes, longitudes, px, py, HEAT_BINS, TILE_SIZE // HEAT_BINS)
+    return [[round(sum_lat / count, 5), round(sum_lon / count, 5), count] for count, sum_lat, sum_lon in cells]
+
+def _gradient_palette():
+    """256-entry RGBA palette: alpha and color both rise with density"""
+    palette = []
+    for i in range(256):
+        t = i / 255
+        for (t0, c0), (t1, c1) in zip(HEAT_GRADIENT, HEAT_GRADIENT[1:]):
+            if t <= t1:
+                f = 0 if t1 == t0 else (t - t0) / (t1 - t0)
+                palette.append(tuple(int(a + (b - a) * f) for a, b in zip(c0, c1)) + (min(255, int(t * 400)),))
+                break
+    return palette
+
+_PALETTE = _gradient_palette()
+
+def _pixel_counts(px, py, size, offset):
+    """Count points per pixel of a size x size grid; returns {pixel_index: count}"""
+    if HAS_NUMPY:
+        bx = np.floor(np.asarray(px) + offset).astype(np.int64)
+        by = np.floor(np.asarray(py) + offset).astype(np.int64)
+        inside = (bx >= 0) & (bx < size) & (by >= 0) & (by < size)
+        counts = np.bincount(by[inside] * size + bx[inside], minlength=size * size)
+        occupied = np.nonzero(counts)[0]
+        return dict(zip(occupied.tolist(), counts[occupied].tolist()))
+    counts = {}
+    for x_px, y_px in zip(px, py):
+        bx, by = int(math.floor(x_px + offset)), int(math.floor(y_px + offset))
+        if 0 <= bx < size and 0 <= by < size:
+            counts[by * size + bx] = counts.get(by * size + bx, 0) + 1
+    return counts
+
+def _heat_kernel(radius):
+    """Blurred disc stamped for every occupied pixel, like leaflet.heat's point sprite"""
+    size = 2 * radius + 1
+    kernel = Image.new('L', (size, size))
+    inner = radius * 0.6
+    ImageDraw.Draw(kernel).ellipse((radius - inner, radius - inner, radius + inner, radius + inner), fill=255)
+    return kernel.filter(ImageFilter.GaussianBlur(radius * 0.3))
+
+def render_heat_tile_png(conn, z, x, y, radius=DEFAULT_RADIUS, scale=DEFAULT_SCALE, library_ids=None,
+                         library_names=None, date_from=None, date_to=None):
+    """Render a 256x256 heat tile PNG for clients that cannot draw a heat layer themselves
+
+    Every occupied pixel stamps a blurred disc of `radius` whose opacity grows
+    with the log of its photo count (`scale` photos reach full opacity);
+    stamps accumulate like alpha compositing. The query covers a margin of
+    one radius around the tile so blobs do not break at tile edges.
+    """
+    validate_tile(z, x, y)
+    radius = max(1, min(64, int(radius)))
+    size = TILE_SIZE + 2 * radius
+
+    # Grow the query bounds by the margin (in tile units)
+    n = 2 ** z
+    margin = radius / TILE_SIZE
+    def lat(tile_y):
+        tile_y = max(0.0, min(float(n), tile_y))
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+    bbox = (max(-180.0, (x - margin) / n * 360.0 - 180.0), lat(y + 1 + margin),
+            min(180.0, (x + 1 + margin) / n * 360.0 - 180.0), lat(y - margin))
+
+    # Canvas has a further radius of padding so every stamp fits entirely
+    canvas = Image.new('L', (size + 2 * radius, size + 2 * radius))
+    latitudes, longitudes = _fetch_points(conn, bbox, library_ids, library_names, date_from, date_to)
+    if latitudes:
+        px, py = _tile_pixels(latitudes, longitudes, z, x, y, TILE_SIZE)
+        kernel = _heat_kernel(radius)
+        stamps = {}
+        log_scale = math.log1p(max(1, scale))
+        for index, count in _pixel_counts(px, py, size, radius).items():
+            level = min(255, int(255 * math.log1p(count) / log_scale))
+            if level not in stamps:
+                stamps[level] = kernel.point(lambda value: value * level // 255)
+            box = (index % size, index // size, index % size + kernel.width, index // size + kernel.height)
+            canvas.paste(ImageChops.screen(canvas.crop(box), stamps[level]), box)
+
+    image = canvas.crop((2 * radius, 2 * radius, 2 * radius + TILE_SIZE, 2 * radius + TILE_SIZE))
+    image.putpalette([channel for color in _PALETTE for channel in color], rawmode='RGBA')
+    buffer = io.BytesIO()
+    image.convert('RGBA').save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
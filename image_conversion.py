@@ -0,0 +1,49 @@
+# Browser-viewable JPEG conversions of HEIC photos, cached on disk by content
+import io
+import os
+import logging
+
+from PIL import Image
+
+from disk_cache import DiskCache
+
+logger = logging.getLogger(__name__)
+
+# Try to import HEIC support
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIC_SUPPORT = True
+except ImportError:
+    HEIC_SUPPORT = False
+
+DEFAULT_QUALITY = 90
+
+# Full-resolution conversions are several MB each, so this cache gets a larger default bound
+DEFAULT_CONVERSION_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+def conversion_key(photo_hash, quality, max_dimension=None):
+    """Cache key and ETag of a conversion: photo contents, JPEG quality and size limit"""
+    return f"{photo_hash}-q{quality}-{max_dimension or 'full'}"
+
+def conversion_cache_for_db(db_path, max_bytes=None):
+    """The conversion cache stored next to a database (data/conversions for data/photo_library.db)"""
+    root = os.path.join(os.path.dirname(os.path.abspath(db_path)), 'conversions')
+    return DiskCache(root, max_bytes or DEFAULT_CONVERSION_CACHE_MAX_BYTES)
+
+def convert_to_jpeg(image_path, quality=DEFAULT_QUALITY, max_dimension=None):
+    """Decode an image and re-encode it as JPEG, optionally bounded to max_dimension pixels"""
+    with Image.open(image_path) as img:
+        logger.debug(f"Converting {image_path}: format={img.format}, mode={img.mode}, size={img.size}")
+        if max_dimension:
+            img.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+        return buffer.getvalue()
+
+def get_converted_jpeg(cache, photo_hash, image_path, quality=DEFAULT_QUALITY, max_dimension=None):
+    """Return the path of a cached conversion, converting once on a miss"""
+    key = conversion_key(photo_hash, quality, max_dimension)
+    return cache.get_or_create(key, lambda: convert_to_jpeg(image_path, quality, max_dimension), '.jpg')
@@ -0,0 +1,125 @@
+# Serialized, pre-compressed /api/markers responses, invalidated when the database changes
+import gzip
+import hashlib
+import logging
+import threading
+import contextlib
+import collections
+
+# Try to import brotli for smaller responses (gzip is always available)
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+logger = logging.getLogger(__name__)
+
+# Distinct marker queries (e.g. viewports) kept per database version
+MAX_SNAPSHOTS = 32
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Encodings offered to clients, most preferred first
+ENCODINGS = (('br',) if HAS_BROTLI else ()) + ('gzip',)
+
+class Snapshot:
+    """A response body plus its compressed variants, each compressed on first request"""
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """Return (body, etag) for a content encoding (None for identity)"""
+        if encoding is None:
+            return self.body, self.etag
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == 'br':
+                    data = brotli.compress(self.body, quality=BROTLI_QUALITY)
+                else:
+                    data = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+                self._encoded[encoding] = data
+        # Each representation needs its own strong ETag
+        return data, f"{self.etag}-{encoding}"
+
+class MarkerSnapshotCache:
+    """Marker responses keyed by query, valid for one database version
+
+    version() must return a token that changes whenever the database does
+    (ReadOnlyConnectionPool.data_version), so commits from process_photos.py,
+    including watch mode, invalidate every snapshot without any signalling.
+    """
+
+    def __init__(self, version, max_snapshots=MAX_SNAPSHOTS):
+        self.version = version
+        self.max_snapshots = max_snapshots
+        self._version = None
+        self._snapshots = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._flights = {}  # key -> [lock, waiters] for builds in progress
+
+    def get(self, key, build, store=True):
+        """Return the Snapshot for key, calling build() for the response body (bytes) on a miss
+
+        Concurrent misses for the same key wait for the first one's build; misses
+        for other keys build in parallel. With store=False (one-off queries such
+        as exact viewports) the snapshot is shared with those waiters but not kept,
+        so it cannot evict the snapshots that are requested again.
+        """
+        version = self.version()
+        snapshot = self._lookup(version, key)
+        if snapshot is not None:
+            return snapshot
+        with self._single_flight((version, key)) as flight:
+            snapshot = self._lookup(version, key) or flight.get('snapshot')
+            if snapshot is not None:
+                return snapshot
+            body = build()
+            snapshot = flight['snapshot'] = Snapshot(body)
+            if store:
+                with self._lock:
+                    if version == self._version:
+                        self._snapshots[key] = snapshot
+                        while len(self._snapshots) > self.max_snapshots:
+                            self._snapshots.popitem(last=False)
+            logger.debug(f"Built marker snapshot for {key} ({len(body)} bytes)")
+            return snapshot
+
+    @contextlib.contextmanager
+    def _single_flight(self, key):
+        """Hold a lock for key shared by every thread missing on it; yields a dict the builder fills"""
+        with self._lock:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0, {}])
+            flight[1] += 1
+        try:
+            with flight[0]:
+                yield flight[2]
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                if not flight[1]:
+                    del self._flights[key]
+
+    def _lookup(self, version, key):
+        with self._lock:
+            if version != self._version:
+                if self._snapshots:
+                    logger.info("Database changed, discarding cached marker responses")
+                self._snapshots.clear()
+                self._version = version
+                return None
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None:
+                self._snapshots.move_to_end(key)
+            return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._snapshots.clear()
+            self._version = None
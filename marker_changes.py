@@ -0,0 +1,115 @@
+# Change log of the photos table, so map clients can sync markers incrementally
+import logging
+
+from marker_queries import build_marker_filters, has_dedup_index, marker_query_sql, row_to_marker
+
+logger = logging.getLogger(__name__)
+
+# Change log entries kept; clients further behind than this reload everything
+CHANGE_LOG_RETENTION = 100000
+
+# Clients with more changed photos than this are told to reload everything, which is cheaper
+MAX_CHANGED_PHOTOS = 5000
+
+# Photos fetched per query (stays below SQLite's host parameter limit)
+_ID_CHUNK = 500
+
+# Like the cluster pyramid, the log is fed by triggers, so every writer (ingest, watch mode,
+# tools) records its changes. AUTOINCREMENT keeps versions increasing even after pruning.
+# Updates are only logged when a column the map shows changes; marker_data is left out
+# because it only holds derived display hints that are rewritten in bulk. The de-duplication
+# triggers hide and reveal other photos, so is_duplicate flips are logged as updates too; the
+# marker query then reports the photo as deleted or as a marker to upsert.
+CHANGE_LOG_SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS photo_changes (
+  version INTEGER PRIMARY KEY AUTOINCREMENT,
+  photo_id INTEGER NOT NULL,
+  op TEXT NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS photos_change_insert AFTER INSERT ON photos
+BEGIN
+  INSERT INTO photo_changes (photo_id, op) VALUES (NEW.id, 'insert');
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_change_delete AFTER DELETE ON photos
+BEGIN
+  INSERT INTO photo_changes (photo_id, op) VALUES (OLD.id, 'delete');
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_change_update AFTER UPDATE ON photos
+WHEN OLD.filename IS NOT NEW.filename OR OLD.path IS NOT NEW.path
+  OR OLD.latitude IS NOT NEW.latitude OR OLD.longitude IS NOT NEW.longitude
+  OR OLD.datetime IS NOT NEW.datetime OR OLD.library_id IS NOT NEW.library_id
+BEGIN
+  INSERT INTO photo_changes (photo_id, op) VALUES (NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_change_duplicate AFTER UPDATE OF is_duplicate ON photos
+WHEN OLD.is_duplicate IS NOT NEW.is_duplicate
+BEGIN
+  INSERT INTO photo_changes (photo_id, op) VALUES (NEW.id, 'update');
+END;
+
+CREATE TRIGGER IF NOT EXISTS photo_changes_prune AFTER INSERT ON photo_changes
+BEGIN
+  DELETE FROM photo_changes WHERE version <= NEW.version - {CHANGE_LOG_RETENTION};
+END;
+'''
+
+def ensure_change_log(cursor):
+    """Create the photo_changes table and the triggers that fill it (after ensure_dedup_key)"""
+    cursor.executescript(CHANGE_LOG_SCHEMA)
+
+def current_change_version(conn):
+    """Return the latest change version (0 before any change), or None if the database has no change log"""
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='photo_changes'").fetchone() is None:
+        return None
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'photo_changes'").fetchone()
+    return row[0] if row else 0
+
+def query_marker_changes(conn, since):
+    """Return the marker changes after version since
+
+    Photos are reported once with their current state: "inserted" and
+    "updated" hold marker dicts (clients should upsert both), "deleted" the
+    ids of photos that were removed or lost their location. If the log no
+    longer reaches back to since, or too much changed, only {"version": ...,
+    "reset": True} is returned and the client should reload all markers.
+
+    Returns:
+        Dict with version and either reset or inserted, updated and deleted
+    """
+    version = current_change_version(conn)
+    oldest = conn.execute("SELECT MIN(version) FROM photo_changes").fetchone()[0]
+    # A since ahead of the log means the database was recreated
+    if since > version or (oldest is not None and since < oldest - 1):
+        return {"version": version, "reset": True}
+
+    first_ops = {}
+    for photo_id, op in conn.execute(
+        "SELECT photo_id, op FROM photo_changes WHERE version > ? AND version <= ? ORDER BY version",
+        (since, version)
+    ):
+        first_ops.setdefault(photo_id, op)
+    if len(first_ops) > MAX_CHANGED_PHOTOS:
+        return {"version": version, "reset": True}
+
+    ids = list(first_ops)
+    # Duplicates are looked for among all photos, not just the changed ones
+    duplicate_where_sql, duplicate_params = build_marker_filters(alias='d') if has_dedup_index(conn) else (None, [])
+    markers = []
+    for start in range(0, len(ids), _ID_CHUNK):
+        chunk = ids[start:start + _ID_CHUNK]
+        where_sql, params = build_marker_filters()
+        where_sql += f" AND p.id IN ({','.join('?' * len(chunk))})"
+        sql = marker_query_sql(where_sql, duplicate_where_sql=duplicate_where_sql)
+        markers.extend(row_to_marker(row) for row in conn.execute(sql, params + chunk + duplicate_params))
+
+    present = {marker['id'] for marker in markers}
+    return {
+        "version": version,
+        "inserted": [marker for marker in markers if first_ops[marker['id']] == 'insert'],
+        "updated": [marker for marker in markers if first_ops[marker['id']] != 'insert'],
+        "deleted": [photo_id for photo_id in ids if photo_id not in present]
+    }
@@ -0,0 +1,133 @@
+"""Compact columnar binary encoding of /api/markers responses
+
+Layout (all numbers little-endian):
+
+    4 bytes   magic b'PHM2'
+    uint32    length of the JSON header
+    ...       JSON header: {"count": n, "libraries": [...], "filenames_bytes": m,
+              "directories_bytes": k, ...} (viewport responses also carry bbox,
+              zoom and truncated), padded with spaces so the arrays below start
+              on a 4-byte boundary
+    int32[n]  photo id
+    float32[n] latitude
+    float32[n] longitude
+    int32[n]  library id (-1 if none)
+    int32[n]  datetime as seconds since 1970-01-01 of the naive local time
+              (INT32_MIN if unknown)
+    int32[n]  index into the filename table
+    int32[n]  index into the directory table: path is the entry followed by the
+              filename, or for -i - 1 entry i is the whole path
+    m bytes   filename table: unique filenames, UTF-8, NUL-separated
+    k bytes   directory table: unique path prefixes, UTF-8, NUL-separated
+
+Photos of a directory share one directory table entry, so paths cost little
+more than filenames. marker_data is not included.
+
+iter_markers_ndjson streams full markers as newline-delimited JSON instead:
+a header line ({"version": ..., "libraries": [...], ...}), one marker dict
+per line, and a closing {"done": true, "count": n, "truncated": ...} line
+whose absence tells the client the download was cut short.
+"""
+import sys
+import json
+import array
+import datetime
+
+from marker_queries import row_to_marker
+
+MARKER_BINARY_MIMETYPE = 'application/x-photo-markers'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Markers serialized per chunk of a streamed response
+STREAM_BATCH_SIZE = 1000
+
+MAGIC = b'PHM2'
+
+MISSING_DATETIME = -2 ** 31
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+def _epoch_seconds(value):
+    """Seconds since the epoch of an ISO datetime string, taken as naive (no time zone conversion)"""
+    try:
+        dt = datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return MISSING_DATETIME
+    seconds = int((dt.replace(tzinfo=None) - _EPOCH).total_seconds())
+    return seconds if MISSING_DATETIME < seconds < 2 ** 31 else MISSING_DATETIME
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+def encode_markers_binary(rows, libraries, **metadata):
+    """Encode marker query rows (MARKER_COLUMNS order) and the library list as the binary format
+
+    Args:
+        rows: Rows from marker_queries.query_marker_rows
+        libraries: Library dicts from marker_queries.query_libraries
+        **metadata: Extra JSON header fields (e.g. bbox, zoom, truncated)
+
+    Returns:
+        The encoded bytes
+    """
+    ids = array.array('i')
+    latitudes = array.array('f')
+    longitudes = array.array('f')
+    library_ids = array.array('i')
+    datetimes = array.array('i')
+    filename_indexes = array.array('i')
+    directory_indexes = array.array('i')
+    filenames = {}
+    directories = {}
+    for photo_id, filename, path, latitude, longitude, taken, _marker_data, library_id, _library_name in rows:
+        ids.append(photo_id)
+        latitudes.append(latitude)
+        longitudes.append(longitude)
+        library_ids.append(library_id if library_id is not None else -1)
+        datetimes.append(_epoch_seconds(taken))
+        filename = filename or ''
+        path = path or ''
+        filename_indexes.append(filenames.setdefault(filename, len(filenames)))
+        if filename and path.endswith(filename):
+            directory_indexes.append(directories.setdefault(path[:-len(filename)], len(directories)))
+        else:
+            directory_indexes.append(-directories.setdefault(path, len(directories)) - 1)
+    filename_table = '\0'.join(filenames).encode('utf-8')
+    directory_table = '\0'.join(directories).encode('utf-8')
+
+    header = dict(metadata, count=len(ids), libraries=libraries, filenames_bytes=len(filename_table),
+                  directories_bytes=len(directory_table))
+    header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    header += b' ' * (-len(header) % 4)
+    parts = [MAGIC, len(header).to_bytes(4, 'little'), header]
+    parts.extend(_little_endian(column) for column in
+                 (ids, latitudes, longitudes, library_ids, datetimes, filename_indexes, directory_indexes))
+    parts.extend((filename_table, directory_table))
+    return b''.join(parts)
+
+def iter_markers_ndjson(cursor, header, precision=None, limit=None, batch_size=STREAM_BATCH_SIZE):
+    """Yield NDJSON chunks (bytes) for a marker query cursor, batch_size rows at a time
+
+    Only one batch of rows is held at a time, so memory stays flat however
+    many photos the query returns.
+
+    Args:
+        cursor: Cursor from marker_queries.execute_marker_query
+        header: Dict for the first line (version, libraries, bbox, ...)
+        precision: Optional decimal places for coordinates (coordinate_precision)
+        limit: The query's limit, to report truncation in the closing line
+        batch_size: Rows fetched and serialized per chunk
+    """
+    yield (json.dumps(header, separators=(',', ':')) + '\n').encode('utf-8')
+    count = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        count += len(rows)
+        yield ''.join(json.dumps(row_to_marker(row, precision), separators=(',', ':')) + '\n'
+                      for row in rows).encode('utf-8')
+    trailer = {"done": True, "count": count, "truncated": bool(limit) and count >= limit}
+    yield (json.dumps(trailer, separators=(',', ':')) + '\n').encode('utf-8')
@@ -0,0 +1,387 @@
+# Shared SQL for the map endpoints: viewport (bbox), library and date filters over the photos table
+import json
+import math
+import sqlite3
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Columns returned for every marker
+MARKER_COLUMNS = ('id', 'filename', 'path', 'latitude', 'longitude', 'datetime',
+                  'marker_data', 'library_id', 'library_name')
+
+# Photos with the same filename at the same location (coordinates rounded to 4 decimals) are
+# shown once. quote() keeps a NULL filename apart from the text 'NULL'.
+def _dedup_key_sql(row):
+    return f"quote({row}.filename) || ',' || ROUND({row}.latitude, 4) || ',' || ROUND({row}.longitude, 4)"
+
+DEDUP_INDEX = 'idx_photos_dedup'
+
+# photos.dedup_key holds the key and photos.is_duplicate marks photos with a lower-id photo of
+# the same key. Like the cluster pyramid, both are kept current by triggers, so every writer
+# maintains them. The triggers' own updates never touch the columns they watch; their
+# is_duplicate flips feed the cluster pyramid and change log triggers.
+DEDUP_TRIGGERS = f'''
+CREATE TRIGGER IF NOT EXISTS photos_dedup_insert AFTER INSERT ON photos
+BEGIN
+  UPDATE photos SET dedup_key = {_dedup_key_sql('NEW')},
+    is_duplicate = EXISTS (SELECT 1 FROM photos d WHERE d.dedup_key = {_dedup_key_sql('NEW')} AND d.id < NEW.id)
+  WHERE id = NEW.id;
+  UPDATE photos SET is_duplicate = 1
+  WHERE dedup_key = {_dedup_key_sql('NEW')} AND id > NEW.id AND is_duplicate = 0;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_dedup_delete AFTER DELETE ON photos
+WHEN OLD.dedup_key IS NOT NULL AND OLD.is_duplicate = 0
+BEGIN
+  UPDATE photos SET is_duplicate = 0
+  WHERE id = (SELECT MIN(id) FROM photos WHERE dedup_key = OLD.dedup_key);
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_dedup_update AFTER UPDATE OF filename, latitude, longitude ON photos
+WHEN OLD.dedup_key IS NOT ({_dedup_key_sql('NEW')})
+BEGIN
+  UPDATE photos SET is_duplicate = 0
+  WHERE OLD.is_duplicate = 0 AND id = (SELECT MIN(id) FROM photos WHERE dedup_key = OLD.dedup_key AND id != NEW.id);
+  UPDATE photos SET dedup_key = {_dedup_key_sql('NEW')},
+    is_duplicate = EXISTS (SELECT 1 FROM photos d WHERE d.dedup_key = {_dedup_key_sql('NEW')} AND d.id < NEW.id)
+  WHERE id = NEW.id;
+  UPDATE photos SET is_duplicate = 1
+  WHERE dedup_key = {_dedup_key_sql('NEW')} AND id > NEW.id AND is_duplicate = 0;
+END;
+'''
+
+SPATIAL_INDEX = 'photos_rtree'
+
+# R*Tree over photo coordinates, so a viewport narrows latitude and longitude at once (idx_coords
+# only narrows latitude). Kept current by triggers like the other derived tables. R*Tree stores
+# 32-bit floats rounded outwards, so lookups also keep the exact coordinate test.
+SPATIAL_INDEX_SCHEMA = f'''
+CREATE VIRTUAL TABLE IF NOT EXISTS {SPATIAL_INDEX} USING rtree(id, min_lat, max_lat, min_lon, max_lon);
+
+CREATE TRIGGER IF NOT EXISTS photos_rtree_insert AFTER INSERT ON photos
+WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+BEGIN
+  INSERT INTO {SPATIAL_INDEX} VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_rtree_delete AFTER DELETE ON photos
+BEGIN
+  DELETE FROM {SPATIAL_INDEX} WHERE id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS photos_rtree_update AFTER UPDATE OF latitude, longitude ON photos
+BEGIN
+  DELETE FROM {SPATIAL_INDEX} WHERE id = OLD.id;
+  INSERT INTO {SPATIAL_INDEX}
+  SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+  WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+END;
+'''
+
+def parse_bbox(value):
+    """Parse 'west,south,east,north' into a tuple of floats
+
+    west > east describes a box crossing the antimeridian. Longitudes outside
+    -180..180 (Leaflet reports them after panning across the dateline) are
+    wrapped; a box spanning 360 degrees or more covers every longitude.
+
+    Raises:
+        ValueError: if the value is malformed
+    """
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4 or not all(math.isfinite(part) for part in parts):
+        raise ValueError("bbox must be 'west,south,east,north'")
+    west, south, east, north = parts
+    if south > north:
+        raise ValueError("bbox south must not be greater than north")
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west = ((west + 180) % 360) - 180
+        east = ((east + 180) % 360) - 180
+        if east == -180 and parts[2] > parts[0]:
+            east = 180.0
+    return west, max(south, -90.0), east, min(north, 90.0)
+
+def parse_library_filter(value):
+    """Split a comma-separated 'libraries' parameter into (ids, names)"""
+    ids, names = [], []
+    for token in (value or '').split(','):
+        token = token.strip()
+        if not token:
+            continue
+        if token.isdigit():
+            ids.append(int(token))
+        else:
+            names.append(token)
+    return ids, names
+
+def parse_date_bound(value, upper=False):
+    """Normalize a from/to parameter to an ISO string comparable with photos.datetime
+
+    A bare date used as an upper bound is moved to the next day, so 'to=2021-05-06'
+    includes photos taken on that day.
+
+    Raises:
+        ValueError: if the value is not an ISO date or datetime
+    """
+    if not value:
+        return None
+    if len(value) == 10:
+        day = datetime.date.fromisoformat(value)
+        if upper:
+            day += datetime.timedelta(days=1)
+        return day.isoformat()
+    return datetime.datetime.fromisoformat(value).isoformat()
+
+def bbox_condition(bbox, lat_column='latitude', lon_column='longitude', id_column=None):
+    """SQL condition and parameters selecting points inside bbox
+
+    With id_column (the photo id column, for databases where has_spatial_index
+    is true) candidates come from the photos_rtree index. Otherwise latitude,
+    the leading column of idx_coords, is an index range scan. A box crossing
+    the antimeridian becomes two longitude ranges.
+    """
+    west, south, east, north = bbox
+    if west <= east:
+        condition = f"{lat_column} BETWEEN ? AND ? AND {lon_column} BETWEEN ? AND ?"
+        params = [south, north, west, east]
+        rtree_ranges = [(west, east)]
+    else:
+        condition = f"{lat_column} BETWEEN ? AND ? AND ({lon_column} >= ? OR {lon_column} <= ?)"
+        params = [south, north, west, east]
+        rtree_ranges = [(west, math.inf), (-math.inf, east)]
+    if id_column is None:
+        return condition, params
+
+    lookups = []
+    rtree_params = []
+    for range_west, range_east in rtree_ranges:
+        lookups.append(f"SELECT id FROM {SPATIAL_INDEX} "
+                       "WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?")
+        rtree_params.extend([south, north, range_west, range_east])
+    return (f"{id_column} IN ({' UNION ALL '.join(lookups)}) AND {condition}",
+            rtree_params + params)
+
+def build_marker_filters(bbox=None, library_ids=None, library_names=None, date_from=None, date_to=None, alias='p',
+                         spatial_index=False):
+    """Build the WHERE clause shared by the marker, cluster and heat queries
+
+    Args:
+        bbox: Optional (west, south, east, north)
+        library_ids: Optional list of library ids
+        library_names: Optional list of library names (requires libraries joined as l)
+        date_from: Optional inclusive lower bound from parse_date_bound
+        date_to: Optional exclusive upper bound from parse_date_bound(upper=True)
+        alias: Table alias of photos in the query
+        spatial_index: Look bbox up through photos_rtree (see has_spatial_index)
+
+    Returns:
+        Tuple of (where_sql, params); where_sql always starts with 'WHERE'
+    """
+    conditions = [f"{alias}.latitude IS NOT NULL AND {alias}.longitude IS NOT NULL"]
+    params = []
+    if bbox is not None:
+        condition, bbox_params = bbox_condition(bbox, f"{alias}.latitude", f"{alias}.longitude",
+                                                f"{alias}.id" if spatial_index else None)
+        conditions.append(condition)
+        params.extend(bbox_params)
+    library_terms = []
+    if library_ids:
+        library_terms.append(f"{alias}.library_id IN ({','.join('?' * len(library_ids))})")
+        params.extend(library_ids)
+    if library_names:
+        library_terms.append(f"l.name IN ({','.join('?' * len(library_names))})")
+        params.extend(library_names)
+    if library_terms:
+        conditions.append('(' + ' OR '.join(library_terms) + ')')
+    if date_from:
+        conditions.append(f"{alias}.datetime >= ?")
+        params.append(date_from)
+    if date_to:
+        conditions.append(f"{alias}.datetime < ?")
+        params.append(date_to)
+    return 'WHERE ' + ' AND '.join(conditions), params
+
+def coordinate_precision(zoom):
+    """Decimal places needed to place a marker within a pixel at the given zoom level"""
+    degrees_per_pixel = 360.0 / (256 * 2 ** max(0, zoom))
+    return max(1, math.ceil(-math.log10(degrees_per_pixel)) + 1)
+
+def query_libraries(conn):
+    """Return all libraries as dicts with source_dirs decoded"""
+    cursor = conn.execute("SELECT id, name, description, source_dirs, last_updated FROM libraries")
+    columns = [column[0] for column in cursor.description]
+    libraries = []
+    for row in cursor.fetchall():
+        lib = dict(zip(columns, row))
+        # Parse source_dirs from JSON string
+        try:
+            lib['source_dirs'] = json.loads(lib['source_dirs']) if lib['source_dirs'] else []
+        except Exception:
+            lib['source_dirs'] = []
+        libraries.append(lib)
+    return libraries
+
+def ensure_dedup_key(cursor):
+    """Add photos.dedup_key and photos.is_duplicate, their index and triggers
+
+    For an existing database, both columns are filled in for every photo.
+    """
+    cursor.execute("PRAGMA table_info(photos)")
+    columns = [column[1] for column in cursor.fetchall()]
+    if 'dedup_key' not in columns:
+        logger.info("Adding de-duplication keys to photos")
+        cursor.execute("ALTER TABLE photos ADD COLUMN dedup_key TEXT")
+        cursor.execute("ALTER TABLE photos ADD COLUMN is_duplicate INTEGER NOT NULL DEFAULT 0")
+        cursor.execute(f"UPDATE photos SET dedup_key = {_dedup_key_sql('photos')}")
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (DEDUP_INDEX,))
+    if cursor.fetchone() is None:
+        cursor.execute(f"CREATE INDEX {DEDUP_INDEX} ON photos(dedup_key, id)")
+        cursor.execute('''
+        UPDATE photos SET is_duplicate = EXISTS (
+            SELECT 1 FROM photos d WHERE d.dedup_key = photos.dedup_key AND d.id < photos.id
+        )
+        ''')
+    cursor.executescript(DEDUP_TRIGGERS)
+
+def ensure_spatial_index(cursor):
+    """Create photos_rtree and its triggers, filling it for an existing database
+
+    Returns:
+        False if this SQLite build has no R*Tree module (bbox lookups then use idx_coords)
+    """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE name=?", (SPATIAL_INDEX,))
+    exists = cursor.fetchone() is not None
+    try:
+        cursor.executescript(SPATIAL_INDEX_SCHEMA)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"R*Tree spatial index unavailable, bbox lookups will use idx_coords: {e}")
+        return False
+    if not exists:
+        logger.info("Building R*Tree spatial index of photo coordinates")
+        cursor.execute(f'''
+        INSERT INTO {SPATIAL_INDEX}
+        SELECT id, latitude, latitude, longitude, longitude FROM photos
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        ''')
+    return True
+
+def has_spatial_index(conn):
+    """Whether photos_rtree exists and this SQLite build can read it"""
+    try:
+        conn.execute(f"SELECT 1 FROM {SPATIAL_INDEX} LIMIT 0")
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+def has_dedup_index(conn):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name=?", (DEDUP_INDEX,)
+    ).fetchone() is not None
+
+def marker_query_sql(where_sql, limit=None, duplicate_where_sql=None):
+    """The de-duplicating marker query for WHERE clauses from build_marker_filters
+
+    Of the photos matching the filters, the lowest id per filename and location
+    is kept, preventing duplicates from the same location while allowing
+    same-named photos from different locations to appear on the map.
+
+    With duplicate_where_sql (the same filters built with alias='d', whose
+    parameters follow where_sql's) the query streams through the matching
+    photos: only those flagged is_duplicate are checked, through the dedup_key
+    index, for a lower-id duplicate that also matches the filters. Without it,
+    ROW_NUMBER partitions and sorts the whole filtered set, for databases that
+    lack the index.
+    """
+    if duplicate_where_sql is not None:
+        sql = f'''
+    SELECT
+        p.id, p.filename, p.path, p.latitude, p.longitude, p.datetime,
+        p.marker_data, p.library_id, l.name as library_name
+    FROM photos p
+    LEFT JOIN libraries l ON p.library_id = l.id
+    {where_sql}
+    AND (p.is_duplicate = 0 OR NOT EXISTS (
+        SELECT 1 FROM photos d
+        LEFT JOIN libraries l ON d.library_id = l.id
+        {duplicate_where_sql} AND d.dedup_key = p.dedup_key AND d.id < p.id
+    ))
+    '''
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return sql
+
+    sql = f'''
+    WITH RankedPhotos AS (
+        SELECT
+            p.id, p.filename, p.path, p.latitude, p.longitude, p.datetime,
+            p.marker_data, p.library_id, l.name as library_name,
+            ROW_NUMBER() OVER(PARTITION BY p.filename, ROUND(p.latitude, 4), ROUND(p.longitude, 4) ORDER BY p.id) as rn
+        FROM photos p
+        LEFT JOIN libraries l ON p.library_id = l.id
+        {where_sql}
+    )
+    SELECT
+        id, filename, path, latitude, longitude, datetime,
+        marker_data, library_id, library_name
+    FROM RankedPhotos
+    WHERE rn = 1
+    '''
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
+def row_to_marker(row, precision=None):
+    """Convert a marker query row to the JSON shape the frontend expects"""
+    photo = dict(zip(MARKER_COLUMNS, row))
+    # Parse marker_data from JSON string if available
+    if photo['marker_data']:
+        try:
+            photo['marker_data'] = json.loads(photo['marker_data'])
+        except Exception:
+            photo['marker_data'] = {}
+    else:
+        photo['marker_data'] = {}
+    if precision is not None:
+        photo['latitude'] = round(photo['latitude'], precision)
+        photo['longitude'] = round(photo['longitude'], precision)
+    return photo
+
+def execute_marker_query(conn, bbox=None, library_ids=None, library_names=None, date_from=None, date_to=None,
+                         limit=None):
+    """Run the de-duplicated marker query and return the cursor, for callers that stream its rows"""
+    where_sql, params = build_marker_filters(bbox, library_ids, library_names, date_from, date_to,
+                                             spatial_index=bbox is not None and has_spatial_index(conn))
+    duplicate_where_sql = None
+    if has_dedup_index(conn):
+        duplicate_where_sql, duplicate_params = build_marker_filters(bbox, library_ids, library_names,
+                                                                     date_from, date_to, alias='d')
+        params = params + duplicate_params
+    return conn.execute(marker_query_sql(where_sql, limit, duplicate_where_sql), params)
+
+def query_marker_rows(conn, bbox=None, library_ids=None, library_names=None, date_from=None, date_to=None,
+                      limit=None):
+    """Return the raw de-duplicated marker rows (MARKER_COLUMNS) matching the filters"""
+    return execute_marker_query(conn, bbox, library_ids, library_names, date_from, date_to, limit).fetchall()
+
+def query_markers(conn, bbox=None, library_ids=None, library_names=None, date_from=None, date_to=None,
+                  zoom=None, limit=None):
+    """Return de-duplicated markers matching the filters
+
+    Args:
+        conn: sqlite3 connection
+        bbox: Optional (west, south, east, north) viewport
+        library_ids, library_names: Optional library filters
+        date_from, date_to: Optional bounds from parse_date_bound
+        zoom: Optional map zoom; coordinates are rounded to what that zoom can display
+        limit: Optional maximum number of markers
+
+    Returns:
+        List of marker dicts
+    """
+    precision = coordinate_precision(zoom) if zoom is not None else None
+    rows = query_marker_rows(conn, bbox, library_ids, library_names, date_from, date_to, limit)
+    return [row_to_marker(row, precision) for row in rows]
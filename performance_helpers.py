@@ -0,0 +1,310 @@
+# Adaptive tuning helpers for photo processing: worker counts, batch sizes, SQLite settings
+import os
+import time
+import hashlib
+import logging
+import threading
+import functools
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Rough CPU cost of extracting metadata from one file (header parse + hash), in milliseconds
+ESTIMATED_CPU_MS_PER_FILE = 2.0
+
+# Upper bound for I/O-bound thread pools; beyond this, contention outweighs extra overlap
+MAX_IO_WORKERS = 32
+
+# Assumed peak memory per in-flight item (file bytes being hashed/parsed plus its result)
+ESTIMATED_BYTES_PER_ITEM = 256 * 1024
+
+# Share of available memory batches may occupy
+BATCH_MEMORY_FRACTION = 0.05
+
+# Number of files read to estimate storage latency, and how much of each is read
+LATENCY_SAMPLE_FILES = 8
+LATENCY_READ_SIZE = 64 * 1024
+
+# Entries kept by the file hash cache
+HASH_CACHE_SIZE = 65536
+
+_latency_cache = {}
+
+def get_cpu_count():
+    """Number of CPUs this process may run on (respects affinity masks and container cpusets)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def get_available_memory():
+    """Return available physical memory in bytes, or None if it cannot be determined"""
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def _sample_files(path, limit):
+    """Return up to limit regular files under path (breadth-first, stops early)"""
+    files = []
+    pending = deque([path])
+    while pending and len(files) < limit:
+        try:
+            with os.scandir(pending.popleft()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        pending.append(entry.path)
+                    elif entry.is_file() and len(files) < limit:
+                        files.append(entry.path)
+        except OSError:
+            continue
+    return files
+
+def _is_cached(fd, length):
+    """Whether the first length bytes of fd are already in the page cache, or None if the OS cannot tell
+
+    A RWF_NOWAIT read only succeeds from cached pages, so probing leaves the cache untouched.
+    """
+    if not hasattr(os, 'RWF_NOWAIT'):
+        return None
+    try:
+        return os.preadv(fd, [bytearray(length)], 0, os.RWF_NOWAIT) > 0
+    except BlockingIOError:
+        return False
+    except OSError:
+        return None
+
+def measure_storage_latency(path, samples=LATENCY_SAMPLE_FILES):
+    """Estimate the median latency in milliseconds of reading the first 64KB of a file under path
+
+    Only files that are not already cached are timed where the OS can tell, so the
+    value reflects the device (local SSD, spinning disk, network mount) rather than
+    RAM without evicting anyone's cached pages; the files read are ones about to be
+    ingested anyway. Falls back to cached reads when every sampled file is cached.
+    Results are cached per path. Returns None when no files can be read.
+    """
+    path = os.path.abspath(path)
+    if path in _latency_cache:
+        return _latency_cache[path]
+
+    cold_timings = []
+    warm_timings = []
+    # Look at a few more files than needed, since some may already be cached
+    for file_path in _sample_files(path, samples * 4):
+        if len(cold_timings) >= samples:
+            break
+        try:
+            with open(file_path, 'rb') as f:
+                cached = _is_cached(f.fileno(), LATENCY_READ_SIZE)
+                if cached and len(warm_timings) >= samples:
+                    continue
+                start = time.perf_counter()
+                f.read(LATENCY_READ_SIZE)
+                elapsed = (time.perf_counter() - start) * 1000
+        except OSError:
+            continue
+        (warm_timings if cached else cold_timings).append(elapsed)
+
+    timings = cold_timings or warm_timings
+    latency = sorted(timings)[len(timings) // 2] if timings else None
+    _latency_cache[path] = latency
+    if latency is not None:
+        logger.info(f"Measured storage read latency for {path}: {latency:.2f} ms")
+    return latency
+
+def get_optimal_worker_count(task_type='io', path=None):
+    """Choose a worker count for a task type
+
+    Args:
+        task_type: 'cpu' (one worker per CPU), 'io' (scaled by storage latency)
+            or 'mixed' (halfway between the two)
+        path: Directory whose storage latency should be measured for I/O tasks
+
+    Returns:
+        Number of workers
+    """
+    cpus = get_cpu_count()
+    if task_type == 'cpu':
+        return cpus
+
+    # While one worker waits on a read, others can use the CPU: size the pool so the
+    # CPUs stay busy, i.e. cpus * (1 + wait time / compute time)
+    latency = measure_storage_latency(path) if path else None
+    if latency is None:
+        workers = cpus * 2
+    else:
+        workers = round(cpus * (1 + latency / ESTIMATED_CPU_MS_PER_FILE))
+
+    if task_type == 'mixed':
+        workers = (workers + cpus) // 2
+    return max(2, min(MAX_IO_WORKERS, workers))
+
+def optimize_batch_processing(batch_size=100):
+    """Derive processing and database batch sizes from available memory
+
+    Args:
+        batch_size: Minimum (and fallback) batch size
+
+    Returns:
+        Tuple of (processing_batch_size, db_batch_size)
+    """
+    available = get_available_memory()
+    if available is None:
+        return batch_size, batch_size
+
+    budget_items = int(available * BATCH_MEMORY_FRACTION / ESTIMATED_BYTES_PER_ITEM)
+    processing_batch_size = max(batch_size, min(5000, budget_items))
+    # Larger transactions amortize commits, but keep them short enough for concurrent readers
+    db_batch_size = max(batch_size, min(2000, processing_batch_size))
+    return processing_batch_size, db_batch_size
+
+class PerformanceMonitor:
+    """Track throughput, per-item latency percentiles and ETA of a long-running job
+
+    Progress is logged at WARNING level because the processing loops raise the
+    log level to WARNING while they run.
+    """
+
+    def __init__(self, name, total=None, report_interval=10.0, max_samples=10000):
+        self.name = name
+        self.total = total
+        self.report_interval = report_interval
+        self.items = 0
+        self.start_time = None
+        self.end_time = None
+        self._last_report = 0.0
+        self._latencies = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def start(self, total=None):
+        """Start (or restart) timing; total enables ETA reporting"""
+        if total is not None:
+            self.total = total
+        self.items = 0
+        self._latencies.clear()
+        self.start_time = self._last_report = time.perf_counter()
+        self.end_time = None
+
+    def update(self, count=1, duration=None):
+        """Record completed items
+
+        Args:
+            count: Number of items completed
+            duration: Seconds the item took, measured where it ran; without it only
+                throughput is recorded (the gap between completions of parallel
+                workers is not a latency)
+        """
+        if self.start_time is None:
+            self.start()
+        now = time.perf_counter()
+        with self._lock:
+            self.items += count
+            if duration is not None:
+                self._latencies.append(duration)
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                logger.warning(self.format_stats())
+
+    def percentile(self, fraction):
+        """Per-item latency in seconds at the given fraction (0.5 = median), or None"""
+        with self._lock:
+            ordered = sorted(self._latencies)
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    def get_stats(self):
+        """Return a dict with items, elapsed, rate, p50/p95/p99 (seconds) and eta (seconds or None)"""
+        end = self.end_time or time.perf_counter()
+        elapsed = end - self.start_time if self.start_time else 0.0
+        rate = self.items / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total and rate > 0:
+            eta = max(0.0, (self.total - self.items) / rate)
+        return {
+            'items': self.items,
+            'total': self.total,
+            'elapsed': elapsed,
+            'rate': rate,
+            'p50': self.percentile(0.50),
+            'p95': self.percentile(0.95),
+            'p99': self.percentile(0.99),
+            'eta': eta,
+        }
+
+    def format_stats(self):
+        """One-line progress summary"""
+        stats = self.get_stats()
+        progress = f"{stats['items']}/{stats['total']}" if stats['total'] else f"{stats['items']}"
+        line = f"{self.name}: {progress} items, {stats['rate']:.1f}/s"
+        if stats['p50'] is not None:
+            line += f", latency p50 {stats['p50'] * 1000:.1f} ms p95 {stats['p95'] * 1000:.1f} ms p99 {stats['p99'] * 1000:.1f} ms"
+        if stats['eta'] is not None:
+            line += f", ETA {stats['eta']:.0f}s"
+        return line
+
+    def stop(self):
+        """Stop timing, log a summary and return (items, elapsed_seconds)"""
+        if self.start_time is None:
+            return 0, 0.0
+        self.end_time = time.perf_counter()
+        logger.warning(f"{self.format_stats()} (finished in {self.end_time - self.start_time:.2f}s)")
+        return self.items, self.end_time - self.start_time
+
+@functools.lru_cache(maxsize=HASH_CACHE_SIZE)
+def _cached_file_md5(path, size, mtime_ns):
+    """MD5 of a file's full contents, cached on (path, size, mtime_ns)"""
+    file_hash = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+def fast_file_hash_cached(path):
+    """Return the MD5 of a file's full contents, reusing the result while size and mtime are unchanged
+
+    The digest equals hashlib.md5(open(path, 'rb').read()).hexdigest(), so it
+    matches the hashes already stored in the photos table.
+    """
+    stat = os.stat(path)
+    return _cached_file_md5(path, stat.st_size, stat.st_mtime_ns)
+
+def optimize_sqlite_connection(conn, file_size_mb=None):
+    """Apply SQLite settings scaled to the database size and available memory
+
+    Args:
+        conn: sqlite3 connection
+        file_size_mb: Current database size in MB, if known
+
+    Returns:
+        Dict of the resulting PRAGMA values
+    """
+    db_mb = file_size_mb or 0
+    available = get_available_memory()
+    available_mb = available / (1024 * 1024) if available else 1024
+
+    # Page cache: a quarter of the database, at least 16MB, at most 10% of free RAM or 512MB
+    cache_mb = max(16, min(db_mb * 0.25, available_mb * 0.1, 512))
+    # Memory-map the whole database plus growth room, capped at 1GB
+    mmap_mb = min(1024, max(64, db_mb * 1.5 + 64))
+
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{int(cache_mb * 1024)}")  # Negative values are KiB
+    conn.execute(f"PRAGMA mmap_size={int(mmap_mb * 1024 * 1024)}")
+    # Fewer, larger checkpoints for big databases keep bulk inserts fast
+    conn.execute(f"PRAGMA wal_autocheckpoint={10000 if db_mb > 500 else 1000}")
+    conn.execute("PRAGMA busy_timeout=30000")
+
+    settings = {}
+    for pragma in ["journal_mode", "cache_size", "synchronous", "temp_store", "mmap_size", "wal_autocheckpoint"]:
+        settings[pragma] = conn.execute(f"PRAGMA {pragma}").fetchone()[0]
+    return settings
@@ -84,8 +84,23 @@ if ! $PYTHON_PATH --version &>/dev/null; then
   echo "Using alternative Python path: $PYTHON_PATH"
 fi
 
+# Use WATCH_MODE=false to go back to periodic cron rescans
+: ${WATCH_MODE:="true"}
+
 # Add library processing jobs to the cron file
-if [ -s /app/logs/libraries.txt ]; then
+if [ "$WATCH_MODE" = "true" ] && [ -s /app/logs/libraries.txt ]; then
+  # One watch daemon per library: an initial scan, then inotify (or polling on network mounts)
+  while IFS=: read -r LIB_PATH LIB_NAME; do
+    (
+      while true; do
+        $PYTHON_PATH /app/process_photos.py --process "$LIB_PATH" --library "$LIB_NAME" --db /app/data/photo_library.db --watch ${WATCH_POLL_INTERVAL:+--poll-interval "$WATCH_POLL_INTERVAL"} >> "/app/logs/watch_${LIB_NAME}.log" 2>&1
+        echo "$(date +"%Y-%m-%d %H:%M:%S"): Watcher for $LIB_NAME exited, restarting in 10s" >> "/app/logs/watch_${LIB_NAME}.log"
+        sleep 10
+      done
+    ) &
+    echo "Started watch mode for library: $LIB_NAME"
+  done < /app/logs/libraries.txt
+elif [ -s /app/logs/libraries.txt ]; then
   while IFS=: read -r LIB_PATH LIB_NAME; do
     # Format properly for /etc/cron.d/ - use bash -c to wrap the entire command
     echo "${UPDATE_INTERVAL} root bash -c 'cd /app && $PYTHON_PATH /app/process_photos.py --process \"${LIB_PATH}\" --library \"${LIB_NAME}\" --db /app/data/photo_library.db >> /app/logs/cron_${LIB_NAME}.log 2>&1'" >> /etc/cron.d/process_photos
@@ -98,7 +113,11 @@ fi
 # Set proper permissions for the cron file
 chmod 0644 /etc/cron.d/process_photos
 
-echo "Photo processing schedule set up with interval: $UPDATE_INTERVAL"
+if [ "$WATCH_MODE" = "true" ]; then
+  echo "Photo libraries are ingested continuously by watch mode"
+else
+  echo "Photo processing schedule set up with interval: $UPDATE_INTERVAL"
+fi
 echo "Crontab file contents:"
 cat /etc/cron.d/process_photos
 
@@ -6,16 +6,25 @@ from datetime import datetime
 from PIL import Image
 from PIL.ExifTags import TAGS, GPSTAGS
 import hashlib
+import io
 import concurrent.futures
 import sys
 import logging
 import time
 import multiprocessing
+import threading
+import queue
+import itertools
 import pickle
 import shelve
 import pathlib
 from functools import partial
 from contextlib import closing
+from scan_functions import iter_file_records, scan_directory_entries, build_signature_tree, stat_file_record
+from cluster_pyramid import ensure_cluster_tables, update_cluster_pyramid, reset_cluster_pyramid
+from marker_changes import ensure_change_log
+from marker_queries import ensure_dedup_key, ensure_spatial_index
+from thumbnails import thumbnail_cache_for_db, pregenerate_thumbnails
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -48,12 +57,26 @@ except ImportError:
     logger.warning("To enable HEIC support, install with: pip install pillow-heif")
     HEIC_SUPPORT = False
 
+# Header-only EXIF parser (no pixel decoding); Pillow is only used when it fails
+try:
+    from exif_header import parse_exif_header
+    HAS_EXIF_HEADER = True
+except ImportError:
+    logger.debug("exif_header module not found, using Pillow for all EXIF parsing")
+    HAS_EXIF_HEADER = False
+
+# RAW formats that Pillow cannot open; their metadata is read with exifread instead
+RAW_EXTENSIONS = ('.dng', '.nef', '.cr2', '.arw')
+
+# File extensions picked up by the incremental scanner and the watch daemon
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.heic', '.tiff', '.bmp', '.nef', '.cr2', '.arw', '.dng')
+
 def get_image_hash(image_path):
     """Create a simple hash of the image file to identify duplicates"""
     try:
         # Import our optimized performance functions if available
         try:
-            from optimize_performance import fast_file_hash_cached
+            from performance_helpers import fast_file_hash_cached
             return fast_file_hash_cached(image_path)
         except ImportError:
             # Fall back to the original method
@@ -278,6 +301,154 @@ def extract_gps(image_path):
     
     return None, None
 
+# EXIF tag IDs used by the single-pass extractor
+EXIF_IFD_TAG = 0x8769
+GPS_IFD_TAG = 0x8825
+ORIENTATION_TAG = 0x0112
+DATETIME_ORIGINAL_TAG = 0x9003
+
+def read_image_bytes(image_path):
+    """Read an image file in a single pass so every metadata stage can share the buffer"""
+    with open(image_path, 'rb') as f:
+        return f.read()
+
+def get_image_hash_from_bytes(data):
+    """Hash an in-memory image buffer (same digest as get_image_hash)"""
+    return hashlib.md5(data).hexdigest()
+
+def parse_exif_datetime(value):
+    """Convert an EXIF 'YYYY:MM:DD HH:MM:SS' value to ISO format, or None"""
+    if isinstance(value, bytes):
+        value = value.decode('ascii', errors='ignore')
+    try:
+        return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').isoformat()
+    except (ValueError, TypeError):
+        return None
+
+def _metadata_from_pillow(data):
+    """Parse GPS, DateTimeOriginal and orientation from an in-memory image with Pillow"""
+    lat = lon = dt = orientation = None
+    with Image.open(io.BytesIO(data)) as img:
+        exif_data = get_exif_data(img)
+        if not exif_data:
+            return lat, lon, dt, orientation
+        
+        orientation = exif_data.get(ORIENTATION_TAG)
+        
+        # DateTimeOriginal lives in the Exif sub-IFD; older Pillow flattens it into the top level
+        exif_ifd = exif_data.get_ifd(EXIF_IFD_TAG) if hasattr(exif_data, 'get_ifd') else {}
+        dt = parse_exif_datetime(exif_ifd.get(DATETIME_ORIGINAL_TAG) or exif_data.get(DATETIME_ORIGINAL_TAG))
+        
+        # GPSInfo may be an IFD offset (int) in the top level, so resolve it as a sub-IFD
+        if hasattr(exif_data, 'get_ifd'):
+            gps_raw = exif_data.get_ifd(GPS_IFD_TAG)
+        else:
+            gps_raw = exif_data.get(GPS_IFD_TAG)
+        if isinstance(gps_raw, dict) and gps_raw:
+            gps_info = {GPSTAGS.get(tag, tag): val for tag, val in gps_raw.items()}
+            if 'GPSLatitude' in gps_info and 'GPSLongitude' in gps_info:
+                lat = get_decimal_from_dms(gps_info['GPSLatitude'], gps_info.get('GPSLatitudeRef'))
+                lon = get_decimal_from_dms(gps_info['GPSLongitude'], gps_info.get('GPSLongitudeRef'))
+    return lat, lon, dt, orientation
+
+def _gps_from_piexif(data):
+    """Fallback GPS parse of an in-memory buffer with piexif"""
+    exif_dict = piexif.load(data)
+    gps = exif_dict.get('GPS') or {}
+    if piexif.GPSIFD.GPSLatitude in gps and piexif.GPSIFD.GPSLongitude in gps:
+        lat = get_decimal_from_dms(gps[piexif.GPSIFD.GPSLatitude], gps.get(piexif.GPSIFD.GPSLatitudeRef))
+        lon = get_decimal_from_dms(gps[piexif.GPSIFD.GPSLongitude], gps.get(piexif.GPSIFD.GPSLongitudeRef))
+        return lat, lon
+    return None, None
+
+def _metadata_from_exifread(data):
+    """Fallback parse of an in-memory buffer with exifread (handles DNG and other RAW formats)"""
+    lat = lon = dt = orientation = None
+    tags = exifread.process_file(io.BytesIO(data), details=False)
+    if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
+        lat_ref = str(tags.get('GPS GPSLatitudeRef', 'N'))
+        lon_ref = str(tags.get('GPS GPSLongitudeRef', 'E'))
+        lat = get_decimal_from_dms([float(v.num) / float(v.den) if v.den else 0.0
+                                    for v in tags['GPS GPSLatitude'].values], lat_ref)
+        lon = get_decimal_from_dms([float(v.num) / float(v.den) if v.den else 0.0
+                                    for v in tags['GPS GPSLongitude'].values], lon_ref)
+    if 'EXIF DateTimeOriginal' in tags:
+        dt = parse_exif_datetime(str(tags['EXIF DateTimeOriginal']))
+    if 'Image Orientation' in tags:
+        try:
+            orientation = int(tags['Image Orientation'].values[0])
+        except (IndexError, TypeError, ValueError):
+            pass
+    return lat, lon, dt, orientation
+
+def extract_metadata(image_path, data=None):
+    """Extract GPS, DateTimeOriginal, orientation and hash from a single read of the file
+    
+    extract_gps, extract_datetime and get_image_hash each open the file on their own;
+    this stage reads it once and feeds the same buffer to every parser and the hasher.
+    
+    Args:
+        image_path: Path of the image (used for format hints and the ctime fallback)
+        data: Optional file contents if the caller has already read them
+        
+    Returns:
+        dict with latitude, longitude, datetime, orientation and hash keys
+    """
+    if data is None:
+        data = read_image_bytes(image_path)
+    
+    lat = lon = dt = orientation = None
+    lower_path = image_path.lower()
+    
+    # Try the pure-Python header parser first; it never touches pixel data or the HEIF decoder.
+    # When it parses the file, piexif/exifread only run for a GPS IFD it could not resolve:
+    # they read the same tags, so a photo that simply has no GPS gains nothing from them.
+    header = parse_exif_header(data) if HAS_EXIF_HEADER else None
+    if header is not None:
+        lat, lon = header['latitude'], header['longitude']
+        dt, orientation = header['datetime'], header['orientation']
+        use_fallbacks = header['gps_unresolved']
+    else:
+        use_fallbacks = True
+        if not lower_path.endswith(RAW_EXTENSIONS):
+            # Pillow cannot open most RAW formats, so go straight to exifread for those
+            try:
+                lat, lon, dt, orientation = _metadata_from_pillow(data)
+            except Exception as e:
+                logger.debug(f"Pillow metadata extraction failed for {image_path}: {e}")
+    
+    # Some phones (e.g. Samsung Galaxy S24+) write GPS data neither parser above can resolve
+    if use_fallbacks and (lat is None or lon is None) and HAS_PIEXIF and not lower_path.endswith('.heic'):
+        try:
+            lat, lon = _gps_from_piexif(data)
+        except Exception as e:
+            logger.debug(f"piexif GPS extraction failed for {image_path}: {e}")
+    
+    if use_fallbacks and (lat is None or lon is None or dt is None) and HAS_EXIFREAD:
+        try:
+            er_lat, er_lon, er_dt, er_orientation = _metadata_from_exifread(data)
+            if lat is None or lon is None:
+                lat, lon = er_lat, er_lon
+            dt = dt or er_dt
+            orientation = orientation or er_orientation
+        except Exception as e:
+            logger.debug(f"exifread metadata extraction failed for {image_path}: {e}")
+    
+    if dt is None:
+        # No EXIF timestamp, fall back to file creation time
+        try:
+            dt = datetime.fromtimestamp(os.path.getctime(image_path)).isoformat()
+        except OSError:
+            dt = None
+    
+    return {
+        'latitude': lat,
+        'longitude': lon,
+        'datetime': dt,
+        'orientation': orientation,
+        'hash': get_image_hash_from_bytes(data)
+    }
+
 def process_image(image_path):
     """Process a single image and return its metadata"""
     try:
@@ -302,6 +473,7 @@ def process_image(image_path):
                     'latitude': None,
                     'longitude': None,
                     'datetime': None,
+                    'orientation': None,
                     'hash': get_image_hash(image_path)  # Use optimized hash function
                 }
         except OSError:
@@ -317,72 +489,21 @@ def process_image(image_path):
                 'latitude': None,
                 'longitude': None,
                 'datetime': None,
+                'orientation': None,
                 'hash': get_image_hash(image_path)  # Use optimized hash function
             }
         
-        # Handle DNG files which Pillow may not be able to open directly
-        if filename.lower().endswith('.dng'):
-            # Try to get basic info without opening with Pillow
-            hash_value = get_image_hash(image_path)
-            try:
-                file_time = os.path.getctime(image_path)
-                dt = datetime.fromtimestamp(file_time).isoformat()
-            except:
-                dt = None
-            
-            # For DNG files, try using exifread for GPS data
-            lat, lon = None, None
-            if HAS_EXIFREAD:
-                try:
-                    with open(image_path, 'rb') as f:
-                        tags = exifread.process_file(f)
-                        if 'GPS GPSLatitude' in tags and 'GPS GPSLongitude' in tags:
-                            lat_ref = str(tags.get('GPS GPSLatitudeRef', 'N'))
-                            lon_ref = str(tags.get('GPS GPSLongitudeRef', 'E'))
-                            
-                            lat = tags['GPS GPSLatitude'].values
-                            lon = tags['GPS GPSLongitude'].values
-                            
-                            # Convert to decimal degrees
-                            lat_val = float(lat[0].num) / float(lat[0].den) + \
-                                  float(lat[1].num) / float(lat[1].den) / 60 + \
-                                  float(lat[2].num) / float(lat[2].den) / 3600
-                                  
-                            lon_val = float(lon[0].num) / float(lon[0].den) + \
-                                  float(lon[1].num) / float(lon[1].den) / 60 + \
-                                  float(lon[2].num) / float(lon[2].den) / 3600
-                                  
-                            if lat_ref == 'S':
-                                lat_val = -lat_val
-                            if lon_ref == 'W':
-                                lon_val = -lon_val
-                                
-                            logger.debug(f"Extracted DNG GPS via exifread: {lat_val}, {lon_val}")
-                            lat, lon = lat_val, lon_val
-                except Exception as e:
-                    logger.debug(f"DNG GPS extraction failed: {e}")
-            
-            return {
-                'filename': filename,
-                'path': image_path,
-                'latitude': lat,
-                'longitude': lon,
-                'datetime': dt,
-                'hash': hash_value
-            }
-            
-        # Continue processing for supported files
-        lat, lon = extract_gps(image_path)
-        dt = extract_datetime(image_path)
-        img_hash = get_image_hash(image_path)
+        # Single-pass extraction: one read feeds GPS, datetime, orientation and the hash
+        metadata = extract_metadata(image_path)
         
         return {
             'filename': filename,
             'path': image_path,
-            'latitude': lat,
-            'longitude': lon,
-            'datetime': dt,
-            'hash': img_hash
+            'latitude': metadata['latitude'],
+            'longitude': metadata['longitude'],
+            'datetime': metadata['datetime'],
+            'orientation': metadata['orientation'],
+            'hash': metadata['hash']
         }
     except Exception as e:
         logger.error(f"Error processing {image_path}: {e}")
@@ -564,7 +685,7 @@ def process_directory(root_dir, db_path='photo_library.db', max_workers=None, in
     # Calculate optimal batch size for processing
     try:
         from performance_helpers import optimize_batch_processing
-        batch_size = optimize_batch_processing(500)  # Start with 500 as default
+        batch_size, _ = optimize_batch_processing(500)  # Start with 500 as default
         logger.info(f"Using optimized batch size: {batch_size}")
     except ImportError:
         # Use a reasonable default if helper not available
@@ -753,6 +874,7 @@ def process_directory(root_dir, db_path='photo_library.db', max_workers=None, in
                   # Final commit - wrapped in try/except to avoid issues        
             try:
                 if conn is not None and hasattr(conn, 'commit'):
+                    update_cluster_pyramid(conn.cursor())
                     conn.commit()
                     conn.close()
                 print(f"Processing complete. {processed_count} images processed, {inserted_count} images inserted into database.")
@@ -852,6 +974,12 @@ def clean_database(db_path='photo_library.db'):
     
     # Delete all records
     cursor.execute("DELETE FROM photos")
+    reset_cluster_pyramid(cursor)
+    
+    # Forget file states too, otherwise the next incremental run would treat every file as unchanged
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='file_state'")
+    if cursor.fetchone():
+        cursor.execute("DELETE FROM file_state")
     conn.commit()
     
     # Reset auto-increment if the sqlite_sequence table exists
@@ -873,7 +1001,7 @@ def optimize_sqlite_connection(conn):
     try:
         # Try to use the optimized version from the performance module
         try:
-            from optimize_performance import optimize_sqlite_connection as optimized_sqlite
+            from performance_helpers import optimize_sqlite_connection as optimized_sqlite
             
             # Get database file size if available
             db_size_mb = None
@@ -921,24 +1049,8 @@ def optimize_sqlite_connection(conn):
         logger.warning(f"Failed to apply some SQLite optimizations: {e}")
         return {}
 
-def create_directory_hash(dir_path):
-    """Create a hash representing the directory contents and modification times"""
-    dir_hash = hashlib.md5()
-    for root, dirs, files in os.walk(dir_path):
-        # Add folder path
-        dir_hash.update(root.encode())
-        
-        # Add file names and modification times
-        for file in sorted(files):  # Sort for consistent results
-            if file.lower().endswith(('.jpg', '.jpeg', '.png', '.heic', '.tiff', '.bmp', '.nef', '.cr2', '.arw', '.dng')):
-                full_path = os.path.join(root, file)
-                try:
-                    mtime = str(os.path.getmtime(full_path))
-                    dir_hash.update(f"{file}{mtime}".encode())
-                except OSError:
-                    pass  # Skip files with access issues
-    
-    return dir_hash.hexdigest()
+# Format version of the directory cache (2 = per-directory signature tree)
+DIRECTORY_CACHE_VERSION = 2
 
 def get_directory_cache(cache_path):
     """Load cached directory information if available"""
@@ -1052,15 +1164,620 @@ def batch_insert_photos(cursor, batch):
     
     return inserted
 
+# Fields of the compact tuples that process-pool workers send back to the parent
+PHOTO_RESULT_FIELDS = ('filename', 'path', 'latitude', 'longitude', 'datetime', 'orientation', 'hash')
+
+# Executor modes for metadata extraction
+EXECUTOR_MODES = ('thread', 'process', 'auto')
+
+# Number of files timed in auto mode before choosing an executor
+AUTO_EXECUTOR_SAMPLE_SIZE = 16
+
+# Fraction of wall time spent on CPU above which extraction is considered GIL-bound
+AUTO_EXECUTOR_CPU_THRESHOLD = 0.5
+
+def timed_process_image(path):
+    """process_image() plus the seconds it took, measured in the worker that ran it"""
+    start = time.perf_counter()
+    result = process_image(path)
+    return result, time.perf_counter() - start
+
+def process_image_chunk(paths):
+    """Process a chunk of images in a worker process
+    
+    Returns a list of (path, tuple, seconds) triples where tuple follows
+    PHOTO_RESULT_FIELDS (or is None), which is much cheaper to pickle back than
+    one dict per photo.
+    """
+    results = []
+    for path in paths:
+        result, duration = timed_process_image(path)
+        if result:
+            results.append((path, tuple(result[field] for field in PHOTO_RESULT_FIELDS), duration))
+        else:
+            results.append((path, None, duration))
+    return results
+
+def choose_executor_mode(sample_paths):
+    """Pick 'thread' or 'process' by timing extraction of a few files
+    
+    Threads are fine while extraction mostly waits on I/O; once CPU time dominates
+    wall time the pure-Python EXIF parsing serializes on the GIL and processes win.
+    The sampled files stay in the page cache, so processing them again is cheap.
+    """
+    if not sample_paths:
+        return 'thread'
+    
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    for path in sample_paths:
+        process_image(path)
+    cpu_time = time.thread_time() - cpu_start
+    wall_time = time.perf_counter() - wall_start
+    
+    cpu_ratio = cpu_time / wall_time if wall_time > 0 else 1.0
+    mode = 'process' if cpu_ratio >= AUTO_EXECUTOR_CPU_THRESHOLD else 'thread'
+    logger.info(f"Auto executor: CPU {cpu_time:.3f}s / wall {wall_time:.3f}s over {len(sample_paths)} files "
+                f"(I/O wait {max(0.0, wall_time - cpu_time):.3f}s), using {mode} pool")
+    return mode
+
+def iter_batch_results(executor, executor_mode, batch, chunk_size):
+    """Submit a batch to the executor and yield (path, result dict or None, seconds or None) as work completes
+    
+    seconds is the extraction time measured in the worker (None if the worker failed).
+    """
+    if executor_mode == 'process':
+        chunks = [batch[i:i+chunk_size] for i in range(0, len(batch), chunk_size)]
+        future_to_chunk = {executor.submit(process_image_chunk, chunk): chunk for chunk in chunks}
+        for future in concurrent.futures.as_completed(future_to_chunk):
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                for path in future_to_chunk[future]:
+                    logger.error(f"Error processing {path}: {e}")
+                    yield path, None, None
+                continue
+            for path, values, duration in chunk_results:
+                yield path, dict(zip(PHOTO_RESULT_FIELDS, values)) if values else None, duration
+    else:
+        future_to_path = {executor.submit(timed_process_image, path): path for path in batch}
+        for future in concurrent.futures.as_completed(future_to_path):
+            path = future_to_path[future]
+            try:
+                result, duration = future.result()
+            except Exception as e:
+                logger.error(f"Error processing {path}: {e}")
+                yield path, None, None
+                continue
+            yield path, result, duration
+
+# SQL used by every photo insert path
+INSERT_PHOTO_SQL = "INSERT INTO photos (filename, path, latitude, longitude, datetime, hash, library_id, marker_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+# Streaming pipeline defaults: bounded queue sizes and writer commit thresholds
+PIPELINE_QUEUE_SIZE = 1000
+PIPELINE_COMMIT_SIZE = 500
+PIPELINE_COMMIT_INTERVAL = 2.0
+PIPELINE_PROCESS_CHUNK_SIZE = 16
+
+# Sentinel telling the writer thread that no more results are coming
+_WRITER_STOP = object()
+
+# Seconds the producer waits on a full queue before checking that the writer is still alive
+PIPELINE_PUT_TIMEOUT = 1.0
+
+def iter_streaming_work(cursor, library_id, root_dir, image_extensions, scan_stats=None):
+    """Walk root_dir one directory at a time, comparing each with its file_state rows
+    
+    Only one directory's rows are held in memory at a time. Yields
+    ('extract', FileRecord, modified) for new and modified files and
+    ('apply', changes) for moves, deletions and photos adopted from other
+    ingest modes, which the writer thread applies. Moves across directories are
+    seen as a deletion plus a new file. Directories that disappeared are purged
+    once the walk is done.
+    
+    Args:
+        cursor: Read-only cursor (the writer thread owns all writes)
+        library_id: Library being ingested
+        root_dir: Directory to walk
+        image_extensions: Tuple of lowercase extensions to match
+        scan_stats: Optional dict whose 'total_files' and 'unchanged' counts are updated
+    """
+    if scan_stats is not None:
+        scan_stats.setdefault('total_files', 0)
+        scan_stats.setdefault('unchanged', 0)
+    visited = set()
+    stack = [root_dir]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            records, subdirs = scan_directory_entries(dir_path, image_extensions)
+        except OSError as e:
+            logger.debug(f"Error scanning directory {dir_path}: {e}")
+            continue
+        visited.add(dir_path)
+        stack.extend(subdirs)
+        
+        changes = classify_file_changes(records, load_file_state_rows(cursor, library_id, dirs=[dir_path]))
+        existing = existing_photo_hashes(cursor, library_id, [record.path for record in changes['new']])
+        changes['adopted'] = [(record, existing[record.path]) for record in changes['new'] if record.path in existing]
+        if scan_stats is not None:
+            scan_stats['total_files'] += len(records)
+            scan_stats['unchanged'] += changes['unchanged'] + len(changes['adopted'])
+        if changes['moved'] or changes['deleted'] or changes['adopted']:
+            yield 'apply', changes
+        for record in changes['new']:
+            if record.path not in existing:
+                yield 'extract', record, False
+        for record in changes['modified']:
+            yield 'extract', record, True
+    
+    # Rows of directories that no longer exist were never listed above
+    low, high = _path_prefix_range(root_dir)
+    cursor.execute("SELECT DISTINCT dir FROM file_state WHERE library_id = ? AND (dir = ? OR (dir >= ? AND dir < ?))",
+                   (library_id, root_dir, low, high))
+    gone = [row[0] for row in cursor.fetchall() if row[0] not in visited]
+    if gone:
+        yield 'apply', {'moved': [], 'deleted': load_file_state_rows(cursor, library_id, dirs=gone), 'adopted': []}
+
+class PhotoWriterThread(threading.Thread):
+    """Dedicated SQLite writer for the streaming pipeline
+    
+    Drains extraction results and file_state changes from result_queue and
+    stores them on its own connection with store_extracted_results, committing
+    whenever commit_size results are pending or commit_interval seconds have
+    passed, so the first photos land in the database within seconds. An
+    exception ends the thread and is kept in self.error for the producer.
+    """
+    
+    def __init__(self, db_path, library_id, result_queue, include_all=False,
+                 commit_size=PIPELINE_COMMIT_SIZE, commit_interval=PIPELINE_COMMIT_INTERVAL):
+        super().__init__(name="photo-writer", daemon=True)
+        self.db_path = db_path
+        self.library_id = library_id
+        self.result_queue = result_queue
+        self.include_all = include_all
+        self.commit_size = commit_size
+        self.commit_interval = commit_interval
+        self.inserted_count = 0
+        self.commit_count = 0
+        self.error = None
+    
+    def run(self):
+        try:
+            self._drain()
+        except Exception as e:
+            logger.error(f"Photo writer failed: {e}")
+            self.error = e
+    
+    def _drain(self):
+        conn = sqlite3.connect(self.db_path)
+        optimize_sqlite_connection(conn)
+        cursor = conn.cursor()
+        pending = []
+        last_commit = time.monotonic()
+        try:
+            while True:
+                timeout = max(0.01, self.commit_interval - (time.monotonic() - last_commit))
+                try:
+                    item = self.result_queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                
+                if item is _WRITER_STOP:
+                    break
+                if item is not None:
+                    pending.append(item)
+                
+                interval_elapsed = time.monotonic() - last_commit >= self.commit_interval
+                if len(pending) >= self.commit_size or (pending and interval_elapsed):
+                    self._flush(cursor, pending)
+                    pending = []
+                    last_commit = time.monotonic()
+                elif interval_elapsed:
+                    last_commit = time.monotonic()
+            
+            if pending:
+                self._flush(cursor, pending)
+        finally:
+            conn.close()
+    
+    def _flush(self, cursor, items):
+        results = []
+        file_records = {}
+        modified_paths = set()
+        for item in items:
+            if item[0] == 'apply':
+                changes = item[1]
+                apply_file_moves_and_deletions(cursor, self.library_id, changes)
+                upsert_file_state(cursor, self.library_id, changes['adopted'])
+            else:
+                _, record, modified, result = item
+                results.append((record.path, result))
+                file_records[record.path] = record
+                if modified:
+                    modified_paths.add(record.path)
+        # Stores photos and file_state, folds the batch into the cluster pyramid and commits
+        inserted = store_extracted_results(cursor, self.library_id, results, self.include_all,
+                                           file_records, modified_paths)
+        self.inserted_count += inserted
+        self.commit_count += 1
+        logger.debug(f"Writer committed {inserted} photos ({self.inserted_count} total)")
+
+def run_streaming_pipeline(work, db_path, library_id, include_all=False, max_workers=4, executor_mode='thread',
+                           queue_size=PIPELINE_QUEUE_SIZE, commit_size=PIPELINE_COMMIT_SIZE,
+                           commit_interval=PIPELINE_COMMIT_INTERVAL, performance_monitor=None):
+    """Run scan -> extract -> insert as overlapping stages
+    
+    work is consumed lazily (normally iter_streaming_work), at most queue_size files
+    are in flight in the extractor pool and at most queue_size items wait for the
+    writer, so memory stays flat regardless of library size.
+    
+    Returns:
+        Tuple of (processed_count, inserted_count)
+        
+    Raises:
+        RuntimeError: If the writer thread died; nothing more can be stored
+    """
+    result_queue = queue.Queue(maxsize=queue_size)
+    writer = PhotoWriterThread(db_path, library_id, result_queue, include_all, commit_size, commit_interval)
+    writer.start()
+    
+    def send(item):
+        # Blocks when the writer falls behind, which throttles extraction, but never on a dead writer
+        while True:
+            try:
+                result_queue.put(item, timeout=PIPELINE_PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if not writer.is_alive():
+                    raise RuntimeError(f"Photo writer stopped: {writer.error}") from writer.error
+    
+    if executor_mode == 'process':
+        executor_class = concurrent.futures.ProcessPoolExecutor
+        chunk_size = PIPELINE_PROCESS_CHUNK_SIZE
+    else:
+        executor_class = concurrent.futures.ThreadPoolExecutor
+        chunk_size = 1
+    max_in_flight = max(max_workers * 2, queue_size // chunk_size)
+    processed_count = 0
+    
+    def forward(done_futures):
+        nonlocal processed_count
+        for future in done_futures:
+            chunk = in_flight.pop(future)
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                logger.error(f"Error processing chunk: {e}")
+                continue
+            for (record, modified), (_, values, duration) in zip(chunk, chunk_results):
+                processed_count += 1
+                if performance_monitor:
+                    performance_monitor.update(duration=duration)
+                if values:
+                    send(('result', record, modified, dict(zip(PHOTO_RESULT_FIELDS, values))))
+    
+    stopped = False
+    try:
+        with executor_class(max_workers=max_workers) as executor:
+            in_flight = {}
+            chunk = []
+            for item in itertools.chain(work, [None]):
+                if item is not None and item[0] == 'apply':
+                    send(item)
+                    continue
+                if item is not None:
+                    chunk.append(item[1:])
+                    if len(chunk) < chunk_size:
+                        continue
+                if not chunk:
+                    continue
+                if len(in_flight) >= max_in_flight:
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    forward(done)
+                in_flight[executor.submit(process_image_chunk, [record.path for record, _ in chunk])] = chunk
+                chunk = []
+            
+            for future in concurrent.futures.as_completed(list(in_flight)):
+                forward([future])
+        send(_WRITER_STOP)
+        stopped = True
+    finally:
+        if not stopped:
+            # Let a live writer commit what it already has before the error propagates
+            try:
+                send(_WRITER_STOP)
+            except RuntimeError:
+                pass
+        writer.join()
+    
+    if writer.error is not None:
+        raise RuntimeError(f"Photo writer stopped: {writer.error}") from writer.error
+    logger.info(f"Writer made {writer.commit_count} commits")
+    return processed_count, writer.inserted_count
+
+def _path_prefix_range(root_dir):
+    """Return (low, high) bounds matching every path under root_dir in an indexed range query"""
+    prefix = os.path.join(root_dir, '')
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def file_state_has_rows(cursor, library_id):
+    """Check whether the file_state index has been populated for a library"""
+    cursor.execute("SELECT 1 FROM file_state WHERE library_id = ? LIMIT 1", (library_id,))
+    return cursor.fetchone() is not None
+
+def load_file_state_rows(cursor, library_id, root_dir=None, dirs=None):
+    """Load (path, size, mtime_ns, inode, hash) rows sorted by path
+    
+    Either every row under root_dir (one indexed range scan) or only the rows
+    of the given directories (used when the signature tree limits the scan).
+    """
+    if dirs is None:
+        low, high = _path_prefix_range(root_dir)
+        cursor.execute(
+            "SELECT path, size, mtime_ns, inode, hash FROM file_state "
+            "WHERE library_id = ? AND path >= ? AND path < ? ORDER BY path",
+            (library_id, low, high)
+        )
+        return cursor.fetchall()
+    
+    rows = []
+    for dir_path in dirs:
+        cursor.execute(
+            "SELECT path, size, mtime_ns, inode, hash FROM file_state WHERE library_id = ? AND dir = ?",
+            (library_id, dir_path)
+        )
+        rows.extend(cursor.fetchall())
+    rows.sort()
+    return rows
+
+def classify_file_changes(records, state_rows):
+    """Classify scanned files against the file_state index in one sorted merge
+    
+    Args:
+        records: FileRecord list from the scanner
+        state_rows: (path, size, mtime_ns, inode, hash) rows sorted by path
+        
+    Returns:
+        dict with 'new' and 'modified' FileRecord lists, 'deleted' state rows,
+        'moved' (state_row, FileRecord) pairs and an 'unchanged' count
+    """
+    records = sorted(records)
+    new, modified, deleted = [], [], []
+    unchanged = 0
+    i = j = 0
+    while i < len(records) or j < len(state_rows):
+        if j >= len(state_rows) or (i < len(records) and records[i].path < state_rows[j][0]):
+            new.append(records[i])
+            i += 1
+        elif i >= len(records) or state_rows[j][0] < records[i].path:
+            deleted.append(state_rows[j])
+            j += 1
+        else:
+            record, row = records[i], state_rows[j]
+            if record.size != row[1] or record.mtime_ns != row[2]:
+                modified.append(record)
+            else:
+                unchanged += 1
+            i += 1
+            j += 1
+    
+    # A deleted path and a new path sharing inode, size and mtime is a move/rename, not new
+    # content; the mtime check guards against inode reuse after delete + copy
+    moved = []
+    deleted_by_inode = {(row[3], row[1], row[2]): row for row in deleted if row[3]}
+    still_new = []
+    for record in new:
+        row = deleted_by_inode.pop((record.inode, record.size, record.mtime_ns), None) if record.inode else None
+        if row is not None:
+            moved.append((row, record))
+        else:
+            still_new.append(record)
+    moved_paths = {row[0] for row, _ in moved}
+    deleted = [row for row in deleted if row[0] not in moved_paths]
+    
+    return {'new': still_new, 'modified': modified, 'deleted': deleted, 'moved': moved, 'unchanged': unchanged}
+
+def upsert_file_state(cursor, library_id, entries):
+    """Bulk insert or replace file_state rows from (FileRecord, hash) pairs"""
+    cursor.executemany(
+        "INSERT OR REPLACE INTO file_state (path, library_id, dir, size, mtime_ns, inode, hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(record.path, library_id, os.path.dirname(record.path), record.size, record.mtime_ns, record.inode, file_hash)
+         for record, file_hash in entries]
+    )
+
+def purge_photos(cursor, library_id, paths):
+    """Delete photos (and their file_state rows) for paths that no longer exist"""
+    cursor.executemany("DELETE FROM photos WHERE library_id = ? AND path = ?", [(library_id, path) for path in paths])
+    cursor.executemany("DELETE FROM file_state WHERE library_id = ? AND path = ?", [(library_id, path) for path in paths])
+
+def adopt_existing_photos(cursor, library_id, root_dir, records):
+    """Seed file_state from photos already in the database (first run with the index)
+    
+    Scanned files that already have a photos row are recorded as unchanged so they
+    are not re-extracted; photos rows whose file is gone are purged.
+    
+    Returns:
+        Tuple of (adopted_count, purged_count)
+    """
+    low, high = _path_prefix_range(root_dir)
+    cursor.execute(
+        "SELECT path, hash FROM photos WHERE library_id = ? AND path >= ? AND path < ? ORDER BY path",
+        (library_id, low, high)
+    )
+    photo_rows = cursor.fetchall()
+    
+    records = sorted(records)
+    adopted, stale = [], []
+    i = j = 0
+    while j < len(photo_rows):
+        if i < len(records) and records[i].path < photo_rows[j][0]:
+            i += 1
+        elif i < len(records) and records[i].path == photo_rows[j][0]:
+            adopted.append((records[i], photo_rows[j][1]))
+            i += 1
+            j += 1
+        else:
+            stale.append(photo_rows[j][0])
+            j += 1
+    
+    upsert_file_state(cursor, library_id, adopted)
+    if stale:
+        purge_photos(cursor, library_id, stale)
+    return len(adopted), len(stale)
+
+def existing_photo_hashes(cursor, library_id, paths, chunk_size=500):
+    """Return {path: hash} for the paths that already have a photos row in the library"""
+    paths = list(paths)
+    found = {}
+    for i in range(0, len(paths), chunk_size):
+        chunk = paths[i:i+chunk_size]
+        cursor.execute(
+            f"SELECT path, hash FROM photos WHERE library_id = ? AND path IN ({', '.join('?' * len(chunk))})",
+            [library_id] + chunk
+        )
+        found.update(cursor.fetchall())
+    return found
+
+def adopt_untracked_photos(cursor, library_id, records):
+    """Record file_state for new files that already have a photos row
+    
+    Rows written by modes that do not maintain file_state (--legacy, or runs
+    before the index existed) would otherwise be extracted again and inserted
+    a second time; they are adopted as unchanged, like on the first run.
+    
+    Returns:
+        The records that still need extracting
+    """
+    existing = existing_photo_hashes(cursor, library_id, [record.path for record in records])
+    if not existing:
+        return records
+    upsert_file_state(cursor, library_id, [(record, existing[record.path]) for record in records
+                                           if record.path in existing])
+    return [record for record in records if record.path not in existing]
+
+def apply_file_moves_and_deletions(cursor, library_id, changes):
+    """Update photos for moved files and purge photos whose files were deleted"""
+    for row, record in changes['moved']:
+        old_path = row[0]
+        new_filename = os.path.basename(record.path)
+        cursor.execute("SELECT id, datetime FROM photos WHERE library_id = ? AND path = ?", (library_id, old_path))
+        for photo_id, photo_datetime in cursor.fetchall():
+            cursor.execute(
+                "UPDATE photos SET path = ?, filename = ?, marker_data = ? WHERE id = ?",
+                (record.path, new_filename, create_marker_data({'filename': new_filename, 'datetime': photo_datetime}), photo_id)
+            )
+        cursor.execute("DELETE FROM file_state WHERE library_id = ? AND path = ?", (library_id, old_path))
+        upsert_file_state(cursor, library_id, [(record, row[4])])
+    
+    if changes['deleted']:
+        purge_photos(cursor, library_id, [row[0] for row in changes['deleted']])
+
+def update_modified_photos(cursor, photos):
+    """Rewrite the metadata of photos whose files changed; returns those that had no row yet"""
+    missing = []
+    for photo in photos:
+        cursor.execute(
+            "UPDATE photos SET filename = ?, latitude = ?, longitude = ?, datetime = ?, hash = ?, marker_data = ? "
+            "WHERE library_id = ? AND path = ?",
+            (photo['filename'], photo['latitude'], photo['longitude'], photo['datetime'], photo['hash'],
+             photo['marker_data'], photo['library_id'], photo['path'])
+        )
+        if cursor.rowcount == 0:
+            missing.append(photo)
+    return missing
+
+def store_extracted_results(cursor, library_id, results, include_all=False, file_records=None, modified_paths=()):
+    """Write a batch of extraction results to photos and file_state, then commit
+    
+    Args:
+        cursor: Database cursor
+        library_id: Library the photos belong to
+        results: List of (path, metadata dict or None) from process_image
+        include_all: Keep photos without GPS coordinates
+        file_records: Optional {path: FileRecord} whose file_state should be recorded
+        modified_paths: Paths that may already have a photos row to update
+        
+    Returns:
+        Number of photos inserted
+    """
+    file_records = file_records or {}
+    new_photos = []
+    updated_photos = []
+    stale_paths = []
+    states = []
+    
+    for path, result in results:
+        if not result:
+            continue
+        
+        # Record the file's state even when it is not stored, so it is not extracted again
+        if path in file_records:
+            states.append((file_records[path], result['hash']))
+        
+        # If include_all is True, keep all photos regardless of GPS data
+        # Otherwise, only keep photos with GPS coordinates
+        if include_all or (result['latitude'] and result['longitude']):
+            # Add marker data and library ID
+            result['marker_data'] = create_marker_data(result)
+            result['library_id'] = library_id
+            if path in modified_paths:
+                updated_photos.append(result)
+            else:
+                new_photos.append(result)
+        elif path in modified_paths:
+            # An edit removed the GPS data; drop the stale map entry
+            stale_paths.append(path)
+    
+    # A path without file_state may still have a row from another ingest mode; update it in place
+    if new_photos:
+        existing = existing_photo_hashes(cursor, library_id, [photo['path'] for photo in new_photos])
+        if existing:
+            updated_photos.extend(photo for photo in new_photos if photo['path'] in existing)
+            new_photos = [photo for photo in new_photos if photo['path'] not in existing]
+    
+    # Modified files update their existing rows; any without a row are inserted
+    if updated_photos:
+        new_photos.extend(update_modified_photos(cursor, updated_photos))
+    if stale_paths:
+        cursor.executemany("DELETE FROM photos WHERE library_id = ? AND path = ?",
+                           [(library_id, path) for path in stale_paths])
+    if states:
+        upsert_file_state(cursor, library_id, states)
+    
+    inserted = 0
+    if new_photos:
+        try:
+            # Use more efficient batched insert with executemany
+            cursor.executemany(
+                INSERT_PHOTO_SQL,
+                [(photo['filename'], photo['path'], photo['latitude'], photo['longitude'],
+                  photo['datetime'], photo['hash'], photo['library_id'], photo['marker_data']) for photo in new_photos]
+            )
+            inserted = len(new_photos)
+        except Exception as e:
+            logger.error(f"Error inserting batch: {e}")
+            # Try inserting one by one as fallback
+            inserted = batch_insert_photos(cursor, new_photos)
+    
+    # Fold this batch (and any purges before it) into the cluster pyramid in the same transaction
+    update_cluster_pyramid(cursor)
+    cursor.connection.commit()
+    return inserted
+
 def process_directory_incremental(root_dir, db_path='photo_library.db', max_workers=None, include_all=False, 
-                          library_name="Default", use_cache=True, resume=True, use_parallel_scan=True):
+                          library_name="Default", use_cache=True, resume=True, use_parallel_scan=True,
+                          executor_mode='thread', streaming=False, use_file_state=True):
     """Fast incremental processing with optimizations:
     - Uses multiprocessing for parallel directory scanning
-    - Uses thread pool for parallel image processing
+    - Uses a thread or process pool for parallel image processing (executor_mode: thread, process or auto)
+    - Optional streaming mode that overlaps scanning, extraction and inserts (see run_streaming_pipeline)
     - Optional directory cache for avoiding redundant scans
     - SQLite optimizations (WAL mode, memory settings)
     - Resume capability for interrupted operations
     - Directory change detection to skip unchanged directories
+    - Persistent file_state index: new, modified, moved and deleted files are detected per run
     - Optimized batch sizes for better performance    - Fast file hashing without loading entire files into memory
     """
     
@@ -1091,27 +1808,16 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
     ensure_database_initialized(db_path)
       # Try to use optimized performance settings
     try:
-        # First try the simple performance helpers module
-        try:
-            from performance_helpers import get_optimal_worker_count, optimize_batch_processing, PerformanceMonitor
-            logger.info("Using performance_helpers module")
-        except ImportError:
-            # Then try the full optimization module
-            from optimize_performance import get_optimal_worker_count, optimize_batch_processing, PerformanceMonitor
-            logger.info("Using optimize_performance module")
+        from performance_helpers import get_optimal_worker_count, optimize_batch_processing, PerformanceMonitor
+        logger.info("Using performance_helpers module")
             
         # Auto-determine optimal number of worker threads if not specified
         if max_workers is None:
-            max_workers = get_optimal_worker_count(task_type='io')
+            max_workers = get_optimal_worker_count(task_type='io', path=root_dir)
             logger.info(f"Auto-configured worker count: {max_workers}")
         
         # Get optimal batch sizes based on available memory
-        try:
-            processing_batch_size, db_batch_size = optimize_batch_processing(batch_size=100)
-        except TypeError:
-            # Simple version might return just one value
-            processing_batch_size = optimize_batch_processing(batch_size=100)
-            db_batch_size = processing_batch_size
+        processing_batch_size, db_batch_size = optimize_batch_processing(batch_size=100)
             
         logger.info(f"Auto-configured batch sizes: processing={processing_batch_size}, db={db_batch_size}")
         
@@ -1186,7 +1892,7 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
     logger.info(f"Using library: {library_name} (ID: {library_id})")
     
     # Define image extensions
-    image_extensions = ('.jpg', '.jpeg', '.png', '.heic', '.tiff', '.bmp', '.nef', '.cr2', '.arw', '.dng')
+    image_extensions = IMAGE_EXTENSIONS
     
     # Load checkpoint if resume is enabled
     checkpoint = None
@@ -1197,100 +1903,164 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
             processed_files = set(checkpoint['processed_files'])
             logger.info(f"Resuming from checkpoint with {len(processed_files)} already processed files")
     
-    # Create index of paths that already exist in the database
-    logger.info("Building database path index for incremental comparison...")
-    
-    # Use a more efficient approach with a generator to avoid loading all paths into memory at once
-    cursor.execute("SELECT path FROM photos")
+    # The file_state index replaces the in-memory set of every stored path
     existing_paths = set()
+    if not use_file_state and not streaming:
+        # Create index of paths that already exist in the database
+        logger.info("Building database path index for incremental comparison...")
+        
+        # Use a more efficient approach with a generator to avoid loading all paths into memory at once
+        cursor.execute("SELECT path FROM photos")
+        
+        # Read in chunks to avoid memory pressure with very large databases
+        while True:
+            rows = cursor.fetchmany(10000)
+            if not rows:
+                break
+            existing_paths.update(row[0] for row in rows)
+        
+        logger.info(f"Found {len(existing_paths)} files already in database")
+    
+    if streaming:
+        # Files flow straight from the walker to the extractors and the writer thread, which
+        # maintains file_state as it stores photos; every commit is durable, so an interrupted
+        # run resumes by finding what is already stored unchanged
+        logger.info("Using streaming scan -> extract -> insert pipeline")
+        scan_stats = {}
+        work = iter_streaming_work(cursor, library_id, root_dir, image_extensions, scan_stats)
+        if executor_mode == 'auto':
+            sample = []
+            for item in work:
+                sample.append(item)
+                if sum(1 for queued in sample if queued[0] == 'extract') >= AUTO_EXECUTOR_SAMPLE_SIZE:
+                    break
+            executor_mode = choose_executor_mode([item[1].path for item in sample if item[0] == 'extract'])
+            work = itertools.chain(sample, work)
+        if executor_mode == 'process':
+            max_workers = min(max_workers, multiprocessing.cpu_count())
+        
+        if performance_monitor:
+            performance_monitor.start()
+        try:
+            processed_count, inserted_count = run_streaming_pipeline(
+                work, db_path, library_id, include_all=include_all, max_workers=max_workers,
+                executor_mode=executor_mode, commit_size=max(db_batch_size, PIPELINE_COMMIT_SIZE),
+                performance_monitor=performance_monitor
+            )
+        finally:
+            conn.close()
+        if performance_monitor:
+            performance_monitor.stop()
+        
+        total_time = time.time() - start_time
+        logger.info(f"Found {scan_stats.get('total_files', 0)} total files, {scan_stats.get('unchanged', 0)} unchanged")
+        logger.info(f"Streaming run completed in {total_time:.2f} seconds")
+        logger.info(f"Processed {processed_count} images, inserted {inserted_count} into database")
+        data_dir = os.path.dirname(db_path) if os.path.dirname(db_path) else './data'
+        record_processing_time(library_name, data_dir)
+        return
     
-    # Read in chunks to avoid memory pressure with very large databases
-    while True:
-        rows = cursor.fetchmany(10000)
-        if not rows:
-            break
-        existing_paths.update(row[0] for row in rows)
-    
-    logger.info(f"Found {len(existing_paths)} files already in database")
-    
-    # Check if we have a directory cache from previous runs
+    # Check if we have a directory signature tree from previous runs
     dir_cache = {}
     if use_cache:
         dir_cache = get_directory_cache(cache_path)
-        logger.info(f"Loaded cache with {len(dir_cache)} directory entries")
+        if dir_cache.get('version') != DIRECTORY_CACHE_VERSION:
+            # Older flat {dir: hash} caches cannot be compared; rebuild from scratch
+            dir_cache = {'version': DIRECTORY_CACHE_VERSION, 'signatures': {}}
+        logger.info(f"Loaded cache with {len(dir_cache['signatures'])} directory signatures")
     
     # Process directories with directory-level change detection
     new_files = []
     total_files = 0
-    unchanged_dirs = 0
-    
-    # If we have a cache, we can use directory-level change detection
-    if use_cache and dir_cache:
-        logger.info("Using directory-level change detection...")
-        all_dirs = []
-        for dirpath, _, _ in os.walk(root_dir):
-            all_dirs.append(dirpath)
-        
-        changed_dirs = []
-        for dir_path in all_dirs:
-            # Create a hash of the directory contents
-            dir_hash = create_directory_hash(dir_path)
-            
-            # If the directory hasn't changed since last time, skip it
-            if dir_path in dir_cache and dir_cache[dir_path] == dir_hash:
-                unchanged_dirs += 1
-                continue
-                
-            # Directory has changed or is new, mark for processing
-            changed_dirs.append(dir_path)
-            dir_cache[dir_path] = dir_hash
+    scan_records = None
+    scanned_dirs = None  # None means every directory under root_dir was scanned
+    
+    # The first run with the file_state index needs every file, not just changed directories
+    bootstrap_file_state = use_file_state and not file_state_has_rows(cursor, library_id)
+    
+    if use_cache:
+        logger.info("Using directory signature tree for change detection...")
+        previous_signatures = dir_cache['signatures']
+        signatures, changed_records = build_signature_tree(
+            root_dir, image_extensions, {} if bootstrap_file_state else previous_signatures
+        )
         
-        logger.info(f"Skipping {unchanged_dirs} unchanged directories. Processing {len(changed_dirs)} changed directories.")
+        # Every directory is still listed; only those whose own entries changed are compared file by file
+        logger.info(f"Listed {len(signatures)} directories, {len(changed_records)} with changed entries")
         
-        # Only scan the changed directories
-        for dir_path in changed_dirs:
-            for filename in os.listdir(dir_path):
-                if filename.lower().endswith(image_extensions):
-                    full_path = os.path.join(dir_path, filename)
-                    if os.path.isfile(full_path):
-                        total_files += 1
-                        if full_path not in existing_paths and full_path not in processed_files:
-                            new_files.append(full_path)
+        # Only files in directories whose own entries changed need checking
+        scan_records = [record for records in changed_records.values() for record in records]
+        
+        # Replace this root's entries, keeping signatures of other libraries sharing the cache
+        root_prefix = os.path.join(root_dir, '')
+        under_root = {path for path in previous_signatures if path == root_dir or path.startswith(root_prefix)}
+        if not bootstrap_file_state:
+            removed_dirs = [path for path in under_root if path not in signatures]
+            scanned_dirs = list(changed_records) + removed_dirs
+        merged = {path: sig for path, sig in previous_signatures.items() if path not in under_root}
+        merged.update(signatures)
+        dir_cache['signatures'] = merged
+    elif use_file_state or not use_parallel_scan:
+        logger.info("Using serial directory scanning...")
+        # Serial os.scandir walk; DirEntry data avoids a stat per file name
+        scan_records = list(iter_file_records(root_dir, image_extensions))
     else:
-        # Without cache or directory change detection, decide on scanning method
-        if use_parallel_scan:
-            logger.info("Using parallel directory scanning...")
-            new_files, total_files = scan_directory_parallel(
-                root_dir, image_extensions, existing_paths.union(processed_files)
-            )
-        else:
-            logger.info("Using serial directory scanning...")
-            # Traditional serial scanning method
-            total_files = 0
-            new_files = []
-            for dirpath, _, filenames in os.walk(root_dir):
-                rel_path = os.path.relpath(dirpath, root_dir)
-                if rel_path != '.' and total_files % 1000 == 0:
-                    logger.info(f"Scanning: {rel_path}")
-                
-                for filename in filenames:
-                    if filename.lower().endswith(image_extensions):
-                        total_files += 1
-                        full_path = os.path.join(dirpath, filename)
-                        
-                        # Skip if file already exists in database (by path)
-                        if full_path not in existing_paths and full_path not in processed_files:
-                            new_files.append(full_path)
+        logger.info("Using parallel directory scanning...")
+        new_files, total_files = scan_directory_parallel(
+            root_dir, image_extensions, existing_paths.union(processed_files)
+        )
     
-    # Save the updated directory cache
-    if use_cache:
-        save_directory_cache(cache_path, dir_cache)
+    # Files whose state must be recorded once extracted, and those that already have a photos row
+    file_records = {}
+    modified_paths = set()
+    
+    if use_file_state:
+        total_files = len(scan_records)
+        if bootstrap_file_state:
+            adopted, purged = adopt_existing_photos(cursor, library_id, root_dir, scan_records)
+            logger.info(f"Seeded file_state index with {adopted} existing photos, purged {purged} missing ones")
+        
+        if scanned_dirs is None:
+            state_rows = load_file_state_rows(cursor, library_id, root_dir=root_dir)
+        else:
+            state_rows = load_file_state_rows(cursor, library_id, dirs=scanned_dirs)
+        changes = classify_file_changes(scan_records, state_rows)
+        untracked = len(changes['new'])
+        changes['new'] = adopt_untracked_photos(cursor, library_id, changes['new'])
+        if untracked != len(changes['new']):
+            logger.info(f"Adopted {untracked - len(changes['new'])} photos stored without file_state")
+        logger.info(f"File state: {len(changes['new'])} new, {len(changes['modified'])} modified, "
+                    f"{len(changes['moved'])} moved, {len(changes['deleted'])} deleted, {changes['unchanged']} unchanged")
+        
+        apply_file_moves_and_deletions(cursor, library_id, changes)
+        update_cluster_pyramid(cursor)
+        conn.commit()
+        
+        for record in changes['new'] + changes['modified']:
+            file_records[record.path] = record
+        modified_paths = {record.path for record in changes['modified']}
+        new_files = [path for path in file_records if path not in processed_files]
+    else:
+        # Still record file_state for what this run stores, so a later default run does not redo it
+        if scan_records is not None:
+            total_files = len(scan_records)
+            for record in scan_records:
+                if record.path not in existing_paths and record.path not in processed_files:
+                    file_records[record.path] = record
+            new_files = list(file_records)
+        else:
+            for path in new_files:
+                record = stat_file_record(path)
+                if record is not None:
+                    file_records[path] = record
     
     logger.info(f"Found {total_files} total files")
     logger.info(f"Found {len(new_files)} new files to process")
     
     if not new_files:
         logger.info("No new files to process. Exiting.")
+        if use_cache:
+            save_directory_cache(cache_path, dir_cache)
         conn.close()
         end_time = time.time()
         logger.info(f"Incremental scan completed in {end_time - start_time:.2f} seconds")
@@ -1298,19 +2068,30 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
     
     # Start performance monitoring if available
     if performance_monitor:
-        performance_monitor.start()
+        performance_monitor.start(total=len(new_files))
     
     # Process new files in parallel with optimized batch size
     processed_count = 0
     inserted_count = 0
     
-    logger.info(f"Processing {len(new_files)} new files with {max_workers} workers...")
+    # Pick the executor: threads overlap I/O, processes sidestep the GIL for CPU-bound parsing
+    if executor_mode == 'auto':
+        executor_mode = choose_executor_mode(new_files[:AUTO_EXECUTOR_SAMPLE_SIZE])
+    if executor_mode == 'process':
+        max_workers = min(max_workers, multiprocessing.cpu_count())
+        executor_class = concurrent.futures.ProcessPoolExecutor
+    else:
+        executor_class = concurrent.futures.ThreadPoolExecutor
+    
+    # Chunk size for process workers: enough per task to amortize pickling, small enough to balance
+    chunk_size = max(1, min(32, processing_batch_size // (max_workers * 2)))
+    logger.info(f"Processing {len(new_files)} new files with {max_workers} {executor_mode} workers...")
     
     # Reduce logging frequency during batch processing
     logging.getLogger().setLevel(logging.WARNING)  # Temporarily reduce logging
     
-    # Use context manager for thread pooling
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+    # The main process stays the single SQLite writer; workers only extract metadata
+    with executor_class(max_workers=max_workers) as executor:
         
         # Process in optimized batches
         for i in range(0, len(new_files), processing_batch_size):
@@ -1324,56 +2105,31 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
             if resume:
                 create_checkpoint(checkpoint_path, list(processed_files), batch)
             
-            # Submit all files in this batch for parallel processing
-            future_to_path = {executor.submit(process_image, path): path for path in batch}
             batch_results = []
             
             # Collect results as they complete
-            for future in concurrent.futures.as_completed(future_to_path):
-                path = future_to_path[future]
-                try:
-                    result = future.result()
-                    processed_count += 1
-                    processed_files.add(path)  # Mark as processed for checkpoint
-                    
-                    # Update performance monitor if available
-                    if performance_monitor:
-                        performance_monitor.update()
-                    
-                    # Otherwise log progress periodically
-                    elif processed_count % (processing_batch_size // 2) == 0:
-                        percent_done = (processed_count / len(new_files)) * 100
-                        logger.warning(f"Processed {processed_count}/{len(new_files)} images ({percent_done:.1f}%)...")
-                    
-                    if result:
-                        # If include_all is True, keep all photos regardless of GPS data
-                        # Otherwise, only keep photos with GPS coordinates
-                        if include_all or (result['latitude'] and result['longitude']):
-                            # Add marker data and library ID
-                            result['marker_data'] = create_marker_data(result)
-                            result['library_id'] = library_id
-                            batch_results.append(result)
-                except Exception as e:
-                    logger.error(f"Error processing {path}: {e}")
+            for path, result, duration in iter_batch_results(executor, executor_mode, batch, chunk_size):
+                processed_count += 1
+                processed_files.add(path)  # Mark as processed for checkpoint
+                
+                # Update performance monitor if available
+                if performance_monitor:
+                    performance_monitor.update(duration=duration)
+                
+                # Otherwise log progress periodically
+                elif processed_count % (processing_batch_size // 2) == 0:
+                    percent_done = (processed_count / len(new_files)) * 100
+                    logger.warning(f"Processed {processed_count}/{len(new_files)} images ({percent_done:.1f}%)...")
+                
+                batch_results.append((path, result))
             
-            # Insert batch results to database efficiently
-            if batch_results:
-                try:
-                    # Use more efficient batched insert with executemany
-                    cursor.executemany(
-                        "INSERT INTO photos (filename, path, latitude, longitude, datetime, hash, library_id, marker_data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                        [(photo['filename'], photo['path'], photo['latitude'], photo['longitude'], 
-                          photo['datetime'], photo['hash'], photo['library_id'], photo['marker_data']) for photo in batch_results]
-                    )
-                    inserted_this_batch = len(batch_results)
-                    inserted_count += inserted_this_batch
-                    conn.commit()
-                except Exception as e:
-                    logger.error(f"Error inserting batch: {e}")
-                    # Try inserting one by one as fallback
-                    inserted_this_batch = batch_insert_photos(cursor, batch_results)
-                    inserted_count += inserted_this_batch
-                    conn.commit()
+            inserted_count += store_extracted_results(
+                cursor, library_id, batch_results, include_all, file_records, modified_paths
+            )
+    
+    # Save the signature tree only once its new files are stored, so an interrupted run rescans them
+    if use_cache:
+        save_directory_cache(cache_path, dir_cache)
     
     # Processing complete, remove checkpoint file if it exists
     if resume and os.path.exists(checkpoint_path):
@@ -1407,6 +2163,143 @@ def process_directory_incremental(root_dir, db_path='photo_library.db', max_work
     data_dir = os.path.dirname(db_path) if os.path.dirname(db_path) else './data'
     record_processing_time(library_name, data_dir)
 
+def sync_changed_paths(conn, library_id, dirs=(), trees=(), include_all=False, executor=None,
+                       image_extensions=IMAGE_EXTENSIONS):
+    """Reconcile photos and file_state with the current contents of specific directories
+    
+    Files directly in `dirs` and everything below `trees` are compared with
+    their file_state rows; new and modified files are extracted, moves are
+    applied in place and rows of vanished files are purged.
+    
+    Args:
+        conn: Database connection
+        library_id: Library the directories belong to
+        dirs: Directories to re-list non-recursively
+        trees: Directories to re-scan recursively (may no longer exist)
+        include_all: Keep photos without GPS coordinates
+        executor: Optional executor used to extract metadata in parallel
+        image_extensions: Extensions to match
+        
+    Returns:
+        The classify_file_changes() result plus an 'inserted' count
+    """
+    cursor = conn.cursor()
+    records = {}
+    for dir_path in dirs:
+        try:
+            dir_records, _ = scan_directory_entries(dir_path, image_extensions)
+        except OSError:
+            dir_records = []  # Directory removed since the event; its rows are purged below
+        records.update((record.path, record) for record in dir_records)
+    for tree in trees:
+        records.update((record.path, record) for record in iter_file_records(tree, image_extensions))
+    
+    state_rows = {row[0]: row for row in load_file_state_rows(cursor, library_id, dirs=list(dirs))}
+    for tree in trees:
+        state_rows.update((row[0], row) for row in load_file_state_rows(cursor, library_id, root_dir=tree))
+    
+    changes = classify_file_changes(list(records.values()), sorted(state_rows.values()))
+    apply_file_moves_and_deletions(cursor, library_id, changes)
+    conn.commit()
+    
+    to_extract = changes['new'] + changes['modified']
+    paths = [record.path for record in to_extract]
+    if executor is not None:
+        results = list(zip(paths, executor.map(process_image, paths)))
+    else:
+        results = [(path, process_image(path)) for path in paths]
+    
+    changes['inserted'] = store_extracted_results(
+        cursor, library_id, results, include_all,
+        {record.path: record for record in to_extract},
+        {record.path for record in changes['modified']}
+    )
+    return changes
+
+def generate_library_thumbnails(db_path, library_name, thumbnail_cache, max_workers=None):
+    """Pre-render thumbnails for the photos of a library that do not have them yet"""
+    if max_workers is None:
+        try:
+            from performance_helpers import get_optimal_worker_count
+            max_workers = get_optimal_worker_count(task_type='cpu')
+        except ImportError:
+            max_workers = multiprocessing.cpu_count()
+    
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    try:
+        row = conn.execute("SELECT id FROM libraries WHERE name = ?", (library_name,)).fetchone()
+        if row:
+            start_time = time.time()
+            generated = pregenerate_thumbnails(conn, thumbnail_cache, row[0], max_workers=max_workers)
+            if generated:
+                logger.info(f"Generated thumbnails for {generated} photos in {time.time() - start_time:.2f}s")
+    finally:
+        conn.close()
+
+def watch_directory(root_dir, db_path='photo_library.db', max_workers=None, include_all=False,
+                    library_name='Default', debounce=None, poll_interval=None, force_polling=False,
+                    thumbnail_cache=None):
+    """Initial incremental scan, then ingest changes as filesystem events arrive
+    
+    Uses inotify where available and a signature-tree poll elsewhere (network
+    mounts, non-Linux hosts). Events are debounced into micro-batches so a
+    copy of many files is ingested in a few transactions. Runs until interrupted.
+    With a thumbnail_cache, thumbnails of new and modified photos are rendered
+    after each batch.
+    """
+    from file_watcher import create_watcher, DEFAULT_DEBOUNCE, DEFAULT_POLL_INTERVAL
+    
+    # Watches are registered before the initial scan so nothing written during it is missed
+    watcher = create_watcher(
+        root_dir, IMAGE_EXTENSIONS,
+        debounce=debounce or DEFAULT_DEBOUNCE,
+        poll_interval=poll_interval or DEFAULT_POLL_INTERVAL,
+        force_polling=force_polling
+    )
+    
+    process_directory_incremental(root_dir, db_path=db_path, max_workers=max_workers,
+                                  include_all=include_all, library_name=library_name)
+    if thumbnail_cache is not None:
+        generate_library_thumbnails(db_path, library_name, thumbnail_cache)
+    
+    if max_workers is None:
+        try:
+            from performance_helpers import get_optimal_worker_count
+            max_workers = get_optimal_worker_count(task_type='io', path=root_dir)
+        except ImportError:
+            max_workers = 4
+    
+    conn = sqlite3.connect(db_path, timeout=30.0)
+    optimize_sqlite_connection(conn)
+    library_id = get_or_create_library(conn.cursor(), library_name, [root_dir])
+    conn.commit()
+    
+    logger.info(f"Watching {root_dir} for changes (library: {library_name})")
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for batch in watcher.batches():
+                start_time = time.time()
+                try:
+                    changes = sync_changed_paths(conn, library_id, batch.dirs, batch.trees,
+                                                 include_all=include_all, executor=executor)
+                except sqlite3.Error as e:
+                    # Leave the batch for the next event or the next initial scan
+                    logger.error(f"Database error while ingesting {batch}: {e}")
+                    conn.rollback()
+                    continue
+                if changes['new'] or changes['modified'] or changes['moved'] or changes['deleted']:
+                    logger.info(f"Ingested {batch} in {time.time() - start_time:.2f}s: "
+                                f"{len(changes['new'])} new, {len(changes['modified'])} modified, "
+                                f"{len(changes['moved'])} moved, {len(changes['deleted'])} deleted, "
+                                f"{changes['inserted']} inserted")
+                if thumbnail_cache is not None and (changes['new'] or changes['modified']):
+                    pregenerate_thumbnails(conn, thumbnail_cache, library_id, max_workers=max_workers)
+    except KeyboardInterrupt:
+        logger.info("Watch mode stopped")
+    finally:
+        watcher.close()
+        conn.close()
+
 def ensure_database_initialized(db_path):
     """Check if the database exists and has required tables, initialize if needed"""
     db_exists = os.path.exists(db_path)
@@ -1479,6 +2372,34 @@ def ensure_database_tables(db_path):
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_path ON photos(path)')
             cursor.execute('CREATE INDEX IF NOT EXISTS idx_library_id ON photos(library_id)')
         
+        # Persistent per-file state used to detect new, modified, moved and deleted files
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS file_state (
+          path TEXT NOT NULL,
+          library_id INTEGER NOT NULL,
+          dir TEXT NOT NULL,
+          size INTEGER,
+          mtime_ns INTEGER,
+          inode INTEGER,
+          hash TEXT,
+          PRIMARY KEY (library_id, path)
+        )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_file_state_dir ON file_state(library_id, dir)')
+        
+        # Indexed filename/location key, so the map query needs no window sort to drop duplicates
+        ensure_dedup_key(cursor)
+        
+        # Per-zoom marker clusters, kept current by triggers on photos
+        ensure_cluster_tables(cursor)
+        update_cluster_pyramid(cursor)
+        
+        # Change log behind the server's /api/markers/changes, also fed by triggers
+        ensure_change_log(cursor)
+        
+        # R*Tree over coordinates for viewport lookups (idx_coords remains the fallback)
+        ensure_spatial_index(cursor)
+        
         conn.commit()
         conn.close()
         logger.info("Database tables created or verified successfully")
@@ -1625,12 +2546,7 @@ def cross_platform_scan_dir(directory, extensions=None):
     logger.info(f"Scanning directory: {norm_dir}")
     
     try:
-        for root, _, files in os.walk(norm_dir):
-            for filename in files:
-                if extensions and not filename.lower().endswith(extensions):
-                    continue
-                full_path = os.path.join(root, filename)
-                matching_files.append(full_path)
+        matching_files = [record.path for record in iter_file_records(norm_dir, extensions)]
     except Exception as e:
         logger.error(f"Error scanning directory {norm_dir}: {e}")
     
@@ -1641,7 +2557,7 @@ if __name__ == "__main__":
     parser.add_argument('--init', action='store_true', help='Initialize the database')
     parser.add_argument('--process', help='Process images from the specified directory')
     parser.add_argument('--db', default='data/photo_library.db', help='Database file path')
-    parser.add_argument('--workers', type=int, default=4, help='Number of worker threads')
+    parser.add_argument('--workers', type=int, help='Number of worker threads (default: tuned to CPU count and storage latency)')
     parser.add_argument('--include-all', action='store_true', help='Include photos without GPS data')
     parser.add_argument('--clean', action='store_true', help='Clean database before processing')
     parser.add_argument('--force', action='store_true', help='Force import even if photo already exists in database')
@@ -1650,6 +2566,20 @@ if __name__ == "__main__":
     parser.add_argument('--no-resume', action='store_true', help='Disable resume capability for interrupted operations')
     parser.add_argument('--no-optimize-sqlite', action='store_true', help='Disable SQLite optimizations (WAL mode, etc.)')
     parser.add_argument('--serial-scan', action='store_true', help='Disable parallel directory scanning, use serial scanning instead')
+    parser.add_argument('--executor', choices=EXECUTOR_MODES, default='thread',
+                        help='Metadata extraction pool: thread, process (bypasses the GIL) or auto (chosen by measured I/O wait vs CPU time)')
+    parser.add_argument('--no-file-state', action='store_true',
+                        help='Disable the file_state index (only detect new paths; no modified/moved/deleted handling)')
+    parser.add_argument('--streaming', action='store_true',
+                        help='Overlap directory walk, extraction and inserts with bounded queues and a dedicated writer thread')
+    parser.add_argument('--watch', action='store_true',
+                        help='After the initial scan, keep running and ingest changes as files are created, modified or deleted')
+    parser.add_argument('--poll', action='store_true', help='In watch mode, poll for changes instead of using inotify')
+    parser.add_argument('--poll-interval', type=float, help='Seconds between polls when inotify is unavailable (default: 60)')
+    parser.add_argument('--debounce', type=float, help='Seconds of quiet before a burst of file events is ingested (default: 2)')
+    parser.add_argument('--thumbnails', action='store_true',
+                        help='Pre-render 150px and 400px thumbnails for the map popups after processing')
+    parser.add_argument('--thumbnail-cache-mb', type=int, help='Size limit of the thumbnail cache in MB (default: 1024)')
     parser.add_argument('--library', default='Default', help='Specify the library name for imported photos')
     parser.add_argument('--description', help='Description for the library (when creating a new library)')
     args = parser.parse_args()
@@ -1675,9 +2605,26 @@ if __name__ == "__main__":
         process_dir = normalize_path(args.process)
         logger.info(f"Normalized process directory: {process_dir}")
         
+        thumbnail_cache = None
+        if args.thumbnails:
+            max_bytes = args.thumbnail_cache_mb * 1024 * 1024 if args.thumbnail_cache_mb else None
+            thumbnail_cache = thumbnail_cache_for_db(args.db, max_bytes)
+        
         # Always use the incremental processing by default as it's much faster
         # Only use the legacy processing if explicitly requested with --legacy flag
-        if getattr(args, 'legacy', False):            # Use legacy standard processing
+        if args.watch:
+            watch_directory(
+                root_dir=process_dir,
+                db_path=args.db,
+                max_workers=args.workers,
+                include_all=args.include_all,
+                library_name=args.library,
+                debounce=args.debounce,
+                poll_interval=args.poll_interval,
+                force_polling=args.poll,
+                thumbnail_cache=thumbnail_cache
+            )
+        elif getattr(args, 'legacy', False):            # Use legacy standard processing
             logger.info("Using legacy processing mode (slower)")
             process_directory(
                 root_dir=process_dir,
@@ -1697,5 +2644,11 @@ if __name__ == "__main__":
                 library_name=args.library,
                 use_cache=not args.no_cache,
                 resume=not args.no_resume,
-                use_parallel_scan=not args.serial_scan
+                use_parallel_scan=not args.serial_scan,
+                executor_mode=args.executor,
+                streaming=args.streaming,
+                use_file_state=not args.no_file_state
             )
+        
+        if thumbnail_cache is not None and not args.watch:
+            generate_library_thumbnails(args.db, args.library, thumbnail_cache)
@@ -1,55 +1,166 @@
 # Optimized version for faster performance
 import os
+import hashlib
 import multiprocessing
 import logging
 import time
+from collections import namedtuple
 
 logger = logging.getLogger(__name__)
 
+# One scanned file; size/mtime_ns/inode come from the DirEntry so change detection needs no extra stat
+FileRecord = namedtuple('FileRecord', ['path', 'size', 'mtime_ns', 'inode'])
+
+def scan_directory_entries(dir_path, image_extensions=None):
+    """List one directory with os.scandir
+    
+    Uses DirEntry.is_file()/is_dir() (answered from the directory listing on most
+    platforms) and a single DirEntry.stat() per matching file instead of separate
+    isfile/getsize/getmtime calls.
+    
+    Args:
+        dir_path: Directory to list (not recursive)
+        image_extensions: Tuple of lowercase extensions to match, or None for all files
+        
+    Returns:
+        Tuple of (list of FileRecord, list of subdirectory paths)
+    """
+    records = []
+    subdirs = []
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                    continue
+                # Check extension first (cheaper than any filesystem call)
+                if image_extensions and not entry.name.lower().endswith(image_extensions):
+                    continue
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                records.append(FileRecord(entry.path, stat.st_size, stat.st_mtime_ns, entry.inode()))
+            except OSError as e:
+                # File vanished or is unreadable between listing and stat
+                logger.debug(f"Error reading entry {entry.path}: {e}")
+    return records, subdirs
+
+def stat_file_record(path):
+    """Build the FileRecord of a single path, or None if it cannot be stat'ed"""
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        logger.debug(f"Error reading {path}: {e}")
+        return None
+    return FileRecord(path, stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+def iter_file_records(root_dir, image_extensions=None):
+    """Recursively yield FileRecord tuples under root_dir using os.scandir
+    
+    Directories are walked depth-first with an explicit stack; unreadable
+    directories are logged and skipped.
+    """
+    stack = [root_dir]
+    while stack:
+        dir_path = stack.pop()
+        try:
+            records, subdirs = scan_directory_entries(dir_path, image_extensions)
+        except (PermissionError, FileNotFoundError, OSError) as e:
+            logger.debug(f"Error scanning directory {dir_path}: {e}")
+            continue
+        yield from records
+        # Reverse so directories are visited in listing order
+        stack.extend(reversed(subdirs))
+
+def _own_signature(records, subdirs):
+    """Hash a directory's own entries: image files (name, size, mtime) and subdirectory names"""
+    own_hash = hashlib.md5()
+    for record in sorted(records):
+        own_hash.update(f"{os.path.basename(record.path)}\0{record.size}\0{record.mtime_ns}\n".encode())
+    for subdir in sorted(subdirs):
+        own_hash.update(f"{os.path.basename(subdir)}/\n".encode())
+    return own_hash.hexdigest()
+
+def build_signature_tree(root_dir, image_extensions, previous=None):
+    """Compute a Merkle-style signature for every directory under root_dir
+    
+    Each directory is listed exactly once. Its own signature covers its image
+    files and subdirectory names; its tree signature combines the own signature
+    with the tree signatures of its children, so any change deep in the tree
+    changes the signature of every ancestor and nothing else.
+    
+    Args:
+        root_dir: Directory to walk
+        image_extensions: Tuple of lowercase extensions to match
+        previous: Optional {dir_path: (own_signature, tree_signature)} from an earlier run
+        
+    Returns:
+        Tuple of (signatures, changed_records) where signatures maps every directory
+        to (own_signature, tree_signature) and changed_records maps each directory
+        whose own entries changed to its FileRecord list
+    """
+    previous = previous or {}
+    signatures = {}
+    changed_records = {}
+    own_signatures = {}
+    children = {}
+    
+    # Iterative post-order walk: children are signed before their parent
+    stack = [(root_dir, False)]
+    while stack:
+        dir_path, children_done = stack.pop()
+        if children_done:
+            tree_hash = hashlib.md5(own_signatures[dir_path].encode())
+            for child in sorted(children[dir_path]):
+                if child in signatures:
+                    tree_hash.update(signatures[child][1].encode())
+            signatures[dir_path] = (own_signatures[dir_path], tree_hash.hexdigest())
+            continue
+        
+        try:
+            records, subdirs = scan_directory_entries(dir_path, image_extensions)
+        except (PermissionError, FileNotFoundError, OSError) as e:
+            logger.debug(f"Error scanning directory {dir_path}: {e}")
+            continue
+        
+        own_signatures[dir_path] = _own_signature(records, subdirs)
+        children[dir_path] = subdirs
+        # Keep file records only where this directory's own entries changed
+        cached = previous.get(dir_path)
+        if not cached or cached[0] != own_signatures[dir_path]:
+            changed_records[dir_path] = records
+        
+        stack.append((dir_path, True))
+        stack.extend((subdir, False) for subdir in subdirs)
+    
+    return signatures, changed_records
+
 # Define this as a top-level function so it can be pickled for multiprocessing
 def _scan_single_directory(args):
     """Scan a single directory for image files - optimized version
     
+    Workers only return candidate paths; the parent filters them against the
+    existing paths once, so that set is never pickled into the worker processes.
+    
     Args:
-        args: Tuple of (dir_path, image_extensions, existing_paths_list)
+        args: Tuple of (dir_path, image_extensions)
         
     Returns:
-        Tuple of (files_found, total_files_in_directory)
+        Tuple of (candidate_files, total_files_in_directory)
     """
-    dir_path, image_extensions, existing_paths_list = args
+    dir_path, image_extensions = args
     
-    # Use a set for faster lookups (only convert once)
-    existing_paths_set = set(existing_paths_list)
     files_found = []
-    total = 0
     
-    # Optimize file checks by collecting all filenames first
     try:
-        # Get all filenames first
-        all_files = os.listdir(dir_path)
-        
-        # Filter in memory for better performance
-        for filename in all_files:
-            # Check extension first (faster than path operations)
-            if not filename.lower().endswith(image_extensions):
-                continue
-                
-            # Build full path only for matching files
-            full_path = os.path.join(dir_path, filename)
-            
-            # Skip directories that end with image extensions
-            if not os.path.isfile(full_path):
-                continue
-                
-            total += 1
-            if full_path not in existing_paths_set:
-                files_found.append(full_path)
-                
+        # One scandir pass; file type and stat data come from the directory entries
+        records, _ = scan_directory_entries(dir_path, image_extensions)
+        files_found = [record.path for record in records]
     except (PermissionError, FileNotFoundError, OSError) as e:
         # Handle permission errors or directories that disappeared
         logger.debug(f"Error scanning directory {dir_path}: {e}")
     
-    return files_found, total
+    return files_found, len(files_found)
 
 def scan_directory_parallel(root_dir, image_extensions, existing_paths=None):
     """Scan a directory for image files in parallel using multiprocessing - optimized version"""    
@@ -61,14 +172,11 @@ def scan_directory_parallel(root_dir, image_extensions, existing_paths=None):
     all_dirs = []
     dir_count = 0
     
-    # For large sets, convert only once for better performance
-    existing_paths_list = list(existing_paths) if existing_paths else []
-    
     # Pre-scan directories first (faster than walking the whole tree)
     logger.info(f"First pass - collecting directories from {root_dir}")
     for dirpath, dirnames, _ in os.walk(root_dir):
         dir_count += 1
-        all_dirs.append((dirpath, image_extensions, existing_paths_list))
+        all_dirs.append((dirpath, image_extensions))
         
         # Print progress for large directories
         if dir_count % 100 == 0:
@@ -106,17 +214,19 @@ def scan_directory_parallel(root_dir, image_extensions, existing_paths=None):
             # Process directories in chunks for better performance
             results = pool.map(_scan_single_directory, all_dirs, chunksize=chunk_size)
             
-            # Collect results
+            # Collect results, filtering against the existing paths once in the parent
             for files, total in results:
-                new_files.extend(files)
+                new_files.extend(path for path in files if path not in existing_paths)
                 total_files += total
     
     except Exception as e:
         logger.error(f"Parallel scanning failed: {e}. Falling back to serial processing.")
         # Fall back to serial scanning if multiprocessing fails
+        new_files = []
+        total_files = 0
         for args in all_dirs:
             files, count = _scan_single_directory(args)
-            new_files.extend(files)
+            new_files.extend(path for path in files if path not in existing_paths)
             total_files += count
     
     scan_time = time.time() - scan_time_start
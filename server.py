@@ -12,9 +12,26 @@ from PIL import Image
 import io
 import logging
 import json
+import zlib
 import datetime
 import mimetypes
-from flask import Flask, send_from_directory, render_template, request
+import asyncio
+import contextvars
+import multiprocessing
+import concurrent.futures
+from flask import Flask, send_from_directory, send_file, render_template, request, g, stream_with_context
+from db_pool import ReadOnlyConnectionPool, resolve_db_path
+from marker_cache import MarkerSnapshotCache, ENCODINGS, GZIP_LEVEL
+from marker_queries import (parse_bbox, parse_library_filter, parse_date_bound, query_libraries, query_markers,
+                            query_marker_rows, execute_marker_query, coordinate_precision, row_to_marker)
+from marker_format import MARKER_BINARY_MIMETYPE, NDJSON_MIMETYPE, encode_markers_binary, iter_markers_ndjson
+from marker_changes import current_change_version, query_marker_changes
+from cluster_pyramid import query_clusters, compute_clusters, CLUSTER_MIN_ZOOM, CLUSTER_MAX_ZOOM
+from heat_tiles import query_heat_tile, render_heat_tile_png, DEFAULT_RADIUS, DEFAULT_SCALE
+from thumbnails import THUMBNAIL_SIZES, DEFAULT_THUMBNAIL_SIZE, thumbnail_key, thumbnail_cache_for_db, get_thumbnail
+from image_conversion import DEFAULT_QUALITY, conversion_key, conversion_cache_for_db, convert_to_jpeg, get_converted_jpeg
+from transcoder import (TranscoderPool, PreviewScheduler, PRIORITY_REQUEST, REQUEST_WAIT_SECONDS,
+                        needs_transcoding, convert_job)
 
 # Initialize Flask app
 app = Flask(__name__, 
@@ -32,6 +49,77 @@ try:
     HEIC_SUPPORT = True
 except ImportError:
     HEIC_SUPPORT = False
+
+# Try to import the production WSGI servers: gunicorn (Unix, worker processes), else waitress (threads only)
+try:
+    import gunicorn.app.base
+    HAS_GUNICORN = True
+except ImportError:
+    HAS_GUNICORN = False
+
+try:
+    import waitress
+    HAS_WAITRESS = True
+except ImportError:
+    HAS_WAITRESS = False
+
+# Try to import aiohttp for the asyncio serving mode
+try:
+    from aiohttp import web
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# Production mode defaults: worker processes and request threads per worker
+DEFAULT_PRODUCTION_WORKERS = min(4, os.cpu_count() or 1)
+DEFAULT_PRODUCTION_THREADS = 8
+
+# Seconds a silent worker may take before it is restarted, and to finish requests on shutdown or reload
+WORKER_TIMEOUT = 120
+GRACEFUL_TIMEOUT = 30
+
+# Async mode: requests in progress per client address, threads for blocking lookups and for inline HEIC decoding
+DEFAULT_CLIENT_CONCURRENCY = 16
+ASYNC_IO_THREADS = 32
+ASYNC_DECODE_THREADS = max(1, (os.cpu_count() or 1) - 1)
+
+# Thumbnail and HEIC conversion caches next to the database, created on first use
+thumbnail_cache = None
+thumbnail_cache_max_bytes = None
+conversion_cache = None
+conversion_cache_max_bytes = None
+
+# Background HEIC/RAW transcoding, started by start_server; without it conversions run inline
+transcoder = None
+preview_scheduler = None
+
+# Serialized /api/markers responses, created on first use
+marker_cache = None
+
+# Read-only database connections shared by all requests; start_server sets the database path
+db_pool = None
+
+def get_db_pool():
+    """Return the connection pool, looking for the database in the working directory if start_server did not"""
+    global db_pool
+    if db_pool is None:
+        db_pool = ReadOnlyConnectionPool(resolve_db_path())
+    return db_pool
+
+def get_db():
+    """Return the current request's read-only connection, or None if the database does not exist
+
+    The connection is borrowed from the pool on first use and returned when the request ends.
+    """
+    if 'db' not in g:
+        g.db = get_db_pool().acquire()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exception):
+    conn = g.pop('db', None)
+    if conn is not None:
+        db_pool.release(conn)
     
 # Helper function for EXIF data
 def get_exif_data(img):
@@ -78,126 +166,385 @@ def library_updates():
         "updates": updates
     }
 
+def get_marker_cache():
+    """Return the cache of serialized marker responses for the served database"""
+    global marker_cache
+    if marker_cache is None:
+        marker_cache = MarkerSnapshotCache(get_db_pool().data_version)
+    return marker_cache
+
+def json_body(payload):
+    """Compact JSON bytes of a response payload"""
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+def snapshot_response(snapshot, mimetype='application/json', vary='Accept-Encoding'):
+    """Serve a cached snapshot in the best encoding the client accepts, or 304 if its copy is current"""
+    encoding = next((encoding for encoding in ENCODINGS if request.accept_encodings[encoding]), None)
+    body, etag = snapshot.encoded(encoding)
+    # no-cache: browsers keep the response but revalidate it, which costs a 304 until the next ingest
+    headers = {'ETag': f'"{etag}"', 'Vary': vary, 'Cache-Control': 'no-cache'}
+    if request.if_none_match.contains(etag):
+        return "", 304, headers
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return app.response_class(body, mimetype=mimetype, headers=headers)
+
+def streamed_response(chunks, mimetype, vary='Accept-Encoding'):
+    """Stream body chunks as they are produced, gzip-compressed if the client accepts it
+
+    Each chunk is flushed through the compressor so the client can decode it
+    on arrival. The request context (and its pooled connection) stays open
+    until the last chunk is sent.
+    """
+    gzip_encoding = bool(request.accept_encodings['gzip'])
+
+    def generate():
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if gzip_encoding else None
+        try:
+            for chunk in chunks:
+                if compressor:
+                    chunk = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                yield chunk
+        except Exception as e:
+            # Headers are already sent; the client notices the missing end of the stream
+            logger.exception(f"Error while streaming response: {e}")
+        if compressor:
+            yield compressor.flush()
+
+    headers = {'Vary': vary, 'Cache-Control': 'no-cache'}
+    if gzip_encoding:
+        headers['Content-Encoding'] = 'gzip'
+    return app.response_class(stream_with_context(generate()), mimetype=mimetype, headers=headers)
+
 # API endpoint for photo markers
 @app.route('/api/markers')
 def api_markers():
-    """Serve photo markers from the database"""
-    logger.info("Serving photo markers from database")
+    """Serve photo markers from the database
     
-    try:        # Connect to database
-        db_path = os.path.join(os.getcwd(), 'data', 'photo_library.db')
-        if not os.path.exists(db_path):
-            db_path = os.path.join(os.getcwd(), 'photo_library.db')
-            if not os.path.exists(db_path):
-                logger.error(f"Database not found: {db_path}")
-                return {"error": "Database not found"}, 404
-            
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        cursor = conn.cursor()
+    Without parameters every geotagged photo is returned. With
+    ?bbox=west,south,east,north (optionally &zoom=, &libraries=id-or-name,...,
+    &from=, &to=, &limit=) only the photos inside the viewport are returned.
+    Clients that prefer MARKER_BINARY_MIMETYPE in their Accept header get the
+    columnar binary encoding from marker_format instead of JSON. Clients that
+    prefer NDJSON_MIMETYPE get markers streamed line by line as they are read
+    from the database (see marker_format.iter_markers_ndjson).
+    """
+    viewport_mode = any(key in request.args for key in ('bbox', 'libraries', 'from', 'to'))
+    mimetype = request.accept_mimetypes.best_match(['application/json', MARKER_BINARY_MIMETYPE, NDJSON_MIMETYPE])
+    binary = mimetype == MARKER_BINARY_MIMETYPE
+    
+    try:
+        bbox = parse_bbox(request.args['bbox']) if 'bbox' in request.args else None
+        if bbox is not None and preview_scheduler is not None:
+            preview_scheduler.note_viewport(bbox)
+        zoom = request.args.get('zoom', type=int)
+        limit = request.args.get('limit', type=int)
+        library_ids, library_names = parse_library_filter(request.args.get('libraries'))
+        date_from = parse_date_bound(request.args.get('from'))
+        date_to = parse_date_bound(request.args.get('to'), upper=True)
+    except ValueError as e:
+        return {"error": f"Invalid parameter: {e}"}, 400
+    
+    if viewport_mode:
+        logger.debug(f"Serving photo markers for bbox={bbox} zoom={zoom}")
+    else:
+        logger.info("Serving photo markers from database")
+    
+    def build_binary():
+        version = current_change_version(conn)
+        libraries = query_libraries(conn)
+        rows = query_marker_rows(conn, bbox=bbox, library_ids=library_ids, library_names=library_names,
+                                 date_from=date_from, date_to=date_to, limit=limit)
+        logger.info(f"Encoding {len(rows)} photo markers as {MARKER_BINARY_MIMETYPE}")
+        if viewport_mode:
+            return encode_markers_binary(rows, libraries, version=version, bbox=list(bbox) if bbox else None,
+                                         zoom=zoom, truncated=bool(limit) and len(rows) >= limit)
+        return encode_markers_binary(rows, libraries, version=version)
+    
+    def stream_ndjson():
+        version = current_change_version(conn)
+        header = {"version": version, "libraries": query_libraries(conn)}
+        if viewport_mode:
+            header.update(bbox=list(bbox) if bbox else None, zoom=zoom)
+        cursor = execute_marker_query(conn, bbox=bbox, library_ids=library_ids, library_names=library_names,
+                                      date_from=date_from, date_to=date_to, limit=limit)
+        precision = coordinate_precision(zoom) if zoom is not None else None
+        return iter_markers_ndjson(cursor, header, precision, limit)
+    
+    def build_json():
+        # Read the change version first: changes committed while querying are replayed by the next sync
+        version = current_change_version(conn)
         
         # First get the libraries information with last_updated timestamp
-        cursor.execute("SELECT id, name, description, source_dirs, last_updated FROM libraries")
-        library_rows = cursor.fetchall()
-        libraries = []
+        libraries = query_libraries(conn)
         
-        for row in library_rows:
-            lib = dict(row)
-            # Parse source_dirs from JSON string
-            try:
-                lib['source_dirs'] = json.loads(lib['source_dirs']) if lib['source_dirs'] else []
-            except Exception:
-                lib['source_dirs'] = []
-            libraries.append(lib)
-            
-        logger.info(f"Found {len(libraries)} libraries")
+        photos = query_markers(conn, bbox=bbox, library_ids=library_ids, library_names=library_names,
+                               date_from=date_from, date_to=date_to, zoom=zoom, limit=limit)
+        
+        if viewport_mode:
+            logger.debug(f"Queried {len(photos)} photo markers inside viewport")
+            return json_body({
+                "photos": photos,
+                "libraries": libraries,
+                "version": version,
+                "bbox": list(bbox) if bbox else None,
+                "zoom": zoom,
+                "truncated": bool(limit) and len(photos) >= limit
+            })
         
-        # Then get photos with location data - include path and ID
-        # Use ROW_NUMBER to ensure we only get one instance of each filename per unique location
-        # This prevents duplicates from the same location while allowing same-named photos
-        # from different locations to appear on the map
-        cursor.execute('''
-        WITH RankedPhotos AS (
-            SELECT 
-                p.id, p.filename, p.path, p.latitude, p.longitude, p.datetime, 
-                p.marker_data, p.library_id, l.name as library_name,
-                ROW_NUMBER() OVER(PARTITION BY p.filename, ROUND(p.latitude, 4), ROUND(p.longitude, 4) ORDER BY p.id) as rn
-            FROM photos p
-            LEFT JOIN libraries l ON p.library_id = l.id
-            WHERE p.latitude IS NOT NULL AND p.longitude IS NOT NULL
-        )
-        SELECT 
-            id, filename, path, latitude, longitude, datetime, 
-            marker_data, library_id, library_name
-        FROM RankedPhotos
-        WHERE rn = 1
-        ''')
-        
-        rows = cursor.fetchall()
-        photos = []
+        logger.info(f"Found {len(libraries)} libraries")
         
         # Also count how many photos there would be without deduplication
-        cursor.execute('''
-        SELECT COUNT(*) as total FROM photos p
-        WHERE p.latitude IS NOT NULL AND p.longitude IS NOT NULL
-        ''')
-        total_before = cursor.fetchone()[0]
-        
-        logger.info(f"Filtered out duplicate photos with same filename regardless of coordinates, returning {len(rows)} unique photos (removed {total_before - len(rows)} duplicates)")
-        
-        for row in rows:
-            photo = dict(row)
-            # Parse marker_data from JSON string if available
-            if photo['marker_data']:
-                try:
-                    photo['marker_data'] = json.loads(photo['marker_data'])
-                except Exception:
-                    photo['marker_data'] = {}
-            else:
-                photo['marker_data'] = {}
-            
-            photos.append(photo)
+        total_before = conn.execute(
+            "SELECT COUNT(*) FROM photos WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+        ).fetchone()[0]
+        logger.info(f"Filtered out duplicate photos with same filename at same coordinates, returning {len(photos)} unique photos (removed {total_before - len(photos)} duplicates)")
         
-        # Return response as JSON
-        result = {
+        logger.info(f"Queried {len(photos)} photo markers from {len(libraries)} libraries")
+        return json_body({
             "photos": photos,
-            "libraries": libraries
-        }
-        logger.info(f"Successfully served {len(photos)} photo markers from {len(libraries)} libraries")
-        return result
+            "libraries": libraries,
+            "version": version
+        })
+    
+    try:
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return {"error": "Database not found"}, 404
+        
+        # Streamed responses are not cached: memory stays flat however large the library is
+        if mimetype == NDJSON_MIMETYPE:
+            return streamed_response(stream_ndjson(), NDJSON_MIMETYPE, vary='Accept, Accept-Encoding')
+        
+        # The payload only changes when process_photos.py commits, so it is built once per database version;
+        # exact viewports rarely repeat, so their snapshots only serve concurrent identical requests
+        key = (binary, bbox, zoom, limit, tuple(library_ids), tuple(library_names), date_from, date_to)
+        snapshot = get_marker_cache().get(key, build_binary if binary else build_json, store=bbox is None)
+        return snapshot_response(snapshot, MARKER_BINARY_MIMETYPE if binary else 'application/json',
+                                 vary='Accept, Accept-Encoding')
         
     except Exception as e:
         logger.exception(f"Error serving photo markers: {e}")
         return {"error": str(e)}, 500
 
+# API endpoint for incremental marker updates
+@app.route('/api/markers/changes')
+def api_marker_changes():
+    """Serve the markers inserted, updated and deleted after a version: /api/markers/changes?since=<version>
+    
+    The starting version is the "version" field of /api/markers; each response
+    carries the version to ask from next. {"reset": true} means the client is
+    too far behind and should reload /api/markers.
+    """
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return {"error": "Invalid parameter: since must be a non-negative integer"}, 400
+    
+    try:
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return {"error": "Database not found"}, 404
+        if current_change_version(conn) is None:
+            return {"error": "Database has no change log; run process_photos.py to upgrade it"}, 404
+        
+        changes = query_marker_changes(conn, since)
+        if not changes.get("reset"):
+            logger.debug(f"Marker changes since {since}: {len(changes['inserted'])} inserted, "
+                         f"{len(changes['updated'])} updated, {len(changes['deleted'])} deleted")
+        return changes
+        
+    except Exception as e:
+        logger.exception(f"Error serving marker changes: {e}")
+        return {"error": str(e)}, 500
+
+# API endpoint for precomputed marker clusters
+@app.route('/api/clusters')
+def api_clusters():
+    """Serve marker clusters for a zoom level: /api/clusters?z=&bbox=w,s,e,n&libraries=...&from=&to=
+    
+    Clusters come from the photo_clusters pyramid maintained at ingest time;
+    date filters (which the pyramid does not index) are clustered on the fly.
+    """
+    try:
+        zoom = request.args.get('z', type=int)
+        if zoom is None:
+            raise ValueError("z is required")
+        # The map zooms past the pyramid's finest level; serve (and report) the nearest one
+        zoom = max(CLUSTER_MIN_ZOOM, min(CLUSTER_MAX_ZOOM, zoom))
+        bbox = parse_bbox(request.args['bbox']) if 'bbox' in request.args else None
+        if bbox is not None and preview_scheduler is not None:
+            preview_scheduler.note_viewport(bbox)
+        library_ids, library_names = parse_library_filter(request.args.get('libraries'))
+        date_from = parse_date_bound(request.args.get('from'))
+        date_to = parse_date_bound(request.args.get('to'), upper=True)
+    except ValueError as e:
+        return {"error": f"Invalid parameter: {e}"}, 400
+    
+    try:
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return {"error": "Database not found"}, 404
+        
+        has_pyramid = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='photo_clusters'"
+        ).fetchone() is not None
+        
+        if has_pyramid and not (date_from or date_to):
+            if library_names:
+                # The pyramid is keyed by library id
+                placeholders = ','.join('?' * len(library_names))
+                library_ids = library_ids + [row[0] for row in conn.execute(
+                    f"SELECT id FROM libraries WHERE name IN ({placeholders})", library_names)]
+                if not library_ids:
+                    return {"zoom": zoom, "clusters": []}
+            clusters = query_clusters(conn, zoom, bbox=bbox, library_ids=library_ids)
+        else:
+            clusters = compute_clusters(conn, zoom, bbox=bbox, library_ids=library_ids, library_names=library_names,
+                                        date_from=date_from, date_to=date_to)
+        
+        logger.debug(f"Served {len(clusters)} clusters for z={zoom} bbox={bbox}")
+        return {"zoom": zoom, "clusters": clusters}
+        
+    except Exception as e:
+        logger.exception(f"Error serving clusters: {e}")
+        return {"error": str(e)}, 500
+
+def _heat_tile_filters():
+    """Parse the library/date filters shared by the heat tile routes (raises ValueError)"""
+    library_ids, library_names = parse_library_filter(request.args.get('libraries'))
+    date_from = parse_date_bound(request.args.get('from'))
+    date_to = parse_date_bound(request.args.get('to'), upper=True)
+    return dict(library_ids=library_ids, library_names=library_names, date_from=date_from, date_to=date_to)
+
+@app.route('/api/heat/<int:z>/<int:x>/<int:y>')
+@app.route('/api/heat/<int:z>/<int:x>/<int:y>.png', defaults={'image': True})
+def api_heat_tile(z, x, y, image=False):
+    """Serve one heatmap tile: /api/heat/z/x/y (weighted points) or /api/heat/z/x/y.png?radius=&scale=
+    
+    The JSON variant returns {"points": [[lat, lon, count], ...]} for a client-side
+    heat layer; the PNG variant is rendered server-side for devices that cannot
+    afford to draw the layer themselves. Both accept libraries, from and to.
+    """
+    try:
+        filters = _heat_tile_filters()
+        radius = request.args.get('radius', DEFAULT_RADIUS, type=int)
+        scale = request.args.get('scale', DEFAULT_SCALE, type=float)
+    except ValueError as e:
+        return {"error": f"Invalid parameter: {e}"}, 400
+    
+    try:
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return {"error": "Database not found"}, 404
+        
+        if image:
+            png = render_heat_tile_png(conn, z, x, y, radius=radius, scale=scale, **filters)
+        else:
+            points = query_heat_tile(conn, z, x, y, **filters)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    except Exception as e:
+        logger.exception(f"Error serving heat tile {z}/{x}/{y}: {e}")
+        return {"error": str(e)}, 500
+    
+    if image:
+        response = app.response_class(png, mimetype='image/png')
+    else:
+        response = app.make_response({"z": z, "x": x, "y": y, "points": points})
+    # Tiles change only when libraries are re-processed; let browsers reuse them briefly
+    response.headers['Cache-Control'] = 'public, max-age=300'
+    return response
+
+def get_thumbnail_cache():
+    """Return the thumbnail cache belonging to the served database"""
+    global thumbnail_cache
+    if thumbnail_cache is None:
+        thumbnail_cache = thumbnail_cache_for_db(get_db_pool().db_path, thumbnail_cache_max_bytes)
+    return thumbnail_cache
+
+def get_conversion_cache():
+    """Return the HEIC conversion cache belonging to the served database"""
+    global conversion_cache
+    if conversion_cache is None:
+        conversion_cache = conversion_cache_for_db(get_db_pool().db_path, conversion_cache_max_bytes)
+    return conversion_cache
+
+@app.route('/thumb/<int:photo_id>')
+def serve_thumbnail(photo_id):
+    """Serve a photo thumbnail: /thumb/<id>?size=150|400|1600
+    
+    Thumbnails are content-addressed by the photo hash, so the ETag is strong
+    and stays valid until the photo file itself changes.
+    """
+    size = request.args.get('size', DEFAULT_THUMBNAIL_SIZE, type=int)
+    if size not in THUMBNAIL_SIZES:
+        return {"error": f"Invalid parameter: size must be one of {', '.join(map(str, THUMBNAIL_SIZES))}"}, 400
+    
+    try:
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return "Database not found", 404
+        
+        result = conn.execute("SELECT path, hash FROM photos WHERE id = ?", (photo_id,)).fetchone()
+        if not result or not result[1]:
+            return "Photo not found in database", 404
+        photo_path, photo_hash = result
+        
+        etag = thumbnail_key(photo_hash, size)
+        if request.if_none_match.contains(etag):
+            return "", 304, {'ETag': f'"{etag}"', 'Cache-Control': 'public, max-age=86400'}
+        
+        cache = get_thumbnail_cache()
+        photo_path = normalize_path(photo_path)
+        try:
+            thumbnail_path = cache.get(etag, '.jpg')
+            if thumbnail_path is None and transcoder is not None and needs_transcoding(photo_path):
+                # HEIC/RAW decoding runs in the transcoder's worker processes
+                preview_scheduler.submit(photo_hash, photo_path, (PRIORITY_REQUEST, 0), (size,)).result(
+                    REQUEST_WAIT_SECONDS)
+                thumbnail_path = cache.get(etag, '.jpg')
+            if thumbnail_path is None:
+                thumbnail_path = get_thumbnail(cache, photo_hash, photo_path, size)
+        except concurrent.futures.TimeoutError:
+            return "Preview is being generated", 503, {'Retry-After': '2'}
+        except FileNotFoundError:
+            logger.error(f"Photo file not found at {photo_path}")
+            return f"Photo file not found at {photo_path}", 404
+        except OSError as e:
+            logger.warning(f"Cannot render thumbnail for {photo_path}: {e}")
+            return "Thumbnail not available for this file", 415
+        
+        response = send_file(thumbnail_path, mimetype='image/jpeg', etag=etag, conditional=True, max_age=86400)
+        response.cache_control.public = True
+        return response
+        
+    except Exception as e:
+        logger.exception(f"Error serving thumbnail for photo {photo_id}: {e}")
+        return f"Internal server error: {str(e)}", 500
+
 # Function to get last update times for libraries
 def get_last_update_times():
     """Get the last update times for all libraries from the database"""
     updates = {}
     
     try:
-        # Connect to database
-        db_path = os.path.join(os.getcwd(), 'data', 'photo_library.db')
-        if not os.path.exists(db_path):
-            db_path = os.path.join(os.getcwd(), 'photo_library.db')
-            
-        if not os.path.exists(db_path):
-            logger.error(f"Database not found: {db_path}")
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
             return updates
-            
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row  # This enables column access by name
-        cursor = conn.cursor()
         
         # Get the libraries with their last_updated timestamps
-        cursor.execute("SELECT name, last_updated FROM libraries")
-        rows = cursor.fetchall()
+        rows = conn.execute("SELECT name, last_updated FROM libraries").fetchall()
         
-        for row in rows:
-            if row['last_updated']:  # Only add if there's a timestamp
-                updates[row['name']] = row['last_updated']
+        for name, last_updated in rows:
+            if last_updated:  # Only add if there's a timestamp
+                updates[name] = last_updated
         
-        conn.close()
         logger.debug(f"Found {len(updates)} library update times in database")
         
     except Exception as e:
@@ -255,6 +602,33 @@ def normalize_path(path):
                 return test_path
     return path
 
+def find_photo(conn, id_or_filename, path_hint=None):
+    """Look a photo up by ID, then by the path hint, then (unless it looks like an ID) by filename
+
+    Returns:
+        (path, hash) row, or None if no photo matches
+    """
+    cursor = conn.cursor()
+    logger.debug(f"Looking up photo by ID: {id_or_filename}")
+    cursor.execute("SELECT path, hash FROM photos WHERE id = ?", (id_or_filename,))
+    result = cursor.fetchone()
+    
+    # If ID lookup failed, try path hint if available
+    if not result and path_hint:
+        logger.debug(f"Looking up photo by path hint: {path_hint}")
+        cursor.execute("SELECT path, hash FROM photos WHERE path = ?", (path_hint,))
+        result = cursor.fetchone()
+    
+    # No filename fallback for numeric IDs - only use hint if explicitly provided
+    if not result and not id_or_filename.isdigit():
+        logger.debug(f"Looking up photo by filename: {id_or_filename}")
+        cursor.execute("SELECT path, hash FROM photos WHERE filename = ?", (id_or_filename,))
+        result = cursor.fetchone()
+    
+    if result:
+        logger.debug(f"Found photo path in DB: {result[0]}")
+    return result
+
 # Custom request handler to serve photo thumbnails
 class PhotoHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
     def log_message(self, format, *args):
@@ -353,44 +727,12 @@ class PhotoHTTPRequestHandler(http.server.SimpleHTTPRequestHandler):
                 
             logger.info(f"Found {len(libraries)} libraries")
             
-            # Then get photos with location data - include path
-            # Use ROW_NUMBER to ensure we only get one instance of each unique photo per location
-            # This allows photos with same filename but different coordinates to appear separately
-            # while still preventing true duplicates
-            cursor.execute('''
-            WITH RankedPhotos AS (
-                SELECT 
-                    p.filename, p.path, p.latitude, p.longitude, p.datetime, 
-                    p.marker_data, p.library_id, l.name as library_name,
-                    ROW_NUMBER() OVER(PARTITION BY p.filename, ROUND(p.latitude, 4), ROUND(p.longitude, 4) ORDER BY p.id) as rn
-                FROM photos p
-                LEFT JOIN libraries l ON p.library_id = l.id
-                WHERE p.latitude IS NOT NULL AND p.longitude IS NOT NULL
-            )
-            SELECT 
-                filename, path, latitude, longitude, datetime, 
-                marker_data, library_id, library_name
-            FROM RankedPhotos
-            WHERE rn = 1
-            ''')
-            
-            rows = cursor.fetchall()
-            photos = []
+            # Then get photos with location data, de-duplicated like /api/markers
+            rows = query_marker_rows(conn)
             
             logger.info(f"Legacy API: Filtered out duplicate photos with same filename at same coordinates, returning {len(rows)} unique photos")
             
-            for row in rows:
-                photo = dict(row)
-                # Parse marker_data from JSON string if available
-                if photo['marker_data']:
-                    try:
-                        photo['marker_data'] = json.loads(photo['marker_data'])
-                    except Exception:
-                        photo['marker_data'] = {}
-                else:
-                    photo['marker_data'] = {}
-                
-                photos.append(photo)
+            photos = [row_to_marker(row) for row in rows]
             
             # Send response
             self.send_response(200)
@@ -418,54 +760,27 @@ def convert_photo(id_or_filename):
     logger.info(f"Converting and serving photo with ID or filename: {id_or_filename}")
     
     # Check for additional query parameters (path)
-    photo_id = id_or_filename  # Now using path parameter as ID first
     path_hint = request.args.get('path')
-    quality = int(request.args.get('quality', '90'))
+    try:
+        quality = int(request.args.get('quality', DEFAULT_QUALITY))
+        max_dimension = request.args.get('max', 0, type=int) or None
+        if not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100")
+    except ValueError as e:
+        return {"error": f"Invalid parameter: {e}"}, 400
     
     try:
-        # Connect to database
-        db_path = os.path.join(os.getcwd(), 'data', 'photo_library.db')
-        if not os.path.exists(db_path):
-            logger.error(f"Database not found: {db_path}")
+        conn = get_db()
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
             return "Database not found", 404
-            
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # Try different lookup strategies in order of specificity
-        if photo_id is not None:
-            logger.debug(f"Looking up photo by ID: {photo_id}")
-            cursor.execute("SELECT path FROM photos WHERE id = ?", (photo_id,))
-            result = cursor.fetchone()
-            if result:
-                logger.debug(f"Found photo by ID: {photo_id}")
-        else:
-            result = None
-            
-        # If ID lookup failed or wasn't provided, try path hint if available
-        if not result and path_hint:
-            logger.debug(f"Looking up photo by path hint: {path_hint}")
-            cursor.execute("SELECT path FROM photos WHERE path = ?", (path_hint,))
-            result = cursor.fetchone()
-            if result:
-                logger.debug(f"Found photo by path hint: {path_hint}")
-        
-        # No longer fall back to filename lookup when using ID - only use hint if explicitly provided
-        if not result and not photo_id.isdigit():
-            # Only do a filename lookup if the provided parameter doesn't look like a numeric ID
-            filename = id_or_filename
-            logger.debug(f"Looking up photo by filename: {filename}")
-            cursor.execute("SELECT path FROM photos WHERE filename = ?", (filename,))
-            result = cursor.fetchone()
-            
-        conn.close()
+        result = find_photo(conn, id_or_filename, path_hint)
         
         if not result:
             logger.error(f"Photo not found in database: {id_or_filename}")
             return "Photo not found in database", 404
             
-        photo_path = result[0]
-        logger.debug(f"Found photo path in DB: {photo_path}")
+        photo_path, photo_hash = result
         
         normalized_path = normalize_path(photo_path)
         
@@ -479,41 +794,38 @@ def convert_photo(id_or_filename):
         is_heic = original_filename.lower().endswith('.heic')
         
         if is_heic and HEIC_SUPPORT:
-            logger.debug(f"Converting HEIC file to JPEG: {normalized_path}")
+            # Conversions are cached by content, so repeat views cost a sendfile instead of a re-encode
+            etag = conversion_key(photo_hash, quality, max_dimension)
+            if photo_hash and request.if_none_match.contains(etag):
+                return "", 304, {'ETag': f'"{etag}"', 'Cache-Control': 'public, max-age=86400'}
             try:
-                # Ensure HEIF opener is registered
-                try:
-                    from pillow_heif import register_heif_opener
-                    register_heif_opener()
-                    logger.debug("HEIF opener registered successfully")
-                except ImportError:
-                    logger.error("pillow-heif not found, attempting to use PIL directly")
+                if photo_hash:
+                    cache = get_conversion_cache()
+                    converted_path = cache.get(etag, '.jpg')
+                    if converted_path is None and transcoder is not None:
+                        # Decode in the transcoder's worker processes, ahead of background jobs
+                        converted_path = transcoder.submit(
+                            f"convert:{etag}", (PRIORITY_REQUEST, 0), convert_job, cache.root, cache.max_bytes,
+                            photo_hash, normalized_path, quality, max_dimension
+                        ).result(REQUEST_WAIT_SECONDS)
+                    elif converted_path is None:
+                        converted_path = get_converted_jpeg(cache, photo_hash, normalized_path, quality, max_dimension)
+                    logger.debug(f"Serving cached HEIC conversion: {converted_path}")
+                    response = send_file(converted_path, mimetype='image/jpeg', etag=etag, conditional=True,
+                                         max_age=86400)
+                    response.cache_control.public = True
+                    return response
                 
-                with Image.open(normalized_path) as img:
-                    # Get image details for debugging
-                    img_format = img.format
-                    img_mode = img.mode
-                    img_size = img.size
-                    logger.info(f"Image details before conversion: format={img_format}, mode={img_mode}, size={img_size}")
-                    
-                    # Convert to RGB mode if needed
-                    if img.mode != 'RGB':
-                        img = img.convert('RGB')
-                    
-                    buffer = io.BytesIO()
-                    # Convert to JPEG at specified quality for full resolution
-                    img.save(buffer, format='JPEG', quality=quality, optimize=True)
-                    buffer.seek(0)
-                    
-                    # Log success
-                    content_length = buffer.getbuffer().nbytes
-                    logger.info(f"Successfully converted HEIC to JPEG: size={img_size}, output bytes={content_length}")
-                    
-                    return buffer.getvalue(), 200, {
-                        'Content-Type': 'image/jpeg',
-                        'Content-Length': str(content_length),
-                        'Cache-Control': 'max-age=3600'
-                    }
+                # Rows without a hash cannot be cached safely
+                data = convert_to_jpeg(normalized_path, quality, max_dimension)
+                logger.info(f"Converted uncached HEIC to JPEG: output bytes={len(data)}")
+                return data, 200, {
+                    'Content-Type': 'image/jpeg',
+                    'Content-Length': str(len(data)),
+                    'Cache-Control': 'max-age=3600'
+                }
+            except concurrent.futures.TimeoutError:
+                return "Conversion in progress", 503, {'Retry-After': '2'}
             except Exception as e:
                 logger.error(f"Error converting HEIC file: {e}")
                 return f"Error converting HEIC file: {str(e)}", 500
@@ -526,12 +838,293 @@ def convert_photo(id_or_filename):
         logger.exception(f"Error converting photo: {e}")
         return f"Internal server error: {str(e)}", 500
 
+def start_preview_transcoder(transcode_workers=None, backfill_lock=None):
+    """Start this process's HEIC/RAW transcoder pool and preview scheduler"""
+    global transcoder, preview_scheduler
+    transcoder = TranscoderPool(transcode_workers)
+    preview_scheduler = PreviewScheduler(transcoder, get_db_pool().db_path, get_thumbnail_cache(),
+                                         backfill_lock=backfill_lock)
+    preview_scheduler.start()
+    logger.info(f"Started preview transcoder with {transcoder.max_workers} worker processes")
+
+if HAS_GUNICORN:
+    class GunicornServer(gunicorn.app.base.BaseApplication):
+        """Runs the Flask app in gunicorn worker processes with the given config settings"""
+
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+def run_production_server(host, port, workers=None, threads=None, transcode_workers=None, previews=True):
+    """Serve the app with gunicorn, or waitress where gunicorn is unavailable
+
+    gunicorn preloads the app (routes, database checks) once and forks the
+    workers, each with threads request threads. SIGHUP to the master replaces
+    the workers gracefully; SIGTERM drains them and exits. Each worker gets its
+    share of the transcode workers, and one worker at a time backfills previews.
+    waitress serves from threads in a single process.
+
+    Returns:
+        False if neither server is installed
+    """
+    workers = workers or DEFAULT_PRODUCTION_WORKERS
+    threads = threads or DEFAULT_PRODUCTION_THREADS
+    if HAS_GUNICORN:
+        per_worker = max(1, (transcode_workers or max(1, multiprocessing.cpu_count() - 1)) // workers)
+
+        def post_worker_init(worker):
+            if previews:
+                start_preview_transcoder(per_worker, os.path.join(get_thumbnail_cache().root, '.backfill.lock'))
+
+        # SQLite connections must not cross a fork; each worker opens its own
+        get_db_pool().close_all()
+        logger.info(f"Starting gunicorn at http://{host}:{port} with {workers} workers x {threads} threads")
+        GunicornServer(app, {
+            'bind': f"{host}:{port}",
+            'workers': workers,
+            'threads': threads,
+            'worker_class': 'gthread',
+            'preload_app': True,
+            'timeout': WORKER_TIMEOUT,
+            'graceful_timeout': GRACEFUL_TIMEOUT,
+            'post_worker_init': post_worker_init,
+        }).run()
+        return True
+    if HAS_WAITRESS:
+        if previews:
+            start_preview_transcoder(transcode_workers)
+        logger.info(f"Starting waitress at http://{host}:{port} with {threads} threads (gunicorn not installed)")
+        waitress.serve(app, host=host, port=port, threads=threads)
+        return True
+    logger.warning("Production mode needs gunicorn or waitress (pip install gunicorn waitress)")
+    return False
+
+class ClientConcurrencyLimiter:
+    """Caps the requests each client address has in progress; further requests wait their turn"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._clients = {}  # address -> [semaphore, requests holding or waiting]
+
+    async def run(self, client, handler, request):
+        entry = self._clients.get(client)
+        if entry is None:
+            entry = self._clients[client] = [asyncio.Semaphore(self.limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await handler(request)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._clients[client]
+
+def locate_photo_file(id_or_filename, path_hint=None):
+    """Find a photo's file for the async routes (blocking: database lookup and file check)
+
+    Returns:
+        (path, hash) of an existing file, or (None, (message, status)) if there is none
+    """
+    with get_db_pool().connection() as conn:
+        if conn is None:
+            logger.error(f"Database not found: {db_pool.db_path}")
+            return None, ("Database not found", 404)
+        result = find_photo(conn, id_or_filename, path_hint)
+    if not result:
+        logger.error(f"Photo not found in database: {id_or_filename}")
+        return None, ("Photo not found in database", 404)
+    photo_path, photo_hash = result
+    normalized_path = normalize_path(photo_path)
+    if not os.path.exists(normalized_path):
+        logger.error(f"Photo file not found at {normalized_path}")
+        return None, (f"Photo file not found at {normalized_path}", 404)
+    return normalized_path, photo_hash
+
+def create_async_app(client_concurrency=DEFAULT_CLIENT_CONCURRENCY):
+    """Build the aiohttp application of the async serving mode
+
+    /photos/ and /convert/ are served on the event loop: lookups run on a
+    thread pool, HEIC decoding in the transcoder's processes (or a bounded
+    decode thread pool without it), and files go out with sendfile. Every
+    other route is answered by the Flask app on the thread pool, streaming
+    its response. Each client address has at most client_concurrency
+    requests in progress.
+    """
+    io_executor = concurrent.futures.ThreadPoolExecutor(ASYNC_IO_THREADS, thread_name_prefix='async-io')
+    decode_executor = concurrent.futures.ThreadPoolExecutor(ASYNC_DECODE_THREADS, thread_name_prefix='async-decode')
+    limiter = ClientConcurrencyLimiter(client_concurrency)
+    
+    def blocking(executor, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    
+    @web.middleware
+    async def limit_per_client(request, handler):
+        return await limiter.run(request.remote, handler, request)
+    
+    async def serve_original_photo(request):
+        id_or_filename = urllib.parse.unquote(request.match_info['id_or_filename'])
+        logger.info(f"Serving original photo with ID or filename: {id_or_filename}")
+        try:
+            photo_path, error = await blocking(io_executor, locate_photo_file, id_or_filename,
+                                               request.query.get('path'))
+            if photo_path is None:
+                return web.Response(text=error[0], status=error[1])
+            return web.FileResponse(photo_path)
+        except Exception as e:
+            logger.exception(f"Error serving original photo: {e}")
+            return web.Response(text=f"Internal server error: {str(e)}", status=500)
+    
+    async def convert_photo(request):
+        id_or_filename = urllib.parse.unquote(request.match_info['id_or_filename'])
+        logger.info(f"Converting and serving photo with ID or filename: {id_or_filename}")
+        try:
+            quality = int(request.query.get('quality', DEFAULT_QUALITY))
+            max_dimension = int(request.query.get('max') or 0) or None
+            if not 1 <= quality <= 100:
+                raise ValueError("quality must be between 1 and 100")
+        except ValueError as e:
+            return web.json_response({"error": f"Invalid parameter: {e}"}, status=400)
+        
+        try:
+            photo_path, photo_hash = await blocking(io_executor, locate_photo_file, id_or_filename,
+                                                    request.query.get('path'))
+            if photo_path is None:
+                message, status = photo_hash
+                return web.Response(text=message, status=status)
+            if not (os.path.basename(photo_path).lower().endswith('.heic') and HEIC_SUPPORT):
+                return web.FileResponse(photo_path)
+            
+            if not photo_hash:
+                # Rows without a hash cannot be cached safely
+                data = await blocking(decode_executor, convert_to_jpeg, photo_path, quality, max_dimension)
+                return web.Response(body=data, content_type='image/jpeg', headers={'Cache-Control': 'max-age=3600'})
+            
+            etag = conversion_key(photo_hash, quality, max_dimension)
+            cache = get_conversion_cache()
+            converted_path = await blocking(io_executor, cache.get, etag, '.jpg')
+            if converted_path is None and transcoder is not None:
+                job = transcoder.submit(f"convert:{etag}", (PRIORITY_REQUEST, 0), convert_job, cache.root,
+                                        cache.max_bytes, photo_hash, photo_path, quality, max_dimension)
+                try:
+                    # shield: a request giving up must not cancel a conversion other viewers wait for
+                    converted_path = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(job)),
+                                                            REQUEST_WAIT_SECONDS)
+                except asyncio.TimeoutError:
+                    return web.Response(text="Conversion in progress", status=503, headers={'Retry-After': '2'})
+            elif converted_path is None:
+                converted_path = await blocking(decode_executor, get_converted_jpeg, cache, photo_hash, photo_path,
+                                                quality, max_dimension)
+            # FileResponse answers If-None-Match/If-Modified-Since itself
+            return web.FileResponse(converted_path, headers={'Content-Type': 'image/jpeg',
+                                                             'Cache-Control': 'public, max-age=86400'})
+        except Exception as e:
+            logger.error(f"Error converting HEIC file: {e}")
+            return web.Response(text=f"Error converting HEIC file: {str(e)}", status=500)
+    
+    async def flask_fallback(request):
+        body = await request.read()
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': request.url.host or 'localhost',
+            'SERVER_PORT': str(request.url.port or 80),
+            'SERVER_PROTOCOL': f"HTTP/{request.version.major}.{request.version.minor}",
+            'REMOTE_ADDR': request.remote or '',
+            'CONTENT_TYPE': request.headers.get('Content-Type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': request.scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in request.headers.items():
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            if key not in ('HTTP_CONTENT_TYPE', 'HTTP_CONTENT_LENGTH'):
+                environ[key] = f"{environ[key]},{value}" if key in environ else value
+        
+        started = []
+        def start_response(status, headers, exc_info=None):
+            started[:] = [status, headers]
+        
+        # One context for the whole response, so streamed responses (stream_with_context) can resume
+        # their request context on whichever pool thread produces the next chunk
+        context = contextvars.copy_context()
+        iterable = await blocking(io_executor, context.run, app, environ, start_response)
+        chunks = iter(iterable)
+        try:
+            chunk = await blocking(io_executor, context.run, next, chunks, None)
+            status, headers = started
+            response = web.StreamResponse(status=int(status.split(' ', 1)[0]))
+            for name, value in headers:
+                response.headers.add(name, value)
+            await response.prepare(request)
+            while chunk is not None:
+                await response.write(chunk)
+                chunk = await blocking(io_executor, context.run, next, chunks, None)
+            await response.write_eof()
+            return response
+        finally:
+            if hasattr(iterable, 'close'):
+                await blocking(io_executor, context.run, iterable.close)
+    
+    async def shutdown_executors(_app):
+        io_executor.shutdown(wait=False)
+        decode_executor.shutdown(wait=False)
+    
+    async_app = web.Application(middlewares=[limit_per_client])
+    async_app.router.add_get('/photos/{id_or_filename:.+}', serve_original_photo)
+    async_app.router.add_get('/convert/{id_or_filename:.+}', convert_photo)
+    async_app.router.add_route('*', '/{tail:.*}', flask_fallback)
+    async_app.on_cleanup.append(shutdown_executors)
+    return async_app
+
+def run_async_server(host, port, client_concurrency=None, transcode_workers=None, previews=True):
+    """Serve the app from an asyncio event loop (see create_async_app)
+
+    Returns:
+        False if aiohttp is not installed
+    """
+    if not HAS_AIOHTTP:
+        logger.warning("Async mode needs aiohttp (pip install aiohttp)")
+        return False
+    if previews:
+        start_preview_transcoder(transcode_workers)
+    client_concurrency = client_concurrency or DEFAULT_CLIENT_CONCURRENCY
+    logger.info(f"Starting aiohttp server at http://{host}:{port} ({client_concurrency} requests per client)")
+    web.run_app(create_async_app(client_concurrency), host=host, port=port, print=None)
+    return True
+
 def signal_handler(sig, frame):
     logger.info("Gracefully shutting down server...")
     sys.exit(0)
 
-def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host="0.0.0.0"):
-    """Start a Flask server to serve the photo heatmap viewer"""
+def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host="0.0.0.0", thumbnail_cache_mb=None,
+                 conversion_cache_mb=None, transcode_workers=None, production=False, workers=None, threads=None,
+                 async_mode=False, client_concurrency=None):
+    """Start a Flask server to serve the photo heatmap viewer
+
+    With production=True the app is served by run_production_server, with
+    async_mode=True by run_async_server, instead of the Flask development server.
+    """
+    global thumbnail_cache_max_bytes, conversion_cache_max_bytes, db_pool
+    if thumbnail_cache_mb:
+        thumbnail_cache_max_bytes = thumbnail_cache_mb * 1024 * 1024
+    if conversion_cache_mb:
+        conversion_cache_max_bytes = conversion_cache_mb * 1024 * 1024
+    
     # Register signal handler for Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
     
@@ -546,21 +1139,24 @@ def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host=
     else:
         logger.warning("HEIC file support is not available. Install pillow-heif package for HEIC support.")
     
+    # A --db path is relative to where the server was started, not to the served directory
+    if db_path:
+        db_path = os.path.abspath(db_path)
+    
     # Change to the specified directory
     os.chdir(directory)
     
     # Log server startup
     logger.info(f"Starting server in directory: {os.path.abspath(directory)}")
     
-    # Check if database exists
-    db_path = os.path.join(os.getcwd(), 'data', 'photo_library.db')
-    if not os.path.exists(db_path):
-        db_path = os.path.join(os.getcwd(), 'photo_library.db')
-        
+    # Resolve the database once; every request borrows a read-only connection to it
+    db_path = resolve_db_path(db_path)
+    db_pool = ReadOnlyConnectionPool(db_path)
+    
     if os.path.exists(db_path):
         logger.info(f"Found database at {db_path}")
         try:
-            conn = sqlite3.connect(db_path)
+            conn = db_pool.acquire()
             cursor = conn.cursor()
             
             # Get some basic stats
@@ -574,12 +1170,15 @@ def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host=
             library_count = cursor.fetchone()[0]
             
             logger.info(f"Database contains {photo_count} photos ({gps_count} with GPS data) in {library_count} libraries")
-            conn.close()
+            db_pool.release(conn)
         except Exception as e:
             logger.error(f"Error checking database: {e}")
     else:
         logger.warning(f"Database not found at {db_path}")
     
+    # Pre-generate HEIC/RAW previews in worker processes (transcode_workers=0 renders them inline)
+    previews = transcode_workers != 0 and os.path.exists(db_path)
+    
     # Define Flask routes for serving static files
     @app.route('/')
     def serve_index():
@@ -593,53 +1192,20 @@ def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host=
         logger.info(f"Serving original photo with ID or filename: {id_or_filename}")
         
         # Check for additional query parameters (path)
-        photo_id = id_or_filename  # Now using path parameter as ID first
         path_hint = request.args.get('path')
         
         try:
-            # Connect to database
-            db_path = os.path.join(os.getcwd(), 'data', 'photo_library.db')
-            if not os.path.exists(db_path):
-                logger.error(f"Database not found: {db_path}")
+            conn = get_db()
+            if conn is None:
+                logger.error(f"Database not found: {db_pool.db_path}")
                 return "Database not found", 404
-                
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            
-            # Try different lookup strategies in order of specificity
-            if photo_id is not None:
-                logger.debug(f"Looking up photo by ID: {photo_id}")
-                cursor.execute("SELECT path FROM photos WHERE id = ?", (photo_id,))
-                result = cursor.fetchone()
-                if result:
-                    logger.debug(f"Found photo by ID: {photo_id}")
-            else:
-                result = None
-                
-            # If ID lookup failed or wasn't provided, try path hint if available
-            if not result and path_hint:
-                logger.debug(f"Looking up photo by path hint: {path_hint}")
-                cursor.execute("SELECT path FROM photos WHERE path = ?", (path_hint,))
-                result = cursor.fetchone()
-                if result:
-                    logger.debug(f"Found photo by path hint: {path_hint}")
-            
-            # No longer fall back to filename lookup when using ID - only use hint if explicitly provided
-            if not result and not photo_id.isdigit():
-                # Only do a filename lookup if the provided parameter doesn't look like a numeric ID
-                filename = id_or_filename
-                logger.debug(f"Looking up photo by filename: {filename}")
-                cursor.execute("SELECT path FROM photos WHERE filename = ?", (filename,))
-                result = cursor.fetchone()
-                
-            conn.close()
+            result = find_photo(conn, id_or_filename, path_hint)
             
             if not result:
                 logger.error(f"Photo not found in database: {id_or_filename}")
                 return "Photo not found in database", 404
                 
             photo_path = result[0]
-            logger.debug(f"Found photo path in DB: {photo_path}")
             
             normalized_path = normalize_path(photo_path)
             
@@ -657,12 +1223,18 @@ def start_server(port=8000, directory='.', debug_mode=False, db_path=None, host=
             logger.exception(f"Error serving original photo: {e}")
             return f"Internal server error: {str(e)}", 500
     
-    # Endpoint for serving thumbnails has been removed
-    
     @app.route('/<path:path>')
     def serve_static(path):
         return send_from_directory(os.path.abspath(directory), path)
     
+    if production and run_production_server(host, port, workers, threads, transcode_workers, previews):
+        return
+    if async_mode and run_async_server(host, port, client_concurrency, transcode_workers, previews):
+        return
+    
+    if previews:
+        start_preview_transcoder(transcode_workers)
+    
     # Start the Flask application
     logger.info(f"Starting Flask server at http://{host}:{port}")
     app.run(host=host, port=port, debug=debug_mode)
@@ -674,6 +1246,21 @@ if __name__ == "__main__":
     parser.add_argument('--debug', action='store_true', help='Enable debug logging')
     parser.add_argument('--db', default=None, help='Path to the photo library database')
     parser.add_argument('--host', default='0.0.0.0', help='Host address to bind the server to')
+    parser.add_argument('--thumbnail-cache-mb', type=int, help='Size limit of the thumbnail cache in MB (default: 1024)')
+    parser.add_argument('--conversion-cache-mb', type=int, help='Size limit of the HEIC conversion cache in MB (default: 4096)')
+    parser.add_argument('--transcode-workers', type=int,
+                        help='Worker processes pre-generating HEIC/RAW previews (default: CPU count - 1; 0 disables)')
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--production', action='store_true',
+                      help='Serve with gunicorn worker processes (waitress threads where gunicorn is unavailable)')
+    mode.add_argument('--async', dest='async_mode', action='store_true',
+                      help='Serve photos from an asyncio event loop with aiohttp (other routes still run in Flask)')
+    parser.add_argument('--client-concurrency', type=int,
+                        help=f'Async mode: requests in progress per client address (default: {DEFAULT_CLIENT_CONCURRENCY})')
+    parser.add_argument('--workers', type=int,
+                        help=f'Production mode: worker processes (default: {DEFAULT_PRODUCTION_WORKERS})')
+    parser.add_argument('--threads', type=int,
+                        help=f'Production mode: request threads per worker (default: {DEFAULT_PRODUCTION_THREADS})')
     
     args = parser.parse_args()
     
@@ -682,4 +1269,7 @@ if __name__ == "__main__":
         logger.setLevel(logging.DEBUG)
         logger.info("Debug logging enabled")
     
-    start_server(port=args.port, directory=args.dir, debug_mode=args.debug, db_path=args.db, host=args.host)
\ No newline at end of file
+    start_server(port=args.port, directory=args.dir, debug_mode=args.debug, db_path=args.db, host=args.host,
+                 thumbnail_cache_mb=args.thumbnail_cache_mb, conversion_cache_mb=args.conversion_cache_mb,
+                 transcode_workers=args.transcode_workers, production=args.production, workers=args.workers,
+                 threads=args.threads, async_mode=args.async_mode, client_concurrency=args.client_concurrency)
\ No newline at end of file
@@ -38,6 +38,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // Schedule regular updates for library update times
     setInterval(fetchLibraryUpdateTimes, 60000); // Update every minute
+    
+    // Pick up photos added, changed or removed by process_photos.py without reloading
+    setInterval(syncMarkerChanges, 60000);
 });
 
 // Apply mobile-specific settings
@@ -90,12 +90,17 @@ function updateHeatmap(photos) {
 
     // Create heatmap points with varying intensity based on the slider
     const intensityValue = parseInt(document.getElementById('intensity').value);
+
+    // Large libraries: aggregate on the server instead of one heat point per photo
+    if (typeof createServerHeatLayer !== 'undefined' && photos.length > SERVER_HEAT_THRESHOLD) {
+        const allLibraries = photoData.libraries.length === photoData.activeLibraries.length;
+        heatLayer = createServerHeatLayer(allLibraries ? null : photoData.activeLibraries, intensityValue,
+            parseInt(document.getElementById('radius').value)).addTo(map);
+        debugLog(`Using server-side heatmap for ${photos.length} photos`);
+        return;
+    }
     // Use slider value as weight multiplier for each point
-    const points = photos.map(photo => [
-        photo.latitude,
-        photo.longitude,
-        intensityValue / 10  // Use intensity slider to affect point weights
-    ]);
+    const points = heatPoints(photos, intensityValue);
 
     debugLog(`Setting heatmap with point weight: ${intensityValue / 10} (from intensity value: ${intensityValue})`);
     
@@ -111,6 +116,29 @@ function updateHeatmap(photos) {
     debugLog(`Heatmap created with ${points.length} points`);
 }
 
+// Heat layer points, weighted by the intensity slider
+function heatPoints(photos, intensityValue) {
+    return photos.map(photo => [
+        photo.latitude,
+        photo.longitude,
+        intensityValue / 10  // Use intensity slider to affect point weights
+    ]);
+}
+
+// Refresh the heatmap's data in place after incremental marker changes
+function patchHeatmap(photos) {
+    if (!heatLayer) {
+        return;
+    }
+    if (typeof heatLayer.reload === 'function') {
+        heatLayer.reload();  // Server-side cells
+    } else if (typeof heatLayer.redraw === 'function' && typeof heatLayer.setLatLngs !== 'function') {
+        heatLayer.redraw();  // Server-rendered PNG tiles
+    } else {
+        heatLayer.setLatLngs(heatPoints(photos, parseInt(document.getElementById('intensity').value)));
+    }
+}
+
 // Function to update only the heatmap without touching markers
 function updateHeatmapOnly() {
     debugLog('Updating only heatmap with new settings');
@@ -43,6 +43,29 @@ function updateMarkers(inputPhotos = []) {
         markerGroup = null; // Explicitly null it out to ensure full recreation
     }
 
+    // Large libraries: let the server cluster instead of building a marker per photo here
+    if (typeof ServerClusterLayer !== 'undefined' && filteredPhotos.length > SERVER_CLUSTER_THRESHOLD) {
+        const allLibraries = photoData.libraries.length === photoData.activeLibraries.length;
+        markerGroup = new ServerClusterLayer(allLibraries ? null : photoData.activeLibraries);
+        map.addLayer(markerGroup);
+        debugLog(`Using server-side clusters for ${filteredPhotos.length} photos`);
+
+        if (progressBar) {
+            progressBar.style.width = '100%';
+        }
+        if (loadingMessage) {
+            loadingMessage.textContent = 'Complete!';
+        }
+        window._markerUpdateInProgress = false;
+        window._markerLoadingLogged = false;
+        setTimeout(() => {
+            if (loadingElement) {
+                loadingElement.style.display = 'none';
+            }
+        }, 800);
+        return;
+    }
+
     // Create new marker group
     try {
         markerGroup = typeof L.markerClusterGroup === 'function'
@@ -177,101 +200,10 @@ function updateMarkers(inputPhotos = []) {
     }
 
     function addMarker(photo) {
-        if (photo.latitude == null || photo.longitude == null) {
-            debugLog(`Skipping photo with invalid coordinates: ${photo.filename}`);
-            return;
+        const marker = createPhotoMarker(photo);
+        if (marker) {
+            markerGroup.addLayer(marker);
         }
-
-        const marker = L.marker([photo.latitude, photo.longitude]);
-        marker.photoData = photo;
-
-        const container = document.createElement('div');
-        container.className = 'marker-popup';
-        container.innerHTML = `
-            <strong>${photo.filename || 'Unknown'}</strong><br>
-            ${photo.datetime ? new Date(photo.datetime).toLocaleString() : 'No date'}<br>
-            <div class="popup-image-container" style="width: 150px; height: 150px; background: #f0f0f0; display: flex; align-items: center; justify-content: center;">
-                <span class="loading-placeholder">Loading...</span>
-            </div>
-        `;
-
-        marker.bindPopup(container);
-
-        marker.on('popupopen', function () {
-            const imageContainer = container.querySelector('.popup-image-container');
-            if (!imageContainer.querySelector('img')) {
-                const img = new Image();
-                img.style.maxWidth = '150px';
-                img.style.maxHeight = '150px';
-
-                img.onload = function () {
-                    imageContainer.innerHTML = '';
-                    imageContainer.appendChild(img);
-                };
-
-                img.onerror = function () {
-                    imageContainer.innerHTML = 'Image not available';
-                    debugLog(`Failed to load popup image for ${photo.filename}`);
-                };
-
-                // Use only ID without fallback
-                if (photo.id) {
-                    img.src = `/photos/${encodeURIComponent(photo.id)}`;
-                } else {
-                    // If no ID is available (shouldn't happen in normal operation), log a warning and use filename
-                    debugLog(`Warning: No ID available for popup image: ${photo.filename}`);
-                    img.src = `/photos/${encodeURIComponent(photo.filename)}`;
-                }
-            }
-        });
-
-        marker.on('click', function (e) {
-            // Find all photos at exactly the same coordinates using what's available in photoData
-            // rather than depending on the outer scope's filteredPhotos
-            const currentPhotos = filterPhotosByActiveLibraries();
-            
-            // Filter photos by exact coordinates
-            let photosAtSameLocation = currentPhotos.filter(p =>
-                p.latitude === photo.latitude && p.longitude === photo.longitude
-            );
-
-            // Log the found photos for verification
-            debugLog(`Found ${photosAtSameLocation.length} photos at location ${photo.latitude},${photo.longitude}`);
-            
-            // Deduplicate by ID if available, otherwise fall back to filename
-            const uniqueIds = new Set();
-            const uniquePhotos = [];
-            
-            // Ensure path information is available and deduplicate
-            photosAtSameLocation.forEach(p => {
-                // Always ensure full path is available
-                if (!p.full_path) {
-                    p.full_path = p.path || '';
-                }
-                
-                // Use photo ID for deduplication if available, otherwise use filename
-                const uniqueKey = p.id || p.filename;
-                
-                // Only include photos with unique IDs (or filenames if ID not available)
-                if (!uniqueIds.has(uniqueKey)) {
-                    uniqueIds.add(uniqueKey);
-                    uniquePhotos.push(p);
-                    debugLog(`Location photo: ${p.filename}, ID: ${p.id || 'unknown'}, Path: ${p.full_path}, Library: ${p.library_id}`);
-                } else {
-                    debugLog(`Skipping duplicate photo at location: ${p.filename}, ID: ${p.id || 'unknown'}`);
-                }
-            });
-
-            debugLog(`Marker clicked: ${photo.filename} (${uniquePhotos.length} unique photos at this location after deduplication)`);
-
-            const index = uniquePhotos.findIndex(p => p.id === photo.id);
-
-            openPhotoViewer(uniquePhotos, index >= 0 ? index : 0);
-            e.originalEvent?.stopPropagation();
-            L.DomEvent.stopPropagation(e);
-        });
-
-        markerGroup.addLayer(marker);
     }
 
     // Track if finishMarkerLoading has already run to prevent duplicate logging
@@ -385,3 +317,133 @@ function updateMarkers(inputPhotos = []) {
         }, 800);
     }
 }
+
+// Create the marker of one photo, with its popup and click handling (null without coordinates)
+function createPhotoMarker(photo) {
+    if (photo.latitude == null || photo.longitude == null) {
+        debugLog(`Skipping photo with invalid coordinates: ${photo.filename}`);
+        return null;
+    }
+
+    const marker = L.marker([photo.latitude, photo.longitude]);
+    marker.photoData = photo;
+
+    const container = document.createElement('div');
+    container.className = 'marker-popup';
+    container.innerHTML = `
+        <strong>${photo.filename || 'Unknown'}</strong><br>
+        ${photo.datetime ? new Date(photo.datetime).toLocaleString() : 'No date'}<br>
+        <div class="popup-image-container" style="width: 150px; height: 150px; background: #f0f0f0; display: flex; align-items: center; justify-content: center;">
+            <span class="loading-placeholder">Loading...</span>
+        </div>
+    `;
+
+    marker.bindPopup(container);
+
+    marker.on('popupopen', function () {
+        const imageContainer = container.querySelector('.popup-image-container');
+        if (!imageContainer.querySelector('img')) {
+            const img = new Image();
+            img.style.maxWidth = '150px';
+            img.style.maxHeight = '150px';
+
+            img.onload = function () {
+                imageContainer.innerHTML = '';
+                imageContainer.appendChild(img);
+            };
+
+            img.onerror = function () {
+                // HEIC/RAW previews still being generated answer 503; retry once
+                if (!img.dataset.retried) {
+                    img.dataset.retried = 'true';
+                    const url = new URL(img.src);
+                    url.searchParams.set('retry', 1);
+                    setTimeout(() => { img.src = url.toString(); }, 2000);
+                    return;
+                }
+                imageContainer.innerHTML = 'Image not available';
+                debugLog(`Failed to load popup image for ${photo.filename}`);
+            };
+
+            // Cached thumbnail (~10 KB) instead of the original; 400px on high-DPI screens
+            if (photo.id) {
+                const size = window.devicePixelRatio > 1 ? 400 : 150;
+                img.src = `/thumb/${encodeURIComponent(photo.id)}?size=${size}`;
+            } else {
+                // If no ID is available (shouldn't happen in normal operation), log a warning and use filename
+                debugLog(`Warning: No ID available for popup image: ${photo.filename}`);
+                img.src = `/photos/${encodeURIComponent(photo.filename)}`;
+            }
+        }
+    });
+
+    marker.on('click', function (e) {
+        // Find all photos at exactly the same coordinates using what's available in photoData
+        // rather than depending on the outer scope's filteredPhotos
+        const currentPhotos = filterPhotosByActiveLibraries();
+        
+        // Filter photos by exact coordinates
+        let photosAtSameLocation = currentPhotos.filter(p =>
+            p.latitude === photo.latitude && p.longitude === photo.longitude
+        );
+
+        // Log the found photos for verification
+        debugLog(`Found ${photosAtSameLocation.length} photos at location ${photo.latitude},${photo.longitude}`);
+        
+        // Deduplicate by ID if available, otherwise fall back to filename
+        const uniqueIds = new Set();
+        const uniquePhotos = [];
+        
+        // Ensure path information is available and deduplicate
+        photosAtSameLocation.forEach(p => {
+            // Always ensure full path is available
+            if (!p.full_path) {
+                p.full_path = p.path || '';
+            }
+            
+            // Use photo ID for deduplication if available, otherwise use filename
+            const uniqueKey = p.id || p.filename;
+            
+            // Only include photos with unique IDs (or filenames if ID not available)
+            if (!uniqueIds.has(uniqueKey)) {
+                uniqueIds.add(uniqueKey);
+                uniquePhotos.push(p);
+                debugLog(`Location photo: ${p.filename}, ID: ${p.id || 'unknown'}, Path: ${p.full_path}, Library: ${p.library_id}`);
+            } else {
+                debugLog(`Skipping duplicate photo at location: ${p.filename}, ID: ${p.id || 'unknown'}`);
+            }
+        });
+
+        debugLog(`Marker clicked: ${photo.filename} (${uniquePhotos.length} unique photos at this location after deduplication)`);
+
+        const index = uniquePhotos.findIndex(p => p.id === photo.id);
+
+        openPhotoViewer(uniquePhotos, index >= 0 ? index : 0);
+        e.originalEvent?.stopPropagation();
+        L.DomEvent.stopPropagation(e);
+    });
+
+    return marker;
+}
+
+// Apply incremental marker changes in place instead of rebuilding the marker group
+function patchMarkers(removedIds, addedPhotos) {
+    if (!markerGroup) {
+        return;
+    }
+    if (typeof ServerClusterLayer !== 'undefined' && markerGroup instanceof ServerClusterLayer) {
+        markerGroup.reload();
+        return;
+    }
+    const stale = markerGroup.getLayers().filter(marker => marker.photoData && removedIds.has(marker.photoData.id));
+    const fresh = addedPhotos.map(createPhotoMarker).filter(marker => marker);
+    if (typeof markerGroup.removeLayers === 'function') {
+        // Leaflet.markercluster updates its cluster tree for the batch
+        markerGroup.removeLayers(stale);
+        markerGroup.addLayers(fresh);
+    } else {
+        stale.forEach(marker => markerGroup.removeLayer(marker));
+        fresh.forEach(marker => markerGroup.addLayer(marker));
+    }
+    debugLog(`Patched markers: ${stale.length} removed, ${fresh.length} added`);
+}
@@ -5,6 +5,67 @@
 // Global variable to store library update times
 window.libraryUpdateTimes = {};
 
+// Columnar binary marker format served by /api/markers (see marker_format.py)
+const MARKER_BINARY_MIMETYPE = 'application/x-photo-markers';
+const MARKER_MISSING_DATETIME = -2147483648;
+
+// Decode a binary marker response into the same {photos, libraries} shape as the JSON one
+function decodeMarkerPayload(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== 'PHM2') {
+        throw new Error(`Unknown marker format: ${magic}`);
+    }
+    const headerLength = view.getUint32(4, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+    const count = header.count;
+
+    // Columns are little-endian, like every platform browsers run on, so typed arrays can view them directly
+    let offset = 8 + headerLength;
+    const column = (ArrayType) => {
+        const values = new ArrayType(buffer, offset, count);
+        offset += count * 4;
+        return values;
+    };
+    const ids = column(Int32Array);
+    const latitudes = column(Float32Array);
+    const longitudes = column(Float32Array);
+    const libraryIds = column(Int32Array);
+    const datetimes = column(Int32Array);
+    const filenameIndexes = column(Int32Array);
+    const directoryIndexes = column(Int32Array);
+    const decoder = new TextDecoder();
+    const filenames = decoder.decode(new Uint8Array(buffer, offset, header.filenames_bytes)).split('\0');
+    offset += header.filenames_bytes;
+    const directories = decoder.decode(new Uint8Array(buffer, offset, header.directories_bytes)).split('\0');
+
+    const libraryNames = {};
+    (header.libraries || []).forEach(lib => { libraryNames[lib.id] = lib.name; });
+
+    const photos = new Array(count);
+    for (let i = 0; i < count; i++) {
+        const libraryId = libraryIds[i] === -1 ? null : libraryIds[i];
+        const filename = filenames[filenameIndexes[i]];
+        const directoryIndex = directoryIndexes[i];
+        photos[i] = {
+            id: ids[i],
+            filename: filename,
+            // A negative index names an entry holding the whole path
+            path: directoryIndex < 0 ? directories[-directoryIndex - 1] : directories[directoryIndex] + filename,
+            // Float32 keeps ~7 significant digits; drop the binary noise below that
+            latitude: Math.round(latitudes[i] * 1e5) / 1e5,
+            longitude: Math.round(longitudes[i] * 1e5) / 1e5,
+            // Naive local time, as stored in the database
+            datetime: datetimes[i] === MARKER_MISSING_DATETIME ? null :
+                new Date(datetimes[i] * 1000).toISOString().slice(0, 19),
+            library_id: libraryId,
+            library_name: libraryId === null ? null : libraryNames[libraryId],
+            marker_data: {}
+        };
+    }
+    return Object.assign({}, header, { photos: photos, libraries: header.libraries || [] });
+}
+
 // Load photo data
 function loadPhotoData() {
     debugLog('Loading photo data');
@@ -19,12 +80,15 @@ function loadPhotoData() {
     loadingMessage.textContent = 'Fetching photo data...';
     progressBar.style.width = '10%';
     // Use the new API endpoint for markers
-    fetch('/api/markers')
+    fetch('/api/markers', { headers: { 'Accept': `${MARKER_BINARY_MIMETYPE}, application/json;q=0.9` } })
         .then(response => {
             debugLog(`Response status: ${response.status}`);
             if (!response.ok) {
                 throw new Error(`HTTP error! Status: ${response.status}`);
             }
+            if ((response.headers.get('Content-Type') || '').startsWith(MARKER_BINARY_MIMETYPE)) {
+                return response.arrayBuffer().then(decodeMarkerPayload);
+            }
             return response.text().then(text => {
                 try {
                     return JSON.parse(text);
@@ -59,7 +123,8 @@ function loadPhotoData() {
             photoData = {
                 photos: photos,
                 libraries: libraries,
-                activeLibraries: libraries.map(lib => lib.id) // Start with all libraries active
+                activeLibraries: libraries.map(lib => lib.id), // Start with all libraries active
+                version: Array.isArray(data) ? null : data.version // Change log version for syncMarkerChanges
             };
 
             // Create library filter controls
@@ -191,6 +256,48 @@ function loadPhotoData() {
         });
 }
 
+// Fetch the photos inserted, updated or deleted since the loaded version and patch the map in place
+function syncMarkerChanges() {
+    if (!photoData || photoData.version == null || window._syncingMarkerChanges) {
+        return;
+    }
+    window._syncingMarkerChanges = true;
+    fetch(`/api/markers/changes?since=${photoData.version}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP error! Status: ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(changes => {
+            if (changes.reset) {
+                debugLog('Too many marker changes to sync, reloading photo data');
+                loadPhotoData();
+                return;
+            }
+            const upserted = changes.inserted.concat(changes.updated);
+            photoData.version = changes.version;
+            if (upserted.length === 0 && changes.deleted.length === 0) {
+                return;
+            }
+            debugLog(`Syncing markers: ${changes.inserted.length} inserted, ${changes.updated.length} updated, ${changes.deleted.length} deleted`);
+
+            // Updated photos are replaced: their old marker goes, the new one is added
+            const removedIds = new Set(changes.deleted.concat(upserted.map(photo => photo.id)));
+            photoData.photos = photoData.photos.filter(photo => !removedIds.has(photo.id)).concat(upserted);
+
+            const filteredPhotos = filterPhotosByActiveLibraries();
+            document.getElementById('photoCount').textContent = `${filteredPhotos.length} photos with location`;
+            patchHeatmap(filteredPhotos);
+            patchMarkers(removedIds, upserted.filter(photo =>
+                photo.library_id == null || photoData.activeLibraries.includes(photo.library_id)));
+        })
+        .catch(error => debugLog(`Error syncing marker changes: ${error.message}`))
+        .finally(() => {
+            window._syncingMarkerChanges = false;
+        });
+}
+
 // Filter photos by currently active libraries
 function filterPhotosByActiveLibraries() {
     if (!photoData || !photoData.photos || photoData.photos.length === 0) {
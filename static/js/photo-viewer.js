@@ -313,7 +313,7 @@ function updatePhotoViewerContent() {
         
         // For HEIC files, use only ID without fallback
         if (photo.id) {
-            photoViewerImg.src = `/convert/${encodeURIComponent(photo.id)}`;
+            photoViewerImg.src = `/thumb/${encodeURIComponent(photo.id)}?size=1600`;
         } else {
             // If no ID is available (shouldn't happen in normal operation), log a warning and use filename
             debugLog(`Warning: No ID available for HEIC photo: ${photo.filename}`);
@@ -323,7 +323,7 @@ function updatePhotoViewerContent() {
         // For normal images, use only ID without fallback
         if (photo.id) {
             debugLog(`Loading photo ID: ${photo.id} (${photo.filename})`);
-            photoViewerImg.src = `/photos/${encodeURIComponent(photo.id)}?format=jpeg&quality=80`;
+            photoViewerImg.src = `/thumb/${encodeURIComponent(photo.id)}?size=1600`;
         } else {
             // If no ID is available (shouldn't happen in normal operation), log a warning and use filename
             debugLog(`Warning: No ID available for photo: ${photo.filename}`);
@@ -331,6 +331,22 @@ function updatePhotoViewerContent() {
         }
     }
     
+    // HEIC/RAW previews still being generated answer 503; retry a few times
+    photoViewerImg.onerror = function() {
+        const attempts = parseInt(photoViewerImg.dataset.loadAttempts) + 1;
+        if (photoViewerImg.dataset.loadingPhotoId !== (photo.id || photo.filename) || attempts > 3) {
+            return;
+        }
+        photoViewerImg.dataset.loadAttempts = String(attempts);
+        const url = new URL(photoViewerImg.src);
+        url.searchParams.set('retry', attempts);
+        setTimeout(() => {
+            if (photoViewerImg.dataset.loadingPhotoId === (photo.id || photo.filename)) {
+                photoViewerImg.src = url.toString();
+            }
+        }, 2000);
+    };
+    
     // When image loads, ensure full opacity
     photoViewerImg.onload = function() {
         // Make sure this is still the photo we want to show
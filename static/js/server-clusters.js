@@ -0,0 +1,108 @@
+/**
+ * Server-side marker clusters for large libraries (/api/clusters)
+ */
+
+// Above this many photos, clusters come from the server's precomputed pyramid
+// instead of handing every photo to Leaflet.markercluster
+const SERVER_CLUSTER_THRESHOLD = 20000;
+
+// Clicking a cluster with more photos than this zooms in instead of opening the viewer
+const SERVER_CLUSTER_VIEWER_LIMIT = 500;
+
+const ServerClusterLayer = L.LayerGroup.extend({
+    initialize: function (libraryIds) {
+        L.LayerGroup.prototype.initialize.call(this);
+        this._libraryIds = libraryIds;
+        this._requestId = 0;
+    },
+
+    onAdd: function (map) {
+        L.LayerGroup.prototype.onAdd.call(this, map);
+        map.on('moveend', this._refresh, this);
+        this._refresh();
+    },
+
+    onRemove: function (map) {
+        map.off('moveend', this._refresh, this);
+        L.LayerGroup.prototype.onRemove.call(this, map);
+    },
+
+    // Refetch the visible clusters, e.g. after the library changed
+    reload: function () {
+        this._refresh();
+    },
+
+    _libraryParam: function () {
+        return this._libraryIds ? `&libraries=${this._libraryIds.join(',')}` : '';
+    },
+
+    _refresh: function () {
+        if (!this._map) {
+            return;
+        }
+        const bounds = this._map.getBounds();
+        const zoom = this._map.getZoom();
+        const bbox = [bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()]
+            .map(value => value.toFixed(6)).join(',');
+
+        // Ignore responses that arrive after a newer pan/zoom request
+        const requestId = ++this._requestId;
+        fetch(`/api/clusters?z=${zoom}&bbox=${bbox}${this._libraryParam()}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`HTTP error! Status: ${response.status}`);
+                }
+                return response.json();
+            })
+            .then(data => {
+                if (requestId !== this._requestId) {
+                    return;
+                }
+                this.clearLayers();
+                data.clusters.forEach(cluster => this.addLayer(this._createMarker(cluster)));
+                debugLog(`Loaded ${data.clusters.length} server clusters for zoom ${zoom}`);
+            })
+            .catch(err => debugLog('Error loading server clusters: ' + err.message));
+    },
+
+    _createMarker: function (cluster) {
+        let marker;
+        if (cluster.count === 1) {
+            marker = L.marker([cluster.latitude, cluster.longitude]);
+        } else {
+            let sizeClass = 'large';
+            if (cluster.count < 10) {
+                sizeClass = 'small';
+            } else if (cluster.count < 100) {
+                sizeClass = 'medium';
+            }
+            marker = L.marker([cluster.latitude, cluster.longitude], {
+                icon: new L.DivIcon({
+                    html: '<div><span>' + cluster.count + '</span></div>',
+                    className: 'marker-cluster marker-cluster-' + sizeClass,
+                    iconSize: new L.Point(40, 40)
+                })
+            });
+        }
+
+        marker.on('click', (e) => {
+            const [west, south, east, north] = cluster.bounds;
+            if (cluster.count > SERVER_CLUSTER_VIEWER_LIMIT && this._map.getZoom() < this._map.getMaxZoom()) {
+                this._map.fitBounds([[south, west], [north, east]]);
+                return;
+            }
+            // Fetch the photos of this cell and open them like a markercluster cluster
+            fetch(`/api/markers?bbox=${west},${south},${east},${north}${this._libraryParam()}`)
+                .then(response => response.json())
+                .then(data => {
+                    debugLog(`Opening viewer with ${data.photos.length} photos from server cluster`);
+                    if (data.photos.length > 0) {
+                        openPhotoViewer(data.photos, 0);
+                    }
+                })
+                .catch(err => debugLog('Error loading cluster photos: ' + err.message));
+            L.DomEvent.stopPropagation(e);
+        });
+        return marker;
+    }
+});
@@ -0,0 +1,126 @@
+/**
+ * Server-side heatmap tiles for large libraries (/api/heat/{z}/{x}/{y})
+ */
+
+// Above this many photos, the heatmap is built from per-tile density cells
+// instead of one point per photo
+const SERVER_HEAT_THRESHOLD = 20000;
+
+// Highest zoom the server aggregates; deeper zooms reuse these tiles
+const SERVER_HEAT_MAX_ZOOM = 18;
+
+// Weighted-point heat layer: fetches the density cells of the visible tiles
+// and hands them to Leaflet.heat, so the client draws thousands of cells
+// rather than every photo
+const ServerHeatLayer = L.Layer.extend({
+    initialize: function (libraryIds, options) {
+        this._libraryIds = libraryIds;
+        this._options = options;
+        this._tiles = new Map();
+        this._requestId = 0;
+        this._heat = L.heatLayer([], options);
+    },
+
+    onAdd: function (map) {
+        map.addLayer(this._heat);
+        map.on('moveend', this._refresh, this);
+        this._refresh();
+    },
+
+    onRemove: function (map) {
+        map.off('moveend', this._refresh, this);
+        map.removeLayer(this._heat);
+    },
+
+    // Drop the fetched tiles and refetch the visible ones, e.g. after the library changed
+    reload: function () {
+        this._tiles.clear();
+        this._refresh();
+    },
+
+    _visibleTiles: function () {
+        const zoom = Math.min(this._map.getZoom(), SERVER_HEAT_MAX_ZOOM);
+        const count = Math.pow(2, zoom);
+        const bounds = this._map.getPixelBounds();
+        const scale = this._map.getZoomScale(zoom, this._map.getZoom());
+        const clamp = value => Math.max(0, Math.min(count - 1, value));
+        const tiles = [];
+        const minX = clamp(Math.floor(bounds.min.x * scale / 256));
+        const maxX = clamp(Math.floor(bounds.max.x * scale / 256));
+        const minY = clamp(Math.floor(bounds.min.y * scale / 256));
+        const maxY = clamp(Math.floor(bounds.max.y * scale / 256));
+        for (let x = minX; x <= maxX; x++) {
+            for (let y = minY; y <= maxY; y++) {
+                tiles.push(`${zoom}/${x}/${y}`);
+            }
+        }
+        return tiles;
+    },
+
+    _fetchTile: function (key) {
+        if (!this._tiles.has(key)) {
+            const libraries = this._libraryIds ? `?libraries=${this._libraryIds.join(',')}` : '';
+            this._tiles.set(key, fetch(`/api/heat/${key}${libraries}`)
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`HTTP error! Status: ${response.status}`);
+                    }
+                    return response.json();
+                })
+                .then(data => data.points)
+                .catch(err => {
+                    this._tiles.delete(key);
+                    debugLog(`Error loading heat tile ${key}: ${err.message}`);
+                    return [];
+                }));
+        }
+        return this._tiles.get(key);
+    },
+
+    _refresh: function () {
+        if (!this._map) {
+            return;
+        }
+        // Ignore responses that arrive after a newer pan/zoom request
+        const requestId = ++this._requestId;
+        const tiles = this._visibleTiles();
+        Promise.all(tiles.map(key => this._fetchTile(key))).then(results => {
+            if (requestId !== this._requestId) {
+                return;
+            }
+            // Each cell weighs as much as its photos would have individually
+            const points = [];
+            results.forEach(cells => cells.forEach(([lat, lon, count]) => {
+                points.push([lat, lon, count * this._options.pointWeight]);
+            }));
+            this._heat.setLatLngs(points);
+            debugLog(`Server heatmap: ${points.length} cells from ${tiles.length} tiles`);
+        });
+    }
+});
+
+// Create the heat layer for large libraries: weighted cells on desktop,
+// server-rendered PNG tiles on mobile where drawing the layer is expensive
+function createServerHeatLayer(libraryIds, intensityValue, radius) {
+    if (isMobile) {
+        const params = new URLSearchParams({
+            radius: radius,
+            scale: Math.max(1, Math.round(100 / intensityValue))
+        });
+        if (libraryIds) {
+            params.set('libraries', libraryIds.join(','));
+        }
+        return L.tileLayer(`/api/heat/{z}/{x}/{y}.png?${params}`, {
+            maxNativeZoom: SERVER_HEAT_MAX_ZOOM,
+            maxZoom: 19,
+            opacity: 0.8
+        });
+    }
+    return new ServerHeatLayer(libraryIds, {
+        radius: radius,
+        blur: 15,
+        maxZoom: 10,
+        gradient: { 0.4: 'blue', 0.65: 'lime', 1: 'red' },
+        pointWeight: intensityValue / 10
+    });
+}
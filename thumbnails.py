@@ -0,0 +1,139 @@
+# Photo thumbnails: rendering, the on-disk thumbnail cache and pre-generation at ingest time
+import io
+import os
+import logging
+import concurrent.futures
+
+from PIL import Image, ImageOps
+
+from disk_cache import DiskCache, DEFAULT_CACHE_MAX_BYTES
+from exif_header import read_embedded_jpeg, read_exif
+
+logger = logging.getLogger(__name__)
+
+# Try to import HEIC support
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIC_SUPPORT = True
+except ImportError:
+    HEIC_SUPPORT = False
+
+# Longest edge in pixels: map popups, high-DPI popups, photo viewer
+THUMBNAIL_SIZES = (150, 400, 1600)
+DEFAULT_THUMBNAIL_SIZE = 400
+
+# Sizes rendered during ingest; 1600px is only rendered when the viewer asks for it
+INGEST_THUMBNAIL_SIZES = (150, 400)
+
+THUMBNAIL_QUALITY = 80
+
+# Part of every cache key and ETag; bump when the rendered output changes
+THUMBNAIL_VERSION = 1
+
+# Photos whose thumbnails are rendered between marker_data updates
+PREGENERATE_BATCH_SIZE = 200
+
+# RAW formats (as in process_photos); browsers and Pillow show their embedded JPEG previews
+RAW_EXTENSIONS = ('.dng', '.nef', '.cr2', '.arw')
+
+# EXIF orientation -> transpose that displays the image upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def thumbnail_key(photo_hash, size):
+    """Cache key and ETag of a thumbnail; identical photo contents share thumbnails"""
+    return f"{photo_hash}-{size}-v{THUMBNAIL_VERSION}"
+
+def thumbnail_cache_for_db(db_path, max_bytes=None):
+    """The thumbnail cache stored next to a database (data/thumbnails for data/photo_library.db)"""
+    root = os.path.join(os.path.dirname(os.path.abspath(db_path)), 'thumbnails')
+    return DiskCache(root, max_bytes or DEFAULT_CACHE_MAX_BYTES)
+
+def render_thumbnail(image_path, size):
+    """Render a JPEG whose longest edge is at most size pixels, honoring EXIF orientation
+
+    Raises:
+        OSError: if the file cannot be read or decoded (PIL.UnidentifiedImageError included)
+    """
+    orientation = None
+    source = image_path
+    if image_path.lower().endswith(RAW_EXTENSIONS):
+        preview = read_embedded_jpeg(image_path)
+        if preview is not None:
+            # Previews rarely carry their own orientation; the RAW file's IFD0 has it
+            source = io.BytesIO(preview)
+            orientation = (read_exif(image_path) or {}).get('orientation')
+
+    with Image.open(source) as img:
+        # Let the JPEG decoder downscale by 1/2..1/8 while decoding; a no-op for other formats
+        img.draft('RGB', (size, size))
+        if orientation in ORIENTATION_TRANSPOSE and not img.getexif().get(0x0112):
+            img = img.transpose(ORIENTATION_TRANSPOSE[orientation])
+        else:
+            img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size), Image.LANCZOS, reducing_gap=3.0)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True, progressive=size >= 1600)
+        return buffer.getvalue()
+
+def get_thumbnail(cache, photo_hash, image_path, size):
+    """Return the path of a cached thumbnail, rendering and storing it on a miss"""
+    return cache.get_or_create(thumbnail_key(photo_hash, size), lambda: render_thumbnail(image_path, size), '.jpg')
+
+def _render_photo_thumbnails(cache, photo_hash, image_path, sizes):
+    try:
+        for size in sizes:
+            get_thumbnail(cache, photo_hash, image_path, size)
+        return True
+    except Exception as e:
+        logger.debug(f"Could not render thumbnail for {image_path}: {e}")
+        return False
+
+def pregenerate_thumbnails(conn, cache, library_id=None, sizes=INGEST_THUMBNAIL_SIZES, max_workers=4):
+    """Render thumbnails for geotagged photos not yet marked has_thumbnail and set the flag
+
+    The flag tells clients a thumbnail is ready; /thumb still renders lazily
+    when an entry is missing (for example after eviction).
+
+    Returns:
+        Number of photos whose thumbnails were generated
+    """
+    sql = '''
+    SELECT id, path, hash FROM photos
+    WHERE hash IS NOT NULL AND latitude IS NOT NULL AND longitude IS NOT NULL
+      AND COALESCE(json_extract(marker_data, '$.has_thumbnail'), 0) = 0
+    '''
+    params = []
+    if library_id is not None:
+        sql += " AND library_id = ?"
+        params.append(library_id)
+    pending = conn.execute(sql, params).fetchall()
+    if not pending:
+        return 0
+
+    logger.info(f"Generating thumbnails for {len(pending)} photos")
+    generated = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(pending), PREGENERATE_BATCH_SIZE):
+            batch = pending[start:start + PREGENERATE_BATCH_SIZE]
+            rendered = executor.map(lambda row: _render_photo_thumbnails(cache, row[2], row[1], sizes), batch)
+            done = [(row[0],) for row, ok in zip(batch, rendered) if ok]
+            conn.executemany(
+                "UPDATE photos SET marker_data = json_set(COALESCE(marker_data, '{}'), '$.has_thumbnail', json('true')) WHERE id = ?",
+                done
+            )
+            conn.commit()
+            generated += len(done)
+    if generated < len(pending):
+        logger.info(f"Could not render thumbnails for {len(pending) - generated} photos")
+    return generated
@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+import logging
+
+# Make the project modules importable when run as `python tools/benchmark_dedup.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_photos
+from marker_queries import build_marker_filters, marker_query_sql
+
+# Share of photos that are copies of another photo (same filename and location, another library)
+DUPLICATE_SHARE = 0.1
+
+def create_database(db_path, rows, seed=0):
+    """Create a synthetic library of rows photos with the real schema"""
+    process_photos.ensure_database_tables(db_path)
+    conn = sqlite3.connect(db_path)
+    # The cluster and change log triggers maintain tables the benchmark does not read; skip them
+    # for a fast load. The dedup triggers stay, they fill the columns being measured.
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type='trigger' AND name NOT LIKE 'photos_dedup_%'").fetchall():
+        conn.execute(f"DROP TRIGGER {name}")
+    conn.executemany("INSERT INTO libraries (id, name) VALUES (?, ?)", [(1, 'Phone'), (2, 'Camera'), (3, 'Backup')])
+
+    rng = random.Random(seed)
+    centers = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(200)]
+    batch = []
+    originals = []
+    for i in range(rows):
+        if originals and rng.random() < DUPLICATE_SHARE:
+            filename, lat, lon = rng.choice(originals)
+            library_id = rng.randint(1, 3)
+        else:
+            center_lat, center_lon = rng.choice(centers)
+            filename = f"IMG_{i % 100000:05d}.JPG"
+            lat, lon = center_lat + rng.gauss(0, 0.5), center_lon + rng.gauss(0, 0.5)
+            library_id = rng.randint(1, 2)
+            if len(originals) < 100000:
+                originals.append((filename, lat, lon))
+        taken = f"{rng.randint(2005, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T12:00:00"
+        batch.append((filename, f"/photos/{i}/{filename}", lat, lon, taken, library_id, '{}'))
+        if len(batch) >= 10000:
+            conn.executemany('''INSERT INTO photos (filename, path, latitude, longitude, datetime, library_id, marker_data)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    if batch:
+        conn.executemany('''INSERT INTO photos (filename, path, latitude, longitude, datetime, library_id, marker_data)
+                            VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+
+def time_query(conn, sql, params, repeat):
+    """Return (best seconds, result ids) of a query over repeat runs"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(sql, params).fetchall()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, {row[0] for row in rows}
+
+def run_benchmark(sizes, repeat=3, directory=None):
+    """Compare the ROW_NUMBER marker query against the dedup_key anti-join"""
+    scenarios = [
+        ('all markers', {}),
+        ('viewport', {'bbox': (-10.0, 35.0, 30.0, 60.0)}),
+        ('one library', {'library_ids': [2]}),
+        ('date range', {'date_from': '2015-01-01T00:00:00', 'date_to': '2016-01-01T00:00:00'}),
+    ]
+    with tempfile.TemporaryDirectory(dir=directory) as temp_dir:
+        for rows in sizes:
+            db_path = os.path.join(temp_dir, f"bench_{rows}.db")
+            start = time.perf_counter()
+            create_database(db_path, rows)
+            print(f"\n{rows:,} photos (created in {time.perf_counter() - start:.1f} s)")
+
+            conn = sqlite3.connect(db_path)
+            for name, filters in scenarios:
+                where_sql, params = build_marker_filters(**filters)
+                duplicate_where_sql, duplicate_params = build_marker_filters(alias='d', **filters)
+                window_time, window_ids = time_query(conn, marker_query_sql(where_sql), params, repeat)
+                indexed_time, indexed_ids = time_query(
+                    conn, marker_query_sql(where_sql, duplicate_where_sql=duplicate_where_sql),
+                    params + duplicate_params, repeat)
+                speedup = window_time / indexed_time if indexed_time > 0 else 0
+                print(f"  {name:<12} {len(indexed_ids):>9,} markers  ROW_NUMBER {window_time * 1000:9.1f} ms  "
+                      f"dedup_key {indexed_time * 1000:9.1f} ms  ({speedup:.1f}x)")
+                if window_ids != indexed_ids:
+                    print(f"  WARNING: the queries disagree on {len(window_ids ^ indexed_ids)} photos")
+            conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark marker de-duplication: ROW_NUMBER against the dedup_key index')
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma-separated library sizes')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs per query (best is kept)')
+    parser.add_argument('--dir', default=None, help='Directory for the temporary databases (default: system temp)')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    run_benchmark([int(size) for size in args.sizes.split(',')], args.repeat, args.dir)
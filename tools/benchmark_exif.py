@@ -0,0 +1,97 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import logging
+
+# Make the project modules importable when run as `python tools/benchmark_exif.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import process_photos
+
+FORMAT_GROUPS = {
+    'JPEG': ('.jpg', '.jpeg'),
+    'HEIC': ('.heic',),
+    'DNG': ('.dng',),
+}
+
+def collect_files(root_dir, limit):
+    """Collect up to limit sample files per format group"""
+    groups = {name: [] for name in FORMAT_GROUPS}
+    for dirpath, _, filenames in os.walk(root_dir):
+        for filename in filenames:
+            lower = filename.lower()
+            for name, extensions in FORMAT_GROUPS.items():
+                if lower.endswith(extensions) and len(groups[name]) < limit:
+                    groups[name].append(os.path.join(dirpath, filename))
+    return groups
+
+def legacy_cascade(path):
+    """The original per-file extraction: Pillow, then piexif/exifread fallbacks, then a separate hash read"""
+    process_photos.extract_gps(path)
+    process_photos.extract_datetime(path)
+    process_photos.get_image_hash(path)
+
+def time_per_file(func, paths, repeat):
+    """Return per-file latencies in milliseconds (best of repeat runs for each file)"""
+    latencies = []
+    for path in paths:
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(path)
+            elapsed = (time.perf_counter() - start) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        latencies.append(best)
+    return latencies
+
+def summarize(latencies):
+    """Format mean/median/p95 latency for a list of millisecond timings"""
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return f"mean {statistics.mean(ordered):7.2f} ms  median {statistics.median(ordered):7.2f} ms  p95 {p95:7.2f} ms"
+
+def run_benchmark(root_dir, limit=200, repeat=3):
+    """Compare extract_metadata against the Pillow/piexif/exifread cascade"""
+    groups = collect_files(root_dir, limit)
+    for name, paths in groups.items():
+        if not paths:
+            print(f"{name}: no sample files found")
+            continue
+
+        metadata_times = time_per_file(process_photos.extract_metadata, paths, repeat)
+        legacy_times = time_per_file(legacy_cascade, paths, repeat)
+
+        speedup = statistics.mean(legacy_times) / statistics.mean(metadata_times) if statistics.mean(metadata_times) > 0 else 0
+        print(f"\n{name} ({len(paths)} files)")
+        print(f"  extract_metadata: {summarize(metadata_times)}")
+        print(f"  legacy cascade  : {summarize(legacy_times)}")
+        print(f"  speedup         : {speedup:.1f}x")
+
+        # Check the two approaches agree on coordinates
+        mismatches = missed = 0
+        for path in paths:
+            metadata = process_photos.extract_metadata(path)
+            lat, lon = process_photos.extract_gps(path)
+            if lat is None:
+                continue
+            if metadata['latitude'] is None:
+                missed += 1
+            elif abs(metadata['latitude'] - lat) > 1e-6 or abs(metadata['longitude'] - lon) > 1e-6:
+                mismatches += 1
+        if mismatches:
+            print(f"  WARNING: {mismatches} files returned different coordinates")
+        if missed:
+            print(f"  WARNING: {missed} files lost coordinates the legacy cascade found")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark extract_metadata against the Pillow/piexif/exifread cascade')
+    parser.add_argument('directory', help='Directory containing sample JPEG, HEIC and DNG files')
+    parser.add_argument('--limit', type=int, default=200, help='Maximum files per format')
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs per file (best is kept)')
+    args = parser.parse_args()
+
+    # Keep the extraction code's error logging out of the timings
+    logging.getLogger().setLevel(logging.CRITICAL)
+    run_benchmark(args.directory, args.limit, args.repeat)
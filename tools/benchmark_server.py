@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import gzip
+import json
+import argparse
+import itertools
+import threading
+import subprocess
+import http.client
+import urllib.parse
+import concurrent.futures
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server.py')
+
+# Extra server.py arguments per mode for --start
+SERVER_MODES = {
+    'dev': [],
+    'production': ['--production'],
+    'async': ['--async'],
+}
+
+HEIC_EXTENSIONS = ('.heic', '.heif')
+
+def wait_for_server(url, timeout=30.0):
+    """Poll /health until the server answers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            status, _ = fetch(url, '/health')
+            if status == 200:
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+def fetch(url, path, connection=None):
+    """GET path and return (status, body); reuses connection (keep-alive) when given"""
+    own = connection is None
+    if own:
+        parsed = urllib.parse.urlsplit(url)
+        connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+    try:
+        connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        if own:
+            connection.close()
+
+def heic_photo_ids(url):
+    """Ids of the HEIC photos on the map, the ones /convert has to decode"""
+    status, body = fetch(url, '/api/markers')
+    if status != 200:
+        return []
+    try:
+        body = gzip.decompress(body)
+    except OSError:
+        pass
+    photos = json.loads(body).get('photos', [])
+    return [photo['id'] for photo in photos if (photo.get('filename') or '').lower().endswith(HEIC_EXTENSIONS)]
+
+def endpoint_paths(url, endpoints, uncached):
+    """Endless iterators of request paths per endpoint name"""
+    paths = {}
+    if 'markers' in endpoints:
+        paths['markers'] = itertools.repeat('/api/markers')
+    if 'convert' in endpoints:
+        ids = heic_photo_ids(url)
+        if not ids:
+            print("No HEIC photos in the database, skipping /convert")
+        elif uncached:
+            # A different JPEG quality per request misses the conversion cache, so every request decodes
+            paths['convert'] = (f'/convert/{photo_id}?quality={quality}'
+                                for quality, photo_id in zip(itertools.cycle(range(50, 96)), itertools.cycle(ids)))
+        else:
+            paths['convert'] = (f'/convert/{photo_id}' for photo_id in itertools.cycle(ids))
+    return paths
+
+def run_client(url, paths, lock, stop_at, latencies, errors):
+    parsed = urllib.parse.urlsplit(url)
+    connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+    try:
+        while time.monotonic() < stop_at:
+            with lock:
+                path = next(paths)
+            start = time.perf_counter()
+            try:
+                status, _ = fetch(url, path, connection)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=60)
+                status = None
+            elapsed = time.perf_counter() - start
+            if status in (200, 304):
+                latencies.append(elapsed)
+            else:
+                errors.append(status)
+    finally:
+        connection.close()
+
+def run_load(url, paths, concurrency, duration):
+    """Run concurrency clients per endpoint at the same time; returns {endpoint: (latencies, errors)}"""
+    stop_at = time.monotonic() + duration
+    results = {name: ([], []) for name in paths}
+    locks = {name: threading.Lock() for name in paths}
+    with concurrent.futures.ThreadPoolExecutor(concurrency * len(paths)) as executor:
+        for name, endpoint_paths_iter in paths.items():
+            for _ in range(concurrency):
+                executor.submit(run_client, url, endpoint_paths_iter, locks[name], stop_at, *results[name])
+    return results
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+def report(results, duration):
+    for name, (latencies, errors) in results.items():
+        rate = len(latencies) / duration
+        print(f"  {name:<8} {rate:8.1f} req/s  p50 {percentile(latencies, 0.5) * 1000:8.1f} ms  "
+              f"p95 {percentile(latencies, 0.95) * 1000:8.1f} ms  p99 {percentile(latencies, 0.99) * 1000:8.1f} ms  "
+              f"max {max(latencies, default=0) * 1000:8.1f} ms  errors {len(errors)}")
+
+def run_benchmark(url, concurrency_levels, duration, endpoints, uncached):
+    paths = endpoint_paths(url, endpoints, uncached)
+    if not paths:
+        print("Nothing to benchmark")
+        return
+    # Warm-up: fills the marker cache and opens the database connections
+    run_load(url, paths, 1, min(2.0, duration))
+    for concurrency in concurrency_levels:
+        print(f"\n{concurrency} concurrent clients per endpoint ({', '.join(paths)}) for {duration:.0f} s")
+        report(run_load(url, paths, concurrency, duration), duration)
+
+def benchmark_started_servers(modes, port, server_args, concurrency_levels, duration, endpoints, uncached):
+    """Start server.py in each mode in turn and benchmark it"""
+    url = f"http://127.0.0.1:{port}"
+    for mode in modes:
+        command = [sys.executable, SERVER_SCRIPT, '--host', '127.0.0.1', '--port', str(port)] + \
+                  SERVER_MODES[mode] + server_args
+        print(f"\n=== {mode}: {' '.join(command[1:])}")
+        process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_for_server(url):
+                print(f"Server did not start in {mode} mode")
+                continue
+            run_benchmark(url, concurrency_levels, duration, endpoints, uncached)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load test /api/markers and /convert of a running or started server')
+    parser.add_argument('--url', default='http://localhost:8000', help='Server to test (ignored with --start)')
+    parser.add_argument('--start', help='Comma-separated modes to start and compare in turn: dev,production,async')
+    parser.add_argument('--port', type=int, default=8765, help='Port for servers started with --start')
+    parser.add_argument('--concurrency', default='1,8,32', help='Comma-separated client counts per endpoint')
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+    parser.add_argument('--endpoints', default='markers,convert', help='Comma-separated: markers,convert')
+    parser.add_argument('--uncached', action='store_true',
+                        help='Vary /convert quality so every request decodes instead of hitting the cache')
+    args, server_args = parser.parse_known_args()
+
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    endpoints = args.endpoints.split(',')
+    if args.start:
+        modes = args.start.split(',')
+        unknown = [mode for mode in modes if mode not in SERVER_MODES]
+        if unknown:
+            parser.error(f"Unknown mode(s): {', '.join(unknown)}")
+        benchmark_started_servers(modes, args.port, server_args, concurrency_levels, args.duration,
+                                  endpoints, args.uncached)
+    else:
+        run_benchmark(args.url, concurrency_levels, args.duration, endpoints, args.uncached)
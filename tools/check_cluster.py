@@ -3,6 +3,11 @@ import os
 import json
 import sys
 
+# Make the project modules importable when run as `python tools/check_cluster.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from marker_queries import bbox_condition, has_spatial_index
+
 def check_cluster_duplicates(lat=None, lon=None, filename=None, radius=0.0001):
     """Check for duplicate photos in a cluster based on coordinates or filename"""
     
@@ -21,13 +26,16 @@ def check_cluster_duplicates(lat=None, lon=None, filename=None, radius=0.0001):
     # Search by coordinates with a small radius if provided
     if lat is not None and lon is not None:
         print(f"Checking photos at coordinates: {lat}, {lon} (radius: {radius})")
-        cursor.execute("""
+        # Square around the point, looked up through the R*Tree index when the database has one
+        bbox = (lon - radius, lat - radius, lon + radius, lat + radius)
+        bbox_sql, bbox_params = bbox_condition(bbox, 'p.latitude', 'p.longitude',
+                                               'p.id' if has_spatial_index(conn) else None)
+        cursor.execute(f"""
             SELECT id, filename, path, library_id, latitude, longitude
-            FROM photos
-            WHERE latitude BETWEEN ? AND ?
-              AND longitude BETWEEN ? AND ?
+            FROM photos p
+            WHERE {bbox_sql}
             ORDER BY filename
-        """, (lat - radius, lat + radius, lon - radius, lon + radius))
+        """, bbox_params)
         
     # Or search by filename pattern if provided
     elif filename:
@@ -78,19 +86,18 @@ def check_cluster_duplicates(lat=None, lon=None, filename=None, radius=0.0001):
     print("\nChecking what would be returned by the API deduplication query:")
     
     if lat is not None and lon is not None:
-        cursor.execute("""
+        cursor.execute(f"""
             WITH RankedPhotos AS (
                 SELECT 
                     p.id, p.filename, p.path, p.latitude, p.longitude, p.library_id,
                     ROW_NUMBER() OVER(PARTITION BY p.filename, p.latitude, p.longitude ORDER BY p.id) as rn
                 FROM photos p
-                WHERE p.latitude BETWEEN ? AND ?
-                  AND p.longitude BETWEEN ? AND ?
+                WHERE {bbox_sql}
             )
             SELECT id, filename, path, library_id, latitude, longitude
             FROM RankedPhotos
             WHERE rn = 1
-        """, (lat - radius, lat + radius, lon - radius, lon + radius))
+        """, bbox_params)
     else:
         # Use the same subset of photos as above
         photo_ids = ",".join([str(row['id']) for row in rows])
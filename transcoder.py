@@ -0,0 +1,322 @@
+# Background transcoding of HEIC and RAW photos into cached, browser-viewable JPEGs
+import os
+import time
+import heapq
+import sqlite3
+import logging
+import datetime
+import itertools
+import threading
+import multiprocessing
+import concurrent.futures
+import concurrent.futures.process
+
+# fcntl lets one of several server processes own the backfill (not available on Windows)
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+from disk_cache import DiskCache
+from thumbnails import THUMBNAIL_SIZES, RAW_EXTENSIONS, thumbnail_key, get_thumbnail
+from image_conversion import get_converted_jpeg
+from marker_queries import build_marker_filters
+
+logger = logging.getLogger(__name__)
+
+# Formats browsers cannot display directly
+PREVIEW_EXTENSIONS = ('.heic', '.heif') + RAW_EXTENSIONS
+
+# Job priority levels (lower runs first): a request waiting on the result, photos in an area a
+# user is looking at, then everything else newest first
+PRIORITY_REQUEST = 0
+PRIORITY_VIEWPORT = 1
+PRIORITY_BACKFILL = 2
+
+# Seconds between scans for newly ingested photos
+BACKFILL_INTERVAL = 30.0
+
+# Photos queued per viewed area, newest first
+VIEWPORT_LIMIT = 200
+
+# Seconds a request waits for its job before answering 503 with Retry-After
+REQUEST_WAIT_SECONDS = 15.0
+
+# Runs of a job whose worker process died; a job that kills its worker again is failed
+MAX_JOB_ATTEMPTS = 2
+
+def needs_transcoding(path):
+    return path.lower().endswith(PREVIEW_EXTENSIONS)
+
+# Caches opened inside worker processes, reused across jobs so their size accounting persists
+_worker_caches = {}
+
+def _worker_cache(root, max_bytes):
+    cache = _worker_caches.get(root)
+    if cache is None:
+        cache = _worker_caches[root] = DiskCache(root, max_bytes)
+    return cache
+
+def render_thumbnails_job(cache_root, max_bytes, photo_hash, image_path, sizes=THUMBNAIL_SIZES):
+    """Worker job: render thumbnail sizes of a photo into the cache, in the given order"""
+    cache = _worker_cache(cache_root, max_bytes)
+    for size in sizes:
+        get_thumbnail(cache, photo_hash, image_path, size)
+    return True
+
+def convert_job(cache_root, max_bytes, photo_hash, image_path, quality, max_dimension):
+    """Worker job: convert a photo to JPEG into the conversion cache; returns the entry's path"""
+    return get_converted_jpeg(_worker_cache(cache_root, max_bytes), photo_hash, image_path, quality, max_dimension)
+
+class _Job:
+    __slots__ = ('priority', 'fn', 'args', 'future', 'started', 'attempts')
+
+    def __init__(self, priority, fn, args):
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.future = concurrent.futures.Future()
+        self.started = False
+        self.attempts = 0
+
+class TranscoderPool:
+    """A local process pool that runs jobs in priority order
+
+    Jobs are deduplicated by key: submitting a key that is already queued
+    returns the same future and, if the new priority is more urgent, moves the
+    job forward. Only as many jobs as there are workers are handed to the
+    process pool at a time, so a request can overtake a long backfill.
+    Decoding happens in the worker processes, never in the web server's threads.
+    A worker that dies (e.g. a decoder crash) breaks the process pool; it is
+    replaced and the jobs that were running are queued again, up to
+    MAX_JOB_ATTEMPTS runs each.
+    """
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or max(1, multiprocessing.cpu_count() - 1)
+        # Fork is unsafe in a threaded server; forkserver/spawn start workers from a clean process
+        methods = multiprocessing.get_all_start_methods()
+        self._context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self._executor = self._new_executor()
+        self._queue = []  # Heap of (priority, sequence, key); superseded entries are skipped
+        self._jobs = {}
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._slots = threading.Semaphore(self.max_workers)
+        self._closed = False
+        self._thread = threading.Thread(target=self._dispatch, name='transcoder-dispatch', daemon=True)
+        self._thread.start()
+
+    def submit(self, key, priority, fn, *args):
+        """Queue fn(*args) under key at priority (a tuple; smaller runs first) and return its future"""
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is None:
+                job = self._jobs[key] = _Job(priority, fn, args)
+            elif job.started or priority >= job.priority:
+                return job.future
+            job.priority = priority
+            heapq.heappush(self._queue, (priority, next(self._sequence), key))
+            self._cond.notify()
+            return job.future
+
+    def _new_executor(self):
+        return concurrent.futures.ProcessPoolExecutor(self.max_workers, mp_context=self._context)
+
+    def _replace_broken(self, executor):
+        """Swap in a new process pool if executor is the current one and has broken"""
+        with self._cond:
+            if self._closed or executor is not self._executor:
+                return
+            logger.warning("Transcoder worker died; restarting the process pool")
+            self._executor = self._new_executor()
+        executor.shutdown(wait=False)
+
+    def pending(self):
+        """Number of queued or running jobs"""
+        with self._cond:
+            return len(self._jobs)
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                priority, _, key = heapq.heappop(self._queue)
+                job = self._jobs.get(key)
+                if job is None or job.started or priority != job.priority:
+                    self._slots.release()
+                    continue
+                job.started = True
+                job.attempts += 1
+                executor = self._executor
+            try:
+                pool_future = executor.submit(job.fn, *job.args)
+            except concurrent.futures.process.BrokenProcessPool as e:
+                # Broke since the last job finished; retry on a new pool
+                self._replace_broken(executor)
+                self._finish(key, job, executor, error=e)
+                continue
+            except RuntimeError as e:  # Pool shut down
+                self._finish(key, job, executor, error=e)
+                continue
+            pool_future.add_done_callback(
+                lambda done, key=key, job=job, executor=executor: self._finish(key, job, executor, done)
+            )
+
+    def _finish(self, key, job, executor, pool_future=None, error=None):
+        self._slots.release()
+        if pool_future is not None:
+            if pool_future.cancelled():  # Pool shut down
+                with self._cond:
+                    self._jobs.pop(key, None)
+                job.future.cancel()
+                return
+            error = pool_future.exception()
+        if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+            self._replace_broken(executor)
+            with self._cond:
+                if job.attempts < MAX_JOB_ATTEMPTS and not self._closed:
+                    # Any of the running jobs may have killed the worker; each gets another run
+                    job.started = False
+                    heapq.heappush(self._queue, (job.priority, next(self._sequence), key))
+                    self._cond.notify()
+                    return
+        with self._cond:
+            self._jobs.pop(key, None)
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(pool_future.result())
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+def _preview_condition(alias='p'):
+    """SQL condition and parameters selecting photos in PREVIEW_EXTENSIONS"""
+    terms = ' OR '.join(f"lower({alias}.path) LIKE ?" for _ in PREVIEW_EXTENSIONS)
+    return f"({terms})", [f"%{extension}" for extension in PREVIEW_EXTENSIONS]
+
+def _recency(value):
+    """Sort key putting newer photos first (photos without a date last)"""
+    try:
+        return -datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+class PreviewScheduler(threading.Thread):
+    """Keeps the thumbnail cache filled for HEIC and RAW photos
+
+    Every BACKFILL_INTERVAL seconds, photos added since the last scan are queued
+    newest first. Areas users look at (note_viewport) are queued ahead of that.
+    When several server processes each run a scheduler, passing the same
+    backfill_lock path to all of them lets only the holder of that file lock
+    backfill; another process takes over if it exits.
+    """
+
+    def __init__(self, pool, db_path, thumbnail_cache, interval=BACKFILL_INTERVAL, backfill_lock=None):
+        super().__init__(name='preview-scheduler', daemon=True)
+        self.pool = pool
+        self.db_path = db_path
+        self.cache = thumbnail_cache
+        self.interval = interval
+        self._last_id = 0
+        self._viewport = None
+        self._wake = threading.Event()
+        self._stopped = False
+        self._backfill_lock = backfill_lock
+        self._lock_file = None
+
+    def note_viewport(self, bbox):
+        """Prioritize the photos inside bbox (west, south, east, north)"""
+        self._viewport = bbox
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def submit(self, photo_hash, path, priority, sizes=THUMBNAIL_SIZES):
+        """Queue thumbnail sizes of a photo (all by default); returns the job's future
+
+        A request passes only the size it waits for, so it does not also wait for
+        the larger ones; the backfill renders those.
+        """
+        key = f"thumbs:{photo_hash}" if tuple(sizes) == THUMBNAIL_SIZES else \
+            f"thumbs:{photo_hash}:{','.join(map(str, sizes))}"
+        return self.pool.submit(key, priority, render_thumbnails_job,
+                                self.cache.root, self.cache.max_bytes, photo_hash, path, tuple(sizes))
+
+    def _owns_backfill(self):
+        """Whether this process should backfill, taking the backfill lock if it is free"""
+        if self._backfill_lock is None or not HAS_FCNTL or self._lock_file is not None:
+            return True
+        os.makedirs(os.path.dirname(self._backfill_lock), exist_ok=True)
+        lock_file = open(self._backfill_lock, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held until the process exits
+        self._lock_file = lock_file
+        logger.info("Preview backfill runs in this process")
+        return True
+
+    def _is_cached(self, photo_hash):
+        return all(self.cache.get(thumbnail_key(photo_hash, size), '.jpg') for size in THUMBNAIL_SIZES)
+
+    def run(self):
+        next_backfill = 0.0
+        while not self._stopped:
+            self._wake.clear()
+            try:
+                conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=30.0)
+                try:
+                    bbox, self._viewport = self._viewport, None
+                    if bbox is not None:
+                        self._queue_viewport(conn, bbox)
+                    if time.monotonic() >= next_backfill and self._owns_backfill():
+                        self._backfill(conn)
+                        next_backfill = time.monotonic() + self.interval
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"Preview scheduling failed: {e}")
+            self._wake.wait(self.interval)
+
+    def _backfill(self, conn):
+        condition, params = _preview_condition()
+        rows = conn.execute(f'''
+        SELECT p.id, p.path, p.hash, p.datetime FROM photos p
+        WHERE p.id > ? AND p.hash IS NOT NULL AND {condition}
+        ''', [self._last_id] + params).fetchall()
+        queued = 0
+        for photo_id, path, photo_hash, taken in rows:
+            self._last_id = max(self._last_id, photo_id)
+            if not self._is_cached(photo_hash):
+                self.submit(photo_hash, path, (PRIORITY_BACKFILL, _recency(taken)))
+                queued += 1
+        if queued:
+            logger.info(f"Queued previews for {queued} HEIC/RAW photos")
+
+    def _queue_viewport(self, conn, bbox):
+        where_sql, params = build_marker_filters(bbox)
+        condition, extension_params = _preview_condition()
+        rows = conn.execute(f'''
+        SELECT p.path, p.hash FROM photos p
+        {where_sql} AND p.hash IS NOT NULL AND {condition}
+        ORDER BY p.datetime DESC LIMIT {VIEWPORT_LIMIT}
+        ''', params + extension_params).fetchall()
+        # Later viewports outrank earlier ones; within one, newest photos go first
+        priority = (PRIORITY_VIEWPORT, -time.time())
+        for path, photo_hash in rows:
+            if not self._is_cached(photo_hash):
+                self.submit(photo_hash, path, priority)